@@ -0,0 +1,94 @@
+"""Benchmark of the compression modes of ``todus.archive.write_archive()``.
+
+Random data, Python sources and shared libraries (taken from the running
+Python installation) are written in split archives with every mode of
+``todus.archive.COMPRESSIONS``, in 7z (if py7zr is installed) and zip. The
+throughput in MB/s of the input and the size ratio are printed.
+
+Usage, with todus installed (``pip install -e .``)::
+
+    python benchmarks/bench_compression.py [--size-mb 32] [--volume-mb 8]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import sysconfig
+import tempfile
+import time
+from typing import Iterator
+
+from todus import archive
+
+
+def read_files(pattern: str) -> Iterator[bytes]:
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        with open(path, "rb") as file:
+            yield file.read()
+
+
+def make_input(path: str, kind: str, size: int) -> None:
+    if kind == "random":
+        data = os.urandom(size)
+    else:
+        folder = sysconfig.get_paths()["stdlib"]
+        pattern = "**/*.py" if kind == "py sources" else "**/*.so"
+        chunks, total = [], 0
+        while total < size:
+            for chunk in read_files(os.path.join(folder, pattern)):
+                chunks.append(chunk)
+                total += len(chunk)
+                if total >= size:
+                    break
+            if not total:
+                sys.exit(f"No files found for {kind} in {folder}")
+        data = b"".join(chunks)[:size]
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--volume-mb", type=int, default=8)
+    parser.add_argument(
+        "--modes", nargs="+", default=archive.COMPRESSIONS, choices=archive.COMPRESSIONS
+    )
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    kinds = ("random", "py sources", ".so binaries")
+    formats = ("7z", "zip") if archive.HAS_7Z else ("zip",)
+    if archive.HAS_7Z:
+        archive._py7zr()  # not timing the import
+    with tempfile.TemporaryDirectory() as folder:
+        inputs = {}
+        for kind in kinds:
+            inputs[kind] = os.path.join(folder, kind.replace(" ", "_"))
+            make_input(inputs[kind], kind, size)
+        for ext in formats:
+            archive.ARCHIVE_EXT = ext
+            print(f"\n{ext:10}" + "".join(f"{kind:>16}" for kind in kinds))
+            for mode in args.modes:
+                row = f"{mode:10}"
+                for kind in kinds:
+                    volumes: list = []
+                    started = time.perf_counter()
+                    archive.write_archive(
+                        inputs[kind],
+                        os.path.join(folder, "out"),
+                        args.volume_mb * 1024 * 1024,
+                        volumes.append,
+                        mode,
+                    )
+                    elapsed = time.perf_counter() - started
+                    compressed = sum(os.path.getsize(path) for path in volumes)
+                    for path in volumes:
+                        os.remove(path)
+                    row += f"{size / elapsed / 1e6:9.1f} {compressed / size:.3f}"
+                print(row)
+
+
+if __name__ == "__main__":
+    main()
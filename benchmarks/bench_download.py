@@ -0,0 +1,104 @@
+"""Benchmark of the download streaming of ``todus.client.ToDusClient``.
+
+A file is served by ``http.server`` in another process on loopback and
+downloaded with ``download_file()`` using different block sizes, and with
+``iter_content(10)`` as the downloads were written before. The throughput and
+the CPU time of this process per GB are printed.
+
+Usage, with todus installed (``pip install -e .``)::
+
+    python benchmarks/bench_download.py [--size-mb 256]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from todus.client import ToDusClient
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(folder: str) -> tuple:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"],
+        cwd=folder,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def iter_content(url: str, path: str) -> None:
+    with requests.get(url, stream=True) as resp, open(path, "wb") as file:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(10):
+            file.write(chunk)
+
+
+def measure(name: str, download, size: int) -> None:
+    wall, cpu = time.perf_counter(), time.process_time()
+    download()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(f"{name:20} {size / wall / 1e6:7.1f} MB/s {cpu / size * 1e9:8.2f} CPU s/GB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument(
+        "--slow-size-mb", type=int, default=4, help="size for iter_content(10)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, size_mb in (
+            ("big.bin", args.size_mb),
+            ("small.bin", args.slow_size_mb),
+        ):
+            with open(os.path.join(folder, name), "wb") as file:
+                file.write(os.urandom(size_mb * 1024 * 1024))
+        server, base_url = start_server(folder)
+        out = os.path.join(folder, "out.bin")
+        try:
+            size = args.slow_size_mb * 1024 * 1024
+            measure(
+                "iter_content(10)",
+                lambda: iter_content(f"{base_url}/small.bin", out),
+                size,
+            )
+            size = args.size_mb * 1024 * 1024
+            for block_size in (16 * 1024, 256 * 1024):
+                client = ToDusClient(block_size=block_size)
+                measure(
+                    f"readinto {block_size // 1024} KiB",
+                    lambda: client.download_file(
+                        "token", "url", out, real_url=f"{base_url}/big.bin"
+                    ),
+                    size,
+                )
+                os.remove(out)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark of ``todus.xmpp.StanzaParser``.
+
+A stream of purl responses is parsed fed one stanza per read and in reads of
+16 KiB, and compared with the decode and regex match per read that was used
+before the incremental parser (which only worked when every read had exactly
+one stanza).
+
+Usage, with todus installed (``pip install -e .``)::
+
+    python benchmarks/bench_parser.py [--stanzas 100000]
+"""
+
+import argparse
+import re
+import time
+from typing import Callable, List
+
+from todus.xmpp import StanzaParser, _parse_purl
+
+STANZA = (
+    "<iq o='5355555555@im.todus.cu/x' t='result' i='AbCdE-{n}'>"
+    "<query xmlns='todus:purl' put='https://s3.todus.cu/put/{n}?a=1&amp;b=ñ'"
+    " get='https://s3.todus.cu/get/{n}' status='200'/></iq>"
+)
+_PURL = re.compile(r".*put='(.*)' get='(.*)' stat.*")
+
+
+def parse_stanzas(reads: List[bytes]) -> int:
+    parser = StanzaParser()
+    count = 0
+    for data in reads:
+        for stanza in parser.feed(data):
+            _parse_purl(stanza)
+            count += 1
+    return count
+
+
+def match_regex(reads: List[bytes]) -> int:
+    count = 0
+    for data in reads:
+        match = _PURL.match(data.decode())
+        assert match
+        match.group(1).replace("amp;", "")
+        count += 1
+    return count
+
+
+def measure(name: str, func: Callable[[List[bytes]], int], reads: List[bytes]) -> None:
+    started = time.perf_counter()
+    count = func(reads)
+    elapsed = time.perf_counter() - started
+    print(f"{name:24} {count / elapsed / 1000:7.1f}k stanzas/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--stanzas", type=int, default=100000)
+    args = parser.parse_args()
+
+    stanzas = [STANZA.format(n=n).encode() for n in range(args.stanzas)]
+    data = b"".join(stanzas)
+    chunks = [data[i : i + 16 * 1024] for i in range(0, len(data), 16 * 1024)]
+    measure("parser, stanza per read", parse_stanzas, stanzas)
+    measure("parser, 16 KiB reads", parse_stanzas, chunks)
+    measure("regex, stanza per read", match_regex, stanzas)
+
+
+if __name__ == "__main__":
+    main()
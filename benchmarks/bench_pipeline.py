@@ -0,0 +1,132 @@
+"""Benchmark of the URL reservations pipelined over one XMPP session.
+
+A local fake XMPP server answers every IQ after ``--delay`` seconds and the
+reservations are requested by a growing number of threads sharing one
+``todus.xmpp.XMPPSession`` (with ``max_queries`` set to the threads), the
+reservations per second should grow with the threads.
+
+Usage, with todus installed (``pip install -e .``)::
+
+    python benchmarks/bench_pipeline.py [--delay 0.05] [--queries 64]
+
+``openssl`` is needed to create the certificate of the fake server.
+"""
+
+import argparse
+import base64
+import json
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from todus import xmpp
+
+HEADER = (
+    b"<?xml version='1.0'?><stream:stream i='abc' v='1.0' xml:lang='en'"
+    b" xmlns:stream='x1' f='im.todus.cu' xmlns='jc'>"
+)
+PHONE = "5355555555"
+
+
+def make_token() -> str:
+    payload = json.dumps({"username": PHONE, "exp": 9999999999}).encode()
+    return f"eyJhbGciOiJIUzI1NiJ9.{base64.urlsafe_b64encode(payload).decode()}.sig"
+
+
+def make_cert(folder: str) -> tuple:
+    cert, key = os.path.join(folder, "cert.pem"), os.path.join(folder, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert, key
+
+
+def serve(conn: ssl.SSLSocket, delay: float) -> None:
+    """Handle a client of the fake server, the IQ responses are sent from
+    timers so they are answered concurrently."""
+    lock = threading.Lock()
+
+    def send(data: bytes) -> None:
+        with lock:
+            conn.sendall(data)
+
+    parser = xmpp.StanzaParser()
+    authenticated = False
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            return
+        for stanza in parser.feed(data):
+            if stanza.tag == "stream:stream":
+                features = b"<b1 xmlns='x4'/>" if authenticated else b"<es/>"
+                send(HEADER + b"<stream:features>" + features + b"</stream:features>")
+            elif stanza.tag == "ah":
+                authenticated = True
+                send(b"<ok xmlns='x2'/>")
+            elif stanza.tag == "en":
+                send(b"<ed u='true' max='300' i='x'/>")
+            elif stanza.tag == "iq" and stanza.find("b1") is not None:
+                send(f"<iq t='result' i='{stanza.attrs['i']}'/>".encode())
+            elif stanza.tag == "iq":
+                iq_id = stanza.attrs["i"]
+                response = (
+                    f"<iq t='result' i='{iq_id}'><query xmlns='todus:purl'"
+                    f" put='https://s3.todus.cu/put/{iq_id}'"
+                    f" get='https://s3.todus.cu/get/{iq_id}' status='200'/></iq>"
+                )
+                threading.Timer(delay, send, (response.encode(),)).start()
+
+
+def start_server(cert: str, key: str, delay: float) -> int:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+
+    def accept() -> None:
+        while True:
+            conn, _ = server.accept()
+            conn = context.wrap_socket(conn, server_side=True)
+            threading.Thread(target=serve, args=(conn, delay), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--delay", type=float, default=0.05, help="IQ latency")
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        cert, key = make_cert(folder)
+        # the fake server's certificate is the only trusted one
+        os.environ["SSL_CERT_FILE"] = cert
+        xmpp._HOST = ("127.0.0.1", start_server(cert, key, args.delay))
+        token = make_token()
+        print(f"{args.queries} reservations, {args.delay * 1000:.0f} ms per IQ")
+        for workers in args.workers:
+            session = xmpp.XMPPSession(token, max_queries=workers)
+            session.reserve_url(1, 0)  # connect
+            with ThreadPoolExecutor(workers) as pool:
+                started = time.perf_counter()
+                list(pool.map(lambda _: session.reserve_url(1, 0), range(args.queries)))
+                elapsed = time.perf_counter() - started
+            session.close()
+            print(f"{workers:3} workers: {args.queries / elapsed:7.1f} reservations/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark of the startup of the ``todus`` command line.
+
+Every subcommand is run without accounts (the commands that connect stop
+before connecting) with ``-X importtime``. The time spent importing modules,
+the sum of the top-level entries, is printed, the median of a few runs. The
+exit status is 1 if a command that doesn't connect exceeds ``--threshold-ms``.
+
+``-X importtime`` needs Python 3.7 or later.
+
+Usage, with todus installed (``pip install -e .``)::
+
+    python benchmarks/bench_startup.py [--runs 7] [--threshold-ms 150]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+COMMANDS = (
+    ("usage", [], False),
+    ("--version", ["--version"], False),
+    ("accounts", ["accounts"], False),
+    ("stats", ["stats"], False),
+    ("upload -h", ["upload", "--help"], False),
+    ("download -h", ["download", "--help"], False),
+    ("login", ["login"], True),
+    ("token", ["token"], True),
+    ("upload", ["upload", "file"], True),
+    ("download", ["download", "url"], True),
+    ("verify", ["verify", "txt"], True),
+)
+RUN_COMMAND = """
+import sys
+sys.argv = ["todus"] + sys.argv[1:]
+from todus.main import main
+try:
+    main()
+except (SystemExit, EOFError):
+    pass
+"""
+
+
+def import_time(home: str, argv: List[str]) -> float:
+    """Get the seconds spent importing modules by the command line."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUN_COMMAND, *argv],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(os.environ, HOME=home),
+        check=True,
+    )
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # the top-level imports are not indented
+        if name[1] != " ":
+            total += int(cumulative)
+    return total / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--threshold-ms", type=float, default=150)
+    args = parser.parse_args()
+    if sys.version_info < (3, 7):
+        sys.exit("-X importtime needs Python 3.7 or later")
+
+    failed = False
+    with tempfile.TemporaryDirectory() as home:
+        for name, argv, connects in COMMANDS:
+            median = statistics.median(
+                import_time(home, argv) for _ in range(args.runs)
+            )
+            over = not connects and median * 1000 > args.threshold_ms
+            failed |= over
+            print(f"{name:12} {median * 1000:6.1f} ms{'  SLOW' if over else ''}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
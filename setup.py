@@ -56,6 +56,7 @@ if __name__ == "__main__":
             "test": load_requirements("requirements/requirements-test.txt"),
             "dev": load_requirements("requirements/requirements-dev.txt"),
             "7z": load_requirements("requirements/requirements-7z.txt"),
+            "async": load_requirements("requirements/requirements-async.txt"),
         },
         entry_points={"console_scripts": ["todus = todus.main:main"]},
     )
@@ -0,0 +1,76 @@
+import os
+import random
+
+import pytest
+
+from todus import archive
+
+VOLUME = 10_000
+
+
+@pytest.fixture
+def data() -> bytes:
+    rand = random.Random(0)
+    return bytes(rand.getrandbits(8) for _ in range(5 * VOLUME + 123))
+
+
+@pytest.mark.parametrize("ext", ["zip", "7z"])
+def test_roundtrip(tmp_path, monkeypatch, data: bytes, ext: str) -> None:
+    if ext == "7z" and not archive.HAS_7Z:
+        pytest.skip("py7zr is not installed")
+    monkeypatch.setattr(archive, "ARCHIVE_EXT", ext)
+    src = tmp_path / "file.bin"
+    src.write_bytes(data)
+    sealed: list = []
+    archive.write_archive(
+        str(src), str(tmp_path / "file"), VOLUME, sealed.append, "store"
+    )
+    volumes = sorted(str(path) for path in tmp_path.glob(f"file.{ext}.*"))
+    assert sorted(sealed) == volumes
+    # the first volume is sealed on close, after the archive header is rewritten
+    assert sealed[-2:] == volumes[:1] + volumes[-1:]
+    assert all(os.path.getsize(path) == VOLUME for path in volumes[:-1])
+
+    archive.extract_archive(str(tmp_path / f"file.{ext}"), str(tmp_path / "out"))
+    assert (tmp_path / "out" / "file.bin").read_bytes() == data
+    assert not list(tmp_path.glob(f"file.{ext}.*"))
+
+
+def test_pipelined_volumes(tmp_path) -> None:
+    sealed: list = []
+    basename = str(tmp_path / "vol")
+    with archive.PipelinedVolumes(basename, 4, sealed.append) as vol:
+        assert vol.write(b"0123456789") == 10
+        assert sealed == [f"{basename}.0002"]
+        vol.seek(1)
+        vol.write(b"ab")
+        vol.seek(5)
+        with pytest.raises(ValueError):
+            vol.write(b"x")
+    assert sealed == [f"{basename}.0002", f"{basename}.0001", f"{basename}.0003"]
+    assert [open(path, "rb").read() for path in sorted(sealed)] == [
+        b"0ab3",
+        b"4567",
+        b"89",
+    ]
+
+
+def test_consuming_volumes(tmp_path) -> None:
+    basename = str(tmp_path / "vol")
+    for number, chunk in enumerate([b"0123", b"4567", b"89"], 1):
+        with open(f"{basename}.{number:04d}", "wb") as file:
+            file.write(chunk)
+    with archive.ConsumingVolumes(basename) as vol:
+        vol.seek(-2, 2)
+        assert vol.read() == b"89"
+        # not read from its start
+        vol.seek(5)
+        assert vol.read(3) == b"567"
+        assert os.path.exists(f"{basename}.0002")
+        # the first volume is consumed after the archive signature
+        vol.seek(2)
+        assert vol.read(2) == b"23"
+        assert not os.path.exists(f"{basename}.0001")
+        assert vol.read(100) == b"456789"
+        assert not os.path.exists(f"{basename}.0002")
+    assert os.path.exists(f"{basename}.0003")
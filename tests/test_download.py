@@ -0,0 +1,95 @@
+import asyncio
+import gzip
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from todus.client import ToDusClient
+
+BODY = b"todus " * 100_000
+
+
+class Handler(BaseHTTPRequestHandler):
+    # "gzip" encodes the body whatever the client accepts
+    encoding = "identity"
+    received: list = []
+
+    def do_GET(self) -> None:  # noqa
+        self.received.append(dict(self.headers))
+        body = gzip.compress(BODY) if self.encoding == "gzip" else BODY
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.encoding == "gzip":
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self) -> None:  # noqa
+        self.received.append(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    Handler.received = []
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/file"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip"])
+def test_download_file(tmp_path, monkeypatch, server: str, encoding: str) -> None:
+    monkeypatch.setattr(Handler, "encoding", encoding)
+    path = tmp_path / "file"
+    client = ToDusClient(block_size=4096)
+    size = client.download_file("token", "url", str(path), real_url=server)
+    assert Handler.received[0]["Accept-Encoding"] == "identity"
+    assert path.read_bytes() == BODY
+    assert size == len(BODY)
+    assert len(Handler.received) == 1
+
+
+class ThreadRecordingFile(io.BytesIO):
+    threads: set = set()
+
+    def read(self, size: int = -1) -> bytes:
+        self.threads.add(threading.current_thread())
+        return super().read(size)
+
+
+def test_async_transfers(tmp_path, server: str) -> None:
+    aio = pytest.importorskip("todus.aio")
+    pytest.importorskip("aiohttp")
+    path = tmp_path / "file"
+    data = ThreadRecordingFile(BODY)
+
+    async def transfer() -> int:
+        async with aio.AsyncToDusClient(block_size=4096) as client:
+            url = await client.upload_file(
+                "token", data, len(BODY), urls=(server, "down")
+            )
+            assert url == "down"
+            return await client.download_file(
+                "token", "url", str(path), real_url=server
+            )
+
+    loop = asyncio.new_event_loop()
+    try:
+        size = loop.run_until_complete(transfer())
+    finally:
+        loop.close()
+    assert Handler.received[0] == BODY
+    # the file was read in the executor, not in the event loop
+    assert threading.current_thread() not in ThreadRecordingFile.threads
+    assert path.read_bytes() == BODY
+    assert size == len(BODY)
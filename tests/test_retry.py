@@ -0,0 +1,126 @@
+import pytest
+import requests
+
+from todus.client import RetryPolicy
+from todus.errors import AuthenticationError, RetryBudgetExceeded, TokenExpiredError
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def _policy(clock: FakeClock, random: float = 1.0, **kwargs) -> RetryPolicy:
+    return RetryPolicy(clock=clock, sleep=clock.sleep, random=lambda: random, **kwargs)
+
+
+def _http_error(status: int) -> requests.exceptions.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+def test_delay_full_jitter() -> None:
+    clock = FakeClock()
+    for attempt in range(5):
+        assert _policy(clock, random=0.0, base_delay=2).delay(attempt) == 0
+        assert _policy(clock, random=0.5, base_delay=2).delay(attempt) == 2 ** attempt
+        assert (
+            _policy(clock, random=1.0, base_delay=2).delay(attempt) == 2 * 2 ** attempt
+        )
+
+
+def test_delay_max_delay() -> None:
+    policy = _policy(FakeClock(), base_delay=1, max_delay=10)
+    assert [policy.delay(attempt) for attempt in range(6)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_retries_limit() -> None:
+    clock = FakeClock()
+    policy = _policy(clock, base_delay=1, retries=3)
+    attempts = []
+
+    def func(attempt: int) -> None:
+        attempts.append(attempt)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        policy.call(func)
+    assert attempts == [0, 1, 2, 3]
+    assert clock.sleeps == [1, 2, 4]
+
+
+def test_budget() -> None:
+    clock = FakeClock()
+    policy = _policy(clock, base_delay=1, budget=10)
+    # the wait of the retry number 3 (8s) would end after 15s
+    assert policy.next_delay(0, 0.0) == 1
+    clock.now = 7.0
+    with pytest.raises(RetryBudgetExceeded):
+        policy.next_delay(3, 0.0)
+
+    attempts = []
+
+    def func(attempt: int) -> None:
+        attempts.append(attempt)
+        raise ConnectionError("down")
+
+    clock.now = 0.0
+    with pytest.raises(ConnectionError):
+        policy.call(func)
+    assert clock.sleeps == [1, 2, 4]
+    assert attempts == [0, 1, 2, 3]
+
+
+def test_call_refresh() -> None:
+    clock = FakeClock()
+    policy = _policy(clock, base_delay=1)
+    refreshed = []
+
+    def func(attempt: int) -> str:
+        if not refreshed:
+            raise TokenExpiredError()
+        return f"done after {attempt} retries"
+
+    assert policy.call(func, lambda: refreshed.append(True)) == "done after 1 retries"
+
+
+def test_call_fail_fast() -> None:
+    clock = FakeClock()
+    policy = _policy(clock)
+
+    def func(_attempt: int) -> None:
+        raise _http_error(404)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        policy.call(func)
+    assert not clock.sleeps
+
+
+@pytest.mark.parametrize(
+    "err,action",
+    [
+        (_http_error(404), RetryPolicy.FAIL),
+        (_http_error(400), RetryPolicy.FAIL),
+        (_http_error(401), RetryPolicy.REFRESH),
+        (_http_error(403), RetryPolicy.REFRESH),
+        (_http_error(429), RetryPolicy.RETRY),
+        (_http_error(500), RetryPolicy.RETRY),
+        (_http_error(503), RetryPolicy.RETRY),
+        (TokenExpiredError(), RetryPolicy.REFRESH),
+        (AuthenticationError(), RetryPolicy.FAIL),
+        (requests.exceptions.ConnectionError(), RetryPolicy.RETRY),
+        (requests.exceptions.ReadTimeout(), RetryPolicy.RETRY),
+        (ConnectionResetError(), RetryPolicy.RETRY),
+    ],
+)
+def test_classify(err: Exception, action: str) -> None:
+    assert RetryPolicy.classify(err) == action
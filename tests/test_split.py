@@ -0,0 +1,26 @@
+import os
+
+from todus import split
+
+
+def test_split_ranges() -> None:
+    assert split.split_ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert split.split_ranges(0, 4) == [(0, 0)]
+
+
+def test_rewritten_source(tmp_path) -> None:
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"a" * 300_000)
+    manifest = split.new_manifest(str(path), 100_000)
+    assert split.is_same_source(manifest, split.new_manifest(str(path), 100_000))
+    assert not split.is_same_source(manifest, split.new_manifest(str(path), 50_000))
+
+    # rewritten in place with the same size and modification time
+    stat = os.stat(path)
+    path.write_bytes(b"b" * 300_000)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert not split.is_same_source(manifest, split.new_manifest(str(path), 100_000))
+
+    # manifests written before the fingerprint was added are not reused
+    old = {key: manifest[key] for key in ("name", "size", "part_size", "parts")}
+    assert not split.is_same_source(old, manifest)
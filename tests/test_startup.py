@@ -0,0 +1,75 @@
+import subprocess
+import sys
+
+import pytest
+
+# the modules only needed by the commands that use them, see todus.main
+LAZY_MODULES = {"requests", "tqdm", "py7zr"}
+# the package metadata is only read for --version, see todus.get_version()
+METADATA_MODULES = {"importlib.metadata", "pkg_resources"}
+# run a command line and print the modules imported
+RUN_COMMAND = """
+import sys
+sys.argv = ["todus"] + sys.argv[1:]
+from todus.main import main
+try:
+    main()
+except (SystemExit, EOFError):
+    pass
+print(" ".join(sys.modules))
+"""
+
+
+def _imported_modules(home: str, *argv: str) -> set:
+    """Get the modules imported by the todus command line with the given
+    arguments, without accounts."""
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_COMMAND, *argv],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(HOME=home, PYTHONPATH=":".join(sys.path)),
+        check=True,
+    )
+    return set(result.stdout.splitlines()[-1].split())
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        (),
+        ("accounts",),
+        ("stats",),
+        ("login", "--help"),
+        ("upload", "--help"),
+        ("download", "--help"),
+        ("verify", "--help"),
+        ("token", "--help"),
+    ],
+)
+def test_offline_commands(tmp_path, argv: tuple) -> None:
+    modules = _imported_modules(str(tmp_path), *argv)
+    assert not modules & (LAZY_MODULES | METADATA_MODULES)
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ("login",),
+        ("token",),
+        ("upload", "file"),
+        ("download", "url"),
+        ("verify", "txt"),
+    ],
+)
+def test_connecting_commands(tmp_path, argv: tuple) -> None:
+    # without accounts they stop before connecting, the client is imported
+    modules = _imported_modules(str(tmp_path), *argv)
+    assert "requests" in modules
+    assert not modules & ({"tqdm", "py7zr"} | METADATA_MODULES)
+
+
+def test_version(tmp_path) -> None:
+    modules = _imported_modules(str(tmp_path), "--version")
+    assert modules & METADATA_MODULES
+    assert not modules & LAZY_MODULES
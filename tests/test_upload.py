@@ -0,0 +1,72 @@
+import logging
+from threading import Lock
+
+import requests
+
+from todus import main
+from todus.client import RetryPolicy
+from todus.jobs import JobJournal
+from todus.metrics import Metrics
+from todus.pool import ClientPool
+from todus.progress import TransferProgress
+from todus.scheduler import Attempt, _Transfer
+
+
+class FakeClient:
+    phone_number = "5355555555"
+    logger = logging.getLogger(__name__)
+    metrics = Metrics()
+
+    def __init__(self) -> None:
+        self.sleeps: list = []
+        self.retry_policy = RetryPolicy(sleep=self.sleeps.append, retries=3)
+        self.on_upload = None
+
+    def upload_file(self, data, size: int, urls=None, progress=None) -> str:
+        if self.on_upload:
+            on_upload, self.on_upload = self.on_upload, None
+            on_upload()
+            raise requests.exceptions.ConnectionError("connection reset")
+        progress(len(data.read()))
+        return "https://s3.todus.cu/get/file"
+
+
+def test_speculative_upload_original_wins(tmp_path) -> None:
+    (tmp_path / "file.7z.0001").write_bytes(b"todus" * 1000)
+    client = FakeClient()
+    journal = JobJournal(str(tmp_path / "jobs"))
+    txt_path = tmp_path / "file.txt"
+    uploaded: list = []
+    transfer = _Transfer(lambda attempt: None, 5000)
+    original, copy = Attempt(transfer, False), Attempt(transfer, True)
+    transfer.attempts = [original, copy]
+    results = []
+    with open(txt_path, "w", encoding="utf-8") as txt:
+
+        def upload(attempt: Attempt) -> bool:
+            return main._upload_task(
+                "file.7z.0001",
+                ("https://s3.todus.cu/put/file", "https://s3.todus.cu/get/file"),
+                attempt,
+                folder=str(tmp_path),
+                uploaded=uploaded,
+                pool=ClientPool([client]),  # type: ignore
+                source=client,  # type: ignore
+                progress=TransferProgress(),
+                txt_file=txt,
+                lock=Lock(),
+                job=journal.open("split-upload", "file", "fingerprint"),
+            )
+
+        # the copy fails while the original finishes and removes the volume
+        client.on_upload = lambda: results.append(upload(original))
+        results.append(upload(copy))
+    journal.close()
+
+    assert results == [True, False]
+    assert copy.cancelled
+    # the cancelled copy was not retried
+    assert not client.sleeps
+    assert uploaded == ["file.7z.0001"]
+    assert len(txt_path.read_text().splitlines()) == 1
+    assert not (tmp_path / "file.7z.0001").exists()
@@ -0,0 +1,112 @@
+import json
+import random
+from base64 import urlsafe_b64encode
+
+import pytest
+
+from todus.xmpp import StanzaParser, _is_newer_token, _parse_gurl, _parse_purl
+
+# a recorded session: negotiation, purl/gurl responses, a message and the end
+# of the stream, with entities and multi-byte UTF-8 in attributes and text
+TRANSCRIPT = (
+    "<?xml version='1.0'?><stream:stream i='abc' v='1.0' xml:lang='en'"
+    " xmlns:stream='x1' f='im.todus.cu' xmlns='jc'>"
+    "<stream:features><es xmlns='x2'><e>PLAIN</e><e>X-OAUTH2</e></es>"
+    "<register xmlns='http://jabber.org/features/iq-register'/></stream:features>"
+    "<ok xmlns='x2'/>"
+    "<?xml version='1.0'?><stream:stream i='abd' v='1.0' xml:lang='en'"
+    " xmlns:stream='x1' f='im.todus.cu' xmlns='jc'>"
+    "<stream:features><b1 xmlns='x4'/><session xmlns='x5'/></stream:features>"
+    "<iq t='result' i='AbCdE-1'><b1 xmlns='x4'><jid>5355555555@im.todus.cu/x</jid>"
+    "</b1></iq>"
+    "<ed u='true' max='300' i='x'/>  "
+    + "".join(
+        f"<iq o='5355555555@im.todus.cu/x' t='result' i='AbCdE-{n}'>"
+        f"<query xmlns='todus:purl' put='https://s3.todus.cu/put/{n}?a=1&amp;b=ñ'"
+        f" get='https://s3.todus.cu/get/{n}' status='200'/></iq>"
+        for n in range(2, 20)
+    )
+    + "<iq o='5355555555@im.todus.cu/x' t='result' i='AbCdE-20'>"
+    "<query xmlns='todus:gurl' du='https://s3.todus.cu/get/ü?x=&quot;1&quot;'"
+    " status='200'/></iq>"
+    "<message f='x' i='m1'><body>héllo &lt;b&gt; 🎉</body></message>"
+    "</stream:stream>"
+).encode()
+
+
+def _parse(chunks: list) -> tuple:
+    parser = StanzaParser()
+    stanzas = []
+    for chunk in chunks:
+        stanzas += parser.feed(chunk)
+    return [(s.tag, s.attrs, s.children, s.raw) for s in stanzas], parser
+
+
+def _split(data: bytes, offsets: list) -> list:
+    bounds = [0] + sorted(offsets) + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+EXPECTED, _ = _parse([TRANSCRIPT])
+
+
+def test_whole_transcript() -> None:
+    parser = StanzaParser()
+    stanzas = parser.feed(TRANSCRIPT)
+    assert parser.closed
+    assert [stanza.tag for stanza in stanzas[:7]] == [
+        "stream:stream",
+        "stream:features",
+        "ok",
+        "stream:stream",
+        "stream:features",
+        "iq",
+        "ed",
+    ]
+    assert _parse_purl(stanzas[7]) == (
+        "https://s3.todus.cu/put/2?a=1&b=ñ",
+        "https://s3.todus.cu/get/2",
+    )
+    assert _parse_gurl(stanzas[-2]) == 'https://s3.todus.cu/get/ü?x="1"'
+    assert stanzas[-1].raw.decode().endswith("🎉</body></message>")
+
+
+def test_byte_by_byte() -> None:
+    stanzas, parser = _parse([TRANSCRIPT[i : i + 1] for i in range(len(TRANSCRIPT))])
+    assert stanzas == EXPECTED
+    assert parser.closed
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_splits(seed: int) -> None:
+    rand = random.Random(seed)
+    offsets = rand.sample(range(1, len(TRANSCRIPT)), rand.randint(1, 80))
+    stanzas, parser = _parse(_split(TRANSCRIPT, offsets))
+    assert stanzas == EXPECTED
+    assert parser.closed
+
+
+@pytest.mark.parametrize("text", ["&amp;", "&quot;", "ñ", "ü", "🎉"])
+def test_splits_inside(text: str) -> None:
+    # every split point inside the entities and multi-byte characters
+    encoded = text.encode()
+    start = TRANSCRIPT.index(encoded)
+    while start != -1:
+        for offset in range(start + 1, start + len(encoded)):
+            stanzas, _ = _parse(_split(TRANSCRIPT, [offset]))
+            assert stanzas == EXPECTED
+        start = TRANSCRIPT.find(encoded, start + 1)
+
+
+def _token(phone: str, exp: float) -> str:
+    payload = json.dumps({"username": phone, "exp": exp}).encode()
+    return "eyJhbGciOiJIUzI1NiJ9." + urlsafe_b64encode(payload).decode() + ".sig"
+
+
+def test_is_newer_token() -> None:
+    old, new = _token("5355555555", 1000), _token("5355555555", 2000)
+    assert _is_newer_token(new, old)
+    assert not _is_newer_token(old, new)
+    assert not _is_newer_token(old, old)
+    # another account
+    assert _is_newer_token(_token("5355555556", 1000), new)
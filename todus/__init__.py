@@ -1,7 +1,38 @@
-from pkg_resources import DistributionNotFound, get_distribution
+import sys
+import types
+from functools import lru_cache
 
-try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    # package is not installed
-    __version__ = "0.0.0.dev0-unknown"
+
+@lru_cache(maxsize=None)
+def get_version() -> str:
+    """Get the version of the installed package.
+
+    The metadata modules are slow to import, they are only imported here
+    and not when the package is.
+    """
+    # pylint: disable=C0415
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # Python < 3.8
+        from pkg_resources import DistributionNotFound, get_distribution
+
+        PackageNotFoundError = DistributionNotFound  # type: ignore
+
+        def version(distribution_name: str) -> str:  # type: ignore
+            return get_distribution(distribution_name).version
+
+    try:
+        return version(__name__)
+    except PackageNotFoundError:
+        # package is not installed
+        return "0.0.0.dev0-unknown"
+
+
+class _Package(types.ModuleType):
+    # a module __getattr__ (PEP 562) needs Python 3.7
+    @property
+    def __version__(self) -> str:
+        return get_version()
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,654 @@
+"""Asyncio ToDus client.
+
+Requires ``aiohttp``, install it with ``pip install todus[async]``.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import ssl
+import string
+import time
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Union,
+)
+
+from .client import (
+    FileType,
+    Progress,
+    RetryPolicy,
+    UploadData,
+    _download_headers,
+    _login_data,
+    _UploadStream,
+)
+from .errors import AuthenticationError, EndOfStreamError, RetryBudgetExceeded
+from .util import generate_token
+from .xmpp import (
+    _BUFFERSIZE,
+    _HOST,
+    _STREAM_START,
+    Stanza,
+    StanzaParser,
+    _feed,
+    _gurl_query,
+    _is_newer_token,
+    _negotiation_reply,
+    _parse_gurl,
+    _parse_purl,
+    _parse_token,
+    _purl_query,
+)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # type: ignore
+
+AsyncUploadData = Union[UploadData, AsyncIterator[bytes]]
+
+
+class AsyncXMPPSession:
+    """Persistent XMPP session over asyncio streams.
+
+    Works like ``todus.xmpp.XMPPSession``: queries are pipelined over a
+    single stream (at most ``max_queries`` at once) and the stream is
+    reopened when it breaks.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        max_queries: int = 8,
+        timeout: float = 15,
+        keepalive: float = 60,
+        logger: logging.Logger = logging,  # type: ignore
+    ) -> None:
+        self.token = token
+        self.max_queries = max_queries
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.logger = logger
+        self.phone, self._authstr = _parse_token(token)
+        self._sid = generate_token(5)
+        self._ids = itertools.count(1)
+        self._queries = asyncio.Semaphore(max_queries)
+        self._lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._last_activity = 0.0
+        self._closed = False
+        self._read_task: Optional[asyncio.Future] = None
+        self._keepalive_task: Optional[asyncio.Future] = None
+
+    @property
+    def connected(self) -> bool:
+        """True if the XMPP stream is open."""
+        return self._writer is not None
+
+    def _next_id(self) -> str:
+        return f"{self._sid}-{next(self._ids)}"
+
+    async def _send(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        async with self._send_lock:
+            writer.write(data)
+            await writer.drain()
+            self._last_activity = time.monotonic()
+
+    async def _connect(self) -> None:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(*_HOST, ssl=context), self.timeout
+        )
+        parser = StanzaParser()
+        try:
+            await self._send(writer, _STREAM_START)
+            await asyncio.wait_for(
+                self._negotiate(reader, writer, parser), self.timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+        self.logger.debug("XMPP session started for %s", self.phone)
+
+        self._writer = writer
+        self._pending = {}
+        self._read_task = asyncio.ensure_future(
+            self._read_loop(reader, writer, parser, self._pending)
+        )
+        if not self._keepalive_task:
+            self._keepalive_task = asyncio.ensure_future(self._keepalive_loop())
+
+    async def _negotiate(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        parser: StanzaParser,
+    ) -> None:
+        """Authenticate and bind the stream."""
+        bind_id = self._next_id()
+        while True:
+            for stanza in _feed(parser, await reader.read(_BUFFERSIZE)):
+                reply = _negotiation_reply(
+                    stanza, self._authstr, bind_id, self._next_id
+                )
+                if reply:
+                    await self._send(writer, reply)
+                if stanza.tag == "ed":
+                    return
+
+    def _disconnect(self, writer: asyncio.StreamWriter) -> None:
+        """Close the given stream if it is still the active connection."""
+        if self._writer is writer:
+            self._writer = None
+            writer.close()
+
+    async def _read_loop(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        parser: StanzaParser,
+        pending: Dict[str, asyncio.Future],
+    ) -> None:
+        try:
+            while True:
+                for stanza in _feed(parser, await reader.read(_BUFFERSIZE)):
+                    if stanza.tag != "iq":
+                        continue
+                    future = pending.pop(stanza.attrs.get("i", ""), None)
+                    if future and not future.done():
+                        future.set_result(stanza)
+        except Exception as err:  # noqa
+            self._disconnect(writer)
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(err)
+            pending.clear()
+
+    async def _keepalive_loop(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.keepalive / 2)
+            writer = self._writer
+            idle = time.monotonic() - self._last_activity
+            if not writer or idle < self.keepalive:
+                continue
+            try:
+                await self._send(writer, b" ")
+            except OSError as err:
+                self.logger.debug("XMPP keepalive failed: %s", err)
+                self._disconnect(writer)
+
+    async def close(self, wait: bool = False) -> None:
+        """Close the XMPP stream and stop sending keepalives.
+
+        If ``wait`` is ``True`` the queries in flight get their responses (or
+        time out) before the stream is closed.
+        """
+        acquired = 0
+        if wait:
+            # every query in flight holds a slot until it is done
+            deadline = time.monotonic() + self.timeout
+            try:
+                while acquired < self.max_queries:
+                    await asyncio.wait_for(
+                        self._queries.acquire(), max(deadline - time.monotonic(), 0)
+                    )
+                    acquired += 1
+            except asyncio.TimeoutError:
+                pass
+        self._closed = True
+        for _ in range(acquired):
+            self._queries.release()
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+        writer = self._writer
+        if writer:
+            try:
+                await self._send(writer, b"</stream:stream>")
+            except OSError:
+                pass
+            self._disconnect(writer)
+        if self._read_task:
+            self._read_task.cancel()
+
+    async def query(self, query: str) -> Stanza:
+        """Send an IQ with the given query and return the server's response.
+
+        If the stream is broken it is reopened and the query is retried once.
+        If there is no response in ``timeout`` seconds ``TimeoutError`` is
+        raised, the stream is kept open for the other queries. If the token
+        is rejected ``TokenExpiredError`` is raised, to refresh it.
+        """
+        try:
+            return await self._query(query)
+        except TimeoutError:
+            raise
+        except (EndOfStreamError, OSError) as err:
+            self.logger.debug("XMPP session lost, reconnecting: %r", err)
+            return await self._query(query)
+
+    async def query_many(self, queries: Iterable[str]) -> AsyncIterator[Stanza]:
+        """Send the given queries back-to-back and yield the responses in order.
+
+        Up to ``max_queries`` queries are sent ahead of the response being
+        yielded, failed queries are retried like in ``query()``.
+        """
+        window: deque = deque()
+        try:
+            for query in queries:
+                if len(window) >= self.max_queries:
+                    yield await window.popleft()
+                window.append(asyncio.ensure_future(self.query(query)))
+            while window:
+                yield await window.popleft()
+        finally:
+            for future in window:
+                future.cancel()
+
+    async def _query(self, query: str) -> Stanza:
+        if self._closed:
+            raise EndOfStreamError()
+        async with self._queries:
+            if self._closed:  # closed while waiting for a slot
+                raise EndOfStreamError()
+            async with self._lock:
+                if not self._writer:
+                    await self._connect()
+                assert self._writer
+                writer = self._writer
+                pending = self._pending
+            iq_id = self._next_id()
+            future = asyncio.get_event_loop().create_future()
+            pending[iq_id] = future
+            try:
+                try:
+                    await self._send(
+                        writer, f"<iq i='{iq_id}' t='get'>{query}</iq>".encode()
+                    )
+                except OSError:
+                    self._disconnect(writer)
+                    raise
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError as err:
+                # only this query fails, the stream is closed on read errors
+                raise TimeoutError(f"No response to IQ {iq_id!r}") from err
+            finally:
+                pending.pop(iq_id, None)
+
+    async def reserve_url(self, filesize: int, file_type: int) -> tuple:
+        """Reserve an upload URL, returns an (upload URL, download URL) tuple."""
+        return _parse_purl(await self.query(_purl_query(filesize, file_type)))
+
+    async def reserve_urls(
+        self, sizes: Iterable[int], file_type: int
+    ) -> AsyncIterator[tuple]:
+        """Reserve upload URLs for files of the given sizes.
+
+        The (upload URL, download URL) tuples are yielded in the same order.
+        """
+        queries = (_purl_query(size, file_type) for size in sizes)
+        async for response in self.query_many(queries):
+            yield _parse_purl(response)
+
+    async def resolve_url(self, url: str) -> str:
+        """Get the signed download URL of the given file URL."""
+        return _parse_gurl(await self.query(_gurl_query(url)))
+
+    async def resolve_urls(self, urls: Iterable[str]) -> AsyncIterator[str]:
+        """Get the signed download URLs of the given file URLs, in the same order."""
+        async for response in self.query_many(_gurl_query(url) for url in urls):
+            yield _parse_gurl(response)
+
+
+class AsyncToDusClient:
+    """Asyncio version of ``todus.client.ToDusClient``.
+
+    The XMPP queries are pipelined over a persistent asyncio stream and the
+    HTTP transfers share an ``aiohttp`` connection pool of at most
+    ``max_connections`` connections, so many transfers can run concurrently
+    in a single thread.
+    """
+
+    def __init__(
+        self,
+        version_name: str = "0.40.29",
+        version_code: str = "21833",
+        logger: logging.Logger = logging,  # type: ignore
+        max_queries: int = 8,
+        block_size: int = 256 * 1024,
+        retry_policy: RetryPolicy = None,
+        max_connections: int = 100,
+    ) -> None:
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is needed, install todus[async]")
+        self.version_name = version_name
+        self.version_code = version_code
+        self.logger = logger
+        self.max_queries = max_queries
+        self.block_size = block_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.max_connections = max_connections
+        self._xmpp: Optional[AsyncXMPPSession] = None
+        self._closing: set = set()
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        """HTTP session, created on first use inside the event loop."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(sock_connect=30, sock_read=30),
+                headers={"Accept-Encoding": "gzip"},
+            )
+        return self._session
+
+    async def _get_session(self, token: str) -> AsyncXMPPSession:
+        """Get the XMPP session, it is only replaced by a newer token since
+        other tasks may still use an older one. The queries in flight in the
+        replaced session are completed before it is closed."""
+        old = self._xmpp
+        if old is not None and not _is_newer_token(token, old.token):
+            return old
+        session = AsyncXMPPSession(
+            token, max_queries=self.max_queries, logger=self.logger
+        )
+        self._xmpp = session
+        if old is not None:
+            task = asyncio.ensure_future(old.close(wait=True))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        return session
+
+    async def close(self) -> None:
+        """Close the XMPP session and the HTTP connections."""
+        if self._xmpp is not None:
+            await self._xmpp.close()
+            self._xmpp = None
+        if self._closing:
+            await asyncio.gather(*self._closing)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncToDusClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @property
+    def auth_ua(self) -> str:
+        """User Agent used for authentication."""
+        return f"ToDus {self.version_name} Auth"
+
+    @property
+    def upload_ua(self) -> str:
+        """User Agent used for uploads."""
+        return f"ToDus {self.version_name} HTTP-Upload"
+
+    @property
+    def download_ua(self) -> str:
+        """User Agent used for downloads."""
+        return f"ToDus {self.version_name} HTTP-Download"
+
+    async def login(self, phone_number: str, password: str) -> str:
+        """Login with phone number and password to get an access token.
+
+        Transient errors are retried with the ``retry_policy``.
+        """
+        headers = {
+            "Host": "auth.todus.cu",
+            "user-agent": self.auth_ua,
+            "content-type": "application/x-protobuf",
+        }
+        data = _login_data(phone_number, password, self.version_code)
+        url = "https://auth.todus.cu/v2/auth/token"
+
+        async def post(_attempt: int) -> str:
+            async with self.session.post(url, data=data, headers=headers) as resp:
+                if resp.status == 403:
+                    raise AuthenticationError()
+                resp.raise_for_status()
+                text = await resp.text(encoding="latin-1")
+                return "".join([c for c in text if c in string.printable])
+
+        return await retry_call(self.retry_policy, post, on_retry=self._on_retry)
+
+    def _on_retry(self, err: Exception, _attempt: int) -> None:
+        self.logger.exception(err)
+
+    async def reserve_urls(
+        self, token: str, sizes: Iterable[int], file_type: FileType = FileType.VOICE
+    ) -> AsyncIterator[tuple]:
+        """Reserve upload URLs for files of the given sizes.
+
+        The (upload URL, download URL) tuples are yielded in the same order
+        as the sizes as soon as they arrive.
+        """
+        session = await self._get_session(token)
+        async for urls in session.reserve_urls(sizes, int(file_type)):
+            yield urls
+
+    async def resolve_urls(self, token: str, urls: Iterable[str]) -> AsyncIterator[str]:
+        """Get the real download URLs of the given file URLs.
+
+        The URLs are yielded in the same order as soon as they arrive.
+        """
+        session = await self._get_session(token)
+        async for url in session.resolve_urls(urls):
+            yield url
+
+    async def upload_file(
+        self,
+        token: str,
+        data: AsyncUploadData,
+        size: int = None,
+        file_type: FileType = FileType.VOICE,
+        urls: tuple = None,
+        progress: Progress = None,
+    ) -> str:
+        """Upload data and return the download URL.
+
+        ``data`` can be bytes, a binary file object, an iterable or an
+        asynchronous iterable of bytes chunks, for all but bytes ``size`` is
+        required.
+
+        ``urls`` is an (upload URL, download URL) tuple previously returned by
+        ``reserve_urls()``, if not given a new URL is reserved.
+
+        ``progress(size)`` is called with the size of every chunk sent.
+
+        Transient errors are retried with the ``retry_policy`` if the data can
+        be sent again: bytes or a seekable file object. Rejected tokens (HTTP
+        401/403) are not retried, see ``retry_call()``.
+        """
+        if size is None:
+            assert isinstance(data, (bytes, bytearray)), "size needed to stream data"
+            size = len(data)
+        if urls:
+            up_url, down_url = urls
+        else:
+            session = await self._get_session(token)
+            up_url, down_url = await session.reserve_url(size, int(file_type))
+        headers = {
+            "User-Agent": self.upload_ua,
+            "Authorization": f"Bearer {token}",
+            "Content-Length": str(size),
+        }
+        seekable = getattr(data, "seekable", None)
+        start = data.tell() if seekable and seekable() else None  # type: ignore
+
+        async def put(attempt: int) -> str:
+            if attempt and start is not None:
+                data.seek(start)  # type: ignore
+            body = _aiter_upload(data, size, self.block_size, progress) if size else b""
+            async with self.session.put(up_url, data=body, headers=headers) as resp:
+                resp.raise_for_status()
+            return down_url
+
+        if start is None and not isinstance(data, (bytes, bytearray)):
+            return await put(0)
+        return await retry_call(self.retry_policy, put, on_retry=self._on_retry)
+
+    async def download_file(
+        self,
+        token: str,
+        url: str,
+        path: str,
+        real_url: str = None,
+        progress: Progress = None,
+    ) -> int:
+        """Download file URL.
+
+        ``real_url`` is the URL previously returned by ``resolve_urls()`` for
+        the given file URL, if not given the URL is resolved.
+
+        ``progress(size)`` is called with the size of every chunk received.
+
+        Returns the file size.
+        """
+        temp_path = f"{path}.part"
+        if not real_url:
+            session = await self._get_session(token)
+            real_url = await session.resolve_url(url)
+        headers = _download_headers(self.download_ua, token)
+        loop = asyncio.get_event_loop()
+        with open(temp_path, "ab") as file:
+            size = await self._download_range(real_url, headers, file, progress)
+        await loop.run_in_executor(None, os.rename, temp_path, path)
+        return size
+
+    async def _download_range(
+        self, url: str, headers: dict, file, progress: Progress = None
+    ) -> int:
+        """Download into the file from its current position, interrupted
+        transfers are resumed. Errors that are not transient (see
+        ``retry_call()``) are raised. Returns the file size.
+
+        The chunks are written in the default executor, not to block the
+        event loop."""
+        loop = asyncio.get_event_loop()
+        headers = dict(headers)
+        size = -1
+        pos = file.tell()
+        attempt = 0
+        started = self.retry_policy.clock()
+        while pos < size or size == -1:
+            if pos:
+                headers["Range"] = f"bytes={pos}-"
+            try:
+                async with self.session.get(url, headers=headers) as resp:
+                    resp.raise_for_status()
+                    # aiohttp decodes encoded bodies, their size is known at the end
+                    encoding = resp.headers.get("Content-Encoding", "identity")
+                    encoded = encoding.lower() != "identity"
+                    if not encoded:
+                        size = pos + int(resp.headers["Content-Length"])
+                    async for chunk in resp.content.iter_chunked(self.block_size):
+                        await loop.run_in_executor(None, file.write, chunk)
+                        if progress:
+                            progress(len(chunk))
+                    if encoded:
+                        size = file.tell()
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as err:
+                self.logger.exception(err)
+                # bodies cut mid-stream (ClientPayloadError) are resumed,
+                # rejected tokens and HTTP 4xx errors are raised
+                if _classify(err) != RetryPolicy.RETRY:
+                    raise
+                if file.tell() > pos:  # progress, start backoff over
+                    attempt, started = 0, self.retry_policy.clock()
+                try:
+                    delay = self.retry_policy.next_delay(attempt, started)
+                except RetryBudgetExceeded:
+                    raise err from None
+                await asyncio.sleep(delay)
+                attempt += 1
+            pos = file.tell()
+        return size
+
+
+async def retry_call(
+    policy: RetryPolicy,
+    func: Callable[[int], Awaitable[Any]],
+    refresh: Callable[[], Awaitable[None]] = None,
+    on_retry: Callable[[Exception, int], None] = None,
+) -> Any:
+    """Asyncio version of ``todus.client.RetryPolicy.call()``.
+
+    Await ``func(attempt)`` retrying it on errors, they are classified like
+    ``RetryPolicy.classify()`` does with the ``aiohttp`` errors too: the
+    ``refresh()`` coroutine function is awaited before retrying if the token
+    was rejected (HTTP 401/403), HTTP 4xx errors are not retried.
+    """
+    started = policy.clock()
+    for attempt in itertools.count():
+        try:
+            return await func(attempt)
+        except Exception as err:  # pylint: disable=W0703
+            action = _classify(err)
+            if action == RetryPolicy.FAIL or (
+                action == RetryPolicy.REFRESH and not refresh
+            ):
+                raise
+            if on_retry:
+                on_retry(err, attempt)
+            try:
+                delay = policy.next_delay(attempt, started)
+            except RetryBudgetExceeded:
+                raise err from None
+            await asyncio.sleep(delay)
+            if action == RetryPolicy.REFRESH and refresh:
+                await refresh()
+    raise AssertionError("unreachable")
+
+
+def _classify(err: Exception) -> str:
+    """Like ``RetryPolicy.classify()``, with the HTTP errors of ``aiohttp``."""
+    if isinstance(err, aiohttp.ClientResponseError):
+        if err.status in (401, 403):
+            return RetryPolicy.REFRESH
+        if 400 <= err.status < 500 and err.status not in (408, 425, 429):
+            return RetryPolicy.FAIL
+        return RetryPolicy.RETRY
+    return RetryPolicy.classify(err)
+
+
+async def _aiter_upload(
+    data: AsyncUploadData, size: int, block_size: int, progress: Progress = None
+) -> AsyncIterator[bytes]:
+    """Stream the upload data in chunks of at most ``block_size`` bytes.
+
+    Files and iterables are read in the default executor, not to block the
+    event loop.
+    """
+    if hasattr(data, "__aiter__"):
+        async for chunk in data:  # type: ignore
+            yield chunk
+            if progress:
+                progress(len(chunk))
+    elif isinstance(data, (bytes, bytearray)):
+        for chunk in _UploadStream(data, size, block_size, progress):
+            yield chunk
+    else:
+        loop = asyncio.get_event_loop()
+        chunks = iter(_UploadStream(data, size, block_size))  # type: ignore
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+            if progress:
+                progress(len(chunk))
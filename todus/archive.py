@@ -0,0 +1,342 @@
+"""Split archives support."""
+
+import bisect
+import importlib.util
+import io
+import os
+import re
+import sys
+import warnings
+import zipfile
+import zlib
+from typing import BinaryIO, Callable, List, Optional
+
+# py7zr is slow to import, it is only imported when an archive is written or
+# extracted, see _py7zr()
+HAS_7Z = importlib.util.find_spec("py7zr") is not None
+ARCHIVE_EXT = "7z" if HAS_7Z else "zip"
+HAS_ZSTD = importlib.util.find_spec("pyzstd") is not None
+COMPRESSIONS = ("auto", "store", "fast", "deflate", "lzma")
+_SAMPLES = 8
+_SAMPLE_SIZE = 64 * 1024
+
+
+class PipelinedVolumes(io.RawIOBase):
+    """Multi-volume file writer that reports every volume as soon as it is
+    sealed.
+
+    The data is split in volumes of ``volume`` bytes named
+    ``<basename>.0001``, ``<basename>.0002``, etc. A volume is sealed when the
+    writing moves past it, except the first volume that is sealed when the
+    file is closed since the archive formats rewrite their header at the
+    start of the file when they are closed. Writing into a sealed volume
+    raises ``ValueError``.
+
+    ``on_sealed`` is called with the path of each sealed volume, it may block
+    to stop the writer until there is room for more volumes.
+    """
+
+    def __init__(
+        self, basename: str, volume: int, on_sealed: Callable[[str], None]
+    ) -> None:
+        super().__init__()
+        self.name = basename
+        self.volume = volume
+        self._on_sealed = on_sealed
+        self._files: List[BinaryIO] = []
+        self._sealed: set = set()
+        self._position = 0
+        self._size = 0
+        self._add_volume()
+
+    def _add_volume(self) -> None:
+        self._files.append(open(_volume_path(self.name, len(self._files)), "wb"))
+        if len(self._files) > 2:
+            self._seal(len(self._files) - 2)
+
+    def _seal(self, index: int) -> None:
+        if index not in self._sealed:
+            self._sealed.add(index)
+            self._files[index].close()
+            self._on_sealed(_volume_path(self.name, index))
+
+    def write(self, data) -> int:  # type: ignore
+        view = memoryview(data).cast("B")
+        written = 0
+        while written < len(view):
+            index, offset = divmod(self._position, self.volume)
+            while index >= len(self._files):
+                self._add_volume()
+            file = self._files[index]
+            if file.closed:
+                raise ValueError(f"Volume {index + 1} of {self.name} is sealed")
+            if file.tell() != offset:
+                file.seek(offset)
+            count = file.write(view[written : written + self.volume - offset])
+            written += count
+            self._position += count
+        self._size = max(self._size, self._position)
+        return written
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def flush(self) -> None:
+        super().flush()
+        for file in self._files:
+            if not file.closed:
+                file.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            for file in self._files:
+                file.close()
+        for index in range(len(self._files)):
+            self._seal(index)
+
+
+class ConsumingVolumes(io.RawIOBase):
+    """Multi-volume file reader that deletes every volume once it was read.
+
+    The volumes are the files named ``<basename>.<number>``, in the order of
+    their numbers, see ``volumes``. A volume is consumed when it was read
+    sequentially up to its end, from its start or, for the first volume,
+    after the archive signature. The last volume is not deleted since the
+    archive formats keep their header there. Seeking back into a consumed
+    volume is not supported.
+    """
+
+    def __init__(self, basename: str) -> None:
+        super().__init__()
+        self.name = basename
+        self.volumes = _glob_volumes(basename)
+        if not self.volumes:
+            raise FileNotFoundError(f"No volumes of {basename}")
+        self._offsets = [0]
+        for path in self.volumes:
+            self._offsets.append(self._offsets[-1] + os.path.getsize(path))
+        self._position = 0
+        self._run_start = 0
+        self._index = -1
+        self._file: Optional[BinaryIO] = None
+
+    def _open(self, index: int) -> BinaryIO:
+        file = self._file
+        if self._index != index or file is None:
+            self._close_volume()
+            file = self._file = open(self.volumes[index], "rb")
+            self._index = index
+        return file
+
+    def _close_volume(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        view = memoryview(buffer).cast("B")
+        count = 0
+        while count < len(view):
+            index = bisect.bisect_right(self._offsets, self._position) - 1
+            if index >= len(self.volumes):
+                break
+            file = self._open(index)
+            offset = self._position - self._offsets[index]
+            if file.tell() != offset:
+                file.seek(offset)
+            end = self._offsets[index + 1]
+            size = file.readinto(view[count : count + end - self._position])  # type: ignore
+            if not size:
+                break
+            count += size
+            self._position += size
+            if (
+                self._position == end
+                and index < len(self.volumes) - 1
+                and (index == 0 or self._run_start <= self._offsets[index])
+            ):
+                self._close_volume()
+                os.remove(self.volumes[index])
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._offsets[-1]
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        if offset != self._position:
+            self._run_start = offset
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+    def readable(self) -> bool:
+        return not self.closed
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self._close_volume()
+        super().close()
+
+
+def _volume_path(basename: str, index: int) -> str:
+    return f"{basename}.{index + 1:04d}"
+
+
+def _glob_volumes(basename: str) -> List[str]:
+    directory, prefix = os.path.split(basename)
+    prefix += "."
+    numbers = {
+        int(name[len(prefix) :]): name
+        for name in os.listdir(directory or ".")
+        if name.startswith(prefix) and name[len(prefix) :].isdigit()
+    }
+    return [os.path.join(directory, numbers[number]) for number in sorted(numbers)]
+
+
+def volumes_basename(name: str) -> Optional[str]:
+    """Get the archive name of the given volume name, if it is a volume.
+
+    For example ``file.7z`` for ``file.7z.0001``.
+    """
+    match = re.fullmatch(r"(.+\.(?:7z|zip))\.\d+", name)
+    return match.group(1) if match else None
+
+
+def extract_archive(basename: str, path: str = ".") -> None:
+    """Extract a split archive deleting each volume once it was read.
+
+    ``basename`` is the archive name without the volume number, for example
+    ``file.7z`` for the ``file.7z.0001``, ``file.7z.0002``, etc. volumes.
+    The archive is extracted into the folder ``path``.
+    """
+    with ConsumingVolumes(basename) as vol:
+        volumes = vol.volumes
+        if basename.endswith(".7z"):
+            if not HAS_7Z:
+                raise RuntimeError("py7zr is needed to extract 7z archives")
+            with _py7zr().SevenZipFile(vol, "r") as archive:
+                archive.extractall(path)
+        else:
+            with zipfile.ZipFile(vol) as archive:  # type: ignore
+                archive.extractall(path)
+    for volume in volumes:
+        if os.path.exists(volume):
+            os.remove(volume)
+
+
+def is_compressible(path: str, threshold: float = 0.95) -> bool:
+    """Estimate if the given file is worth compressing.
+
+    A few samples spread over the file are compressed with the fastest zlib
+    level, the file is considered compressible if they shrink below
+    ``threshold`` of their size. Already compressed media (video, images,
+    APKs, etc.) doesn't.
+    """
+    size = os.path.getsize(path)
+    step = max(size // _SAMPLES, _SAMPLE_SIZE)
+    original = compressed = 0
+    with open(path, "rb") as file:
+        for offset in range(0, size, step):
+            file.seek(offset)
+            sample = file.read(_SAMPLE_SIZE)
+            original += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+    return compressed < original * threshold
+
+
+def _py7zr():
+    import py7zr  # pylint: disable=C0415
+
+    return py7zr
+
+
+def _7z_filters(compression: str, level: Optional[int]) -> Optional[List[dict]]:
+    py7zr = _py7zr()
+    if compression == "store":
+        return [{"id": py7zr.FILTER_COPY}]
+    if compression == "deflate":
+        return [{"id": py7zr.FILTER_DEFLATE}]
+    if compression == "lzma":
+        return [{"id": py7zr.FILTER_LZMA2, "preset": 7 if level is None else level}]
+    if compression == "fast":
+        if HAS_ZSTD:
+            return [{"id": py7zr.FILTER_ZSTD, "level": level or 1}]
+        return [{"id": py7zr.FILTER_LZMA2, "preset": level or 0}]
+    return None
+
+
+def _zip_options(compression: str, level: Optional[int]) -> dict:
+    if compression == "store":
+        return dict(compression=zipfile.ZIP_STORED)
+    if compression == "lzma":
+        return dict(compression=zipfile.ZIP_LZMA)
+    if sys.version_info < (3, 7):
+        # zipfile has no compresslevel before Python 3.7
+        if level is not None:
+            warnings.warn("Compression level ignored, it needs Python 3.7")
+        return dict(compression=zipfile.ZIP_DEFLATED)
+    if compression == "fast":
+        return dict(compression=zipfile.ZIP_DEFLATED, compresslevel=level or 1)
+    return dict(compression=zipfile.ZIP_DEFLATED, compresslevel=level)
+
+
+def write_archive(
+    path: str,
+    basename: str,
+    part_size: int,
+    on_sealed: Callable[[str], None],
+    compression: str = "auto",
+    level: Optional[int] = None,
+) -> None:
+    """Compress the given file in a split archive.
+
+    The volumes are named ``<basename>.<ARCHIVE_EXT>.0001``,
+    ``<basename>.<ARCHIVE_EXT>.0002``, etc. and ``on_sealed`` is called with
+    the path of each volume once it is complete.
+
+    ``compression`` is one of ``COMPRESSIONS``: ``store`` doesn't compress,
+    ``fast`` uses the fastest codec available, ``deflate`` and ``lzma`` use
+    those codecs and ``auto`` stores the file if it is not compressible
+    (see ``is_compressible()``) or uses the archive format default otherwise.
+    ``level`` is the compression level or preset of the codec, if supported.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "auto":
+        compression = "store" if not is_compressible(path) else ""
+    filename = os.path.basename(path)
+    with PipelinedVolumes(f"{basename}.{ARCHIVE_EXT}", part_size, on_sealed) as vol:
+        if ARCHIVE_EXT == "7z":
+            filters = _7z_filters(compression, level)
+            with _py7zr().SevenZipFile(vol, "w", filters=filters) as archive:
+                archive.write(path, filename)
+        else:
+            with zipfile.ZipFile(vol, "w", **_zip_options(compression, level)) as archive:  # type: ignore
+                archive.write(path, filename)
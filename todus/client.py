@@ -1,25 +1,53 @@
 import functools
+import hashlib
+import itertools
 import json
 import logging
 import os
-import re
-import socket
-import ssl
+import random
 import string
 import time
-from base64 import b64decode, b64encode
-from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
 from http.client import IncompleteRead
-from threading import Lock
-from typing import Callable, Generator
+from threading import Lock, Thread
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import requests.exceptions
-
-from .errors import AuthenticationError, EndOfStreamError, TokenExpiredError
+import urllib3.exceptions
+
+from .dedup import UploadCache, content_sha256
+from .errors import (
+    AuthenticationError,
+    ChecksumError,
+    RetryBudgetExceeded,
+    TokenExpiredError,
+    TransferCancelled,
+)
+from .metrics import Metrics
+from .ratelimit import RateLimiter
+from .tokens import TokenCache
+from .transport import ConnectionStats, PoolAdapter, SocketOption
 from .util import generate_token
+from .xmpp import XMPPSession, _is_newer_token
+
+_MIN_SEGMENT = 1024 * 1024
 
-_BUFFERSIZE = 1024 * 1024
+UploadData = Union[bytes, BinaryIO, Iterable[bytes]]
+Progress = Callable[[int], None]
+T = TypeVar("T")
 
 
 class FileType(IntEnum):
@@ -34,6 +62,111 @@ class FileType(IntEnum):
     PROFILE_THUMBNAIL = 6
 
 
+class RetryPolicy:
+    """Retry policy with exponential backoff, jitter and a retry budget.
+
+    The wait before the retry number ``n`` (starting at 0) is a random time
+    between 0 and ``min(max_delay, base_delay * 2 ** n)``, so clients failing
+    at the same time don't retry in lockstep. An operation is abandoned after
+    ``retries`` retries or when retrying would exceed ``budget`` seconds since
+    it started (``None`` means no limit).
+
+    ``clock``, ``sleep`` and ``random`` can be replaced, for example by a
+    fake clock in tests.
+    """
+
+    FAIL = "fail"
+    RETRY = "retry"
+    REFRESH = "refresh"
+
+    def __init__(
+        self,
+        base_delay: float = 1,
+        max_delay: float = 60,
+        retries: Optional[int] = None,
+        budget: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        random: Callable[[], float] = random.random,
+    ) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = retries
+        self.budget = budget
+        self.clock = clock
+        self.sleep = sleep
+        self.random = random
+
+    @classmethod
+    def classify(cls, err: Exception) -> str:
+        """Get what to do after the given error.
+
+        ``REFRESH`` if the token was rejected, ``FAIL`` for errors that will
+        happen again (like HTTP 4xx) or cancelled transfers and ``RETRY``
+        otherwise (HTTP 5xx, timeouts, connection errors, etc).
+        """
+        if isinstance(err, TokenExpiredError):
+            return cls.REFRESH
+        if isinstance(err, (AuthenticationError, AssertionError, TransferCancelled)):
+            return cls.FAIL
+        if isinstance(err, requests.exceptions.HTTPError) and err.response is not None:
+            status = err.response.status_code
+            if status in (401, 403):
+                return cls.REFRESH
+            if 400 <= status < 500 and status not in (408, 425, 429):
+                return cls.FAIL
+        return cls.RETRY
+
+    def delay(self, attempt: int) -> float:
+        """Get the time to wait before the retry number ``attempt``."""
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def next_delay(self, attempt: int, started: float) -> float:
+        """Get the time to wait before the retry number ``attempt`` of an
+        operation started at ``started`` (by ``clock``), raises
+        ``RetryBudgetExceeded`` if it must be abandoned."""
+        delay = self.delay(attempt)
+        if self.retries is not None and attempt >= self.retries:
+            raise RetryBudgetExceeded(f"Gave up after {attempt} retries")
+        if self.budget is not None and self.clock() + delay - started > self.budget:
+            raise RetryBudgetExceeded(f"Gave up after {self.budget} seconds")
+        return delay
+
+    def backoff(self, attempt: int, started: float) -> None:
+        """Wait before the retry number ``attempt``, see ``next_delay()``."""
+        self.sleep(self.next_delay(attempt, started))
+
+    def call(
+        self,
+        func: Callable[[int], T],
+        refresh: Callable[[], None] = None,
+        on_retry: Callable[[Exception, int], None] = None,
+    ) -> T:
+        """Call ``func(attempt)`` retrying it on errors.
+
+        ``refresh()`` is called before retrying if the token was rejected and
+        ``on_retry(error, attempt)`` before waiting for a retry. The last error
+        is raised if the operation fails or is abandoned.
+        """
+        started = self.clock()
+        for attempt in itertools.count():
+            try:
+                return func(attempt)
+            except Exception as err:  # pylint: disable=W0703
+                action = self.classify(err)
+                if action == self.FAIL:
+                    raise
+                if on_retry:
+                    on_retry(err, attempt)
+                try:
+                    self.backoff(attempt, started)
+                except RetryBudgetExceeded:
+                    raise err from None
+                if action == self.REFRESH and refresh:
+                    refresh()
+        raise AssertionError("unreachable")
+
+
 class ToDusClient:
     """Class to interact with the ToDus API."""
 
@@ -42,11 +175,31 @@ class ToDusClient:
         version_name: str = "0.40.29",
         version_code: str = "21833",
         logger: logging.Logger = logging,  # type: ignore
+        max_queries: int = 8,
+        block_size: int = 256 * 1024,
+        retry_policy: RetryPolicy = None,
+        max_connections: int = 10,
+        timeout: Union[float, Tuple[float, float]] = (15, 30),
+        socket_options: List[SocketOption] = None,
+        metrics: Metrics = None,
+        upload_cache: UploadCache = None,
+        url_ttl: float = 300,
+        upload_limiter: RateLimiter = None,
+        download_limiter: RateLimiter = None,
     ) -> None:
         self.version_name = version_name
         self.version_code = version_code
         self.logger = logger
+        self.max_queries = max_queries
+        self.block_size = block_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or Metrics()
+        self.upload_cache = upload_cache
+        self.upload_limiter = upload_limiter
+        self.download_limiter = download_limiter
+        self._real_urls = _ResolvedURLs(url_ttl)
         self._lock = Lock()
+        self._xmpp: Optional[XMPPSession] = None
 
         self.session = requests.Session()
         self.session.headers.update(
@@ -54,92 +207,85 @@ class ToDusClient:
                 "Accept-Encoding": "gzip",
             }
         )
-        self.session.request = functools.partial(_request, self.session.request)  # type: ignore
-
-    @contextmanager
-    def _get_socket(self) -> Generator:
+        # keep a connection alive for every concurrent transfer, see
+        # todus.transport.socket_options() for the socket_options
+        self.adapter = PoolAdapter(max_connections, socket_options)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.request = functools.partial(_request, self.session.request, timeout)  # type: ignore
+
+    def _get_session(self, token: str) -> XMPPSession:
+        """Get the XMPP session, it is only replaced by a newer token since
+        other threads may still use an older one. The queries in flight in
+        the replaced session are completed before it is closed."""
         with self._lock:
-            context = ssl.create_default_context()
-            context.check_hostname = False
-            _socket = context.wrap_socket(socket.socket(socket.AF_INET))
-            _socket.settimeout(15)
-            _socket.connect(("im.todus.cu", 1756))
-            _socket.send(
-                b"<stream:stream xmlns='jc' o='im.todus.cu' xmlns:stream='x1' v='1.0'>"
+            old = self._xmpp
+            if old is not None and not _is_newer_token(token, old.token):
+                return old
+            session = XMPPSession(
+                token,
+                max_queries=self.max_queries,
+                logger=self.logger,
+                metrics=self.metrics,
             )
-            with _socket:
-                yield _socket
+            self._xmpp = session
+            if old is not None:
+                Thread(target=old.close, args=(True,), daemon=True).start()
+            return session
 
     def _reserve_url(self, token: str, filesize: int, file_type: FileType) -> tuple:
-        phone, authstr = _parse_token(token)
-        sid = generate_token(5)
-
-        with self._get_socket() as ssl_socket:
-            while True:
-                response = ssl_socket.recv(_BUFFERSIZE).decode()
-                if _negociate_start(response, ssl_socket, authstr, sid):
-                    continue
-
-                if f"t='result' i='{sid}-1'>" in response:
-                    ssl_socket.send(b"<en xmlns='x7' u='true' max='300'/>")
-                    ssl_socket.send(
-                        (
-                            "<iq i='"
-                            + sid
-                            + "-3' t='get'><query xmlns='todus:purl' type='"
-                            + str(int(file_type))
-                            + "' persistent='false' size='"
-                            + str(filesize)
-                            + "' room=''></query></iq>"
-                        ).encode()
-                    )
-                    continue
+        return self._get_session(token).reserve_url(filesize, int(file_type))
+
+    def _get_real_url(self, token: str, url: str) -> str:
+        return self._real_urls.get(url, self._get_session(token).resolve_url)
+
+    def _forget_rejected_url(self, url: str, err: Exception) -> None:
+        """Forget the resolved URL of the given file URL if the server
+        rejected it."""
+        if isinstance(err, requests.exceptions.HTTPError) and (
+            RetryPolicy.classify(err) == RetryPolicy.REFRESH
+        ):
+            self._real_urls.forget(url)
+
+    def reserve_urls(
+        self, token: str, sizes: Iterable[int], file_type: FileType = FileType.VOICE
+    ) -> Iterator[tuple]:
+        """Reserve upload URLs for files of the given sizes.
+
+        The reservations are sent back-to-back over the XMPP session and the
+        (upload URL, download URL) tuples are yielded, in the same order as
+        the sizes, as soon as they arrive.
+        """
+        return self._get_session(token).reserve_urls(sizes, int(file_type))
 
-                if response.startswith("<ed u='true' max='300'"):
-                    ssl_socket.send(("<p i='" + sid + "-4'></p>").encode())
-                    continue
+    def resolve_urls(self, token: str, urls: Iterable[str]) -> Iterator[str]:
+        """Get the real download URLs of the given file URLs.
 
-                if response.startswith("<iq o='" + phone + "@im.todus.cu"):
-                    match = re.match(r".*put='(.*)' get='(.*)' stat.*", response)
-                    assert match, f"Unexpected response: {response}"
-                    up_url = match.group(1).replace("amp;", "")
-                    down_url = match.group(2)
-                    return (up_url, down_url)
+        The URLs are yielded in the same order as soon as they arrive, and
+        they are kept for later downloads of the same files.
+        """
+        queried: deque = deque()
 
-                if "<not-authorized/>" in response:
-                    raise TokenExpiredError()
+        def track(urls: Iterable[str]) -> Iterator[str]:
+            for url in urls:
+                queried.append(url)
+                yield url
 
-                if not response:
-                    raise EndOfStreamError()
+        for real_url in self._get_session(token).resolve_urls(track(urls)):
+            self._real_urls.put(queried.popleft(), real_url)
+            yield real_url
 
-    def _get_real_url(self, token: str, url: str) -> str:
-        authstr = _parse_token(token)[1]
-        sid = generate_token(5)
-
-        with self._get_socket() as ssl_socket:
-            while True:
-                response = ssl_socket.recv(_BUFFERSIZE).decode()
-                if _negociate_start(response, ssl_socket, authstr, sid):
-                    continue
-
-                if f"t='result' i='{sid}-1'>" in response:
-                    data = f"<iq i='{sid}-2' t='get'><query xmlns='todus:gurl' url='{url}'></query></iq>"
-                    ssl_socket.send(data.encode())
-                    continue
-
-                if (
-                    f"t='result' i='{sid}-2'>" in response
-                    and "status='200'" in response
-                ):
-                    match = re.match(".*du='(.*)' stat.*", response)
-                    assert match, f"Unexpected response: {response}"
-                    return match.group(1).replace("amp;", "")
-
-                if "<not-authorized/>" in response:
-                    raise TokenExpiredError()
-
-                if not response:
-                    raise EndOfStreamError()
+    def close(self) -> None:
+        """Close the XMPP session, if any."""
+        with self._lock:
+            if self._xmpp is not None:
+                self._xmpp.close()
+                self._xmpp = None
+
+    @property
+    def connection_stats(self) -> ConnectionStats:
+        """Number of HTTP requests sent over new and reused connections."""
+        return self.adapter.stats
 
     @property
     def auth_ua(self) -> str:
@@ -206,18 +352,11 @@ class ToDusClient:
             "user-agent": self.auth_ua,
             "content-type": "application/x-protobuf",
         }
-        data = (
-            b"\n\n"
-            + phone_number.encode()
-            + b"\x12\x96\x01"
-            + generate_token(150).encode()
-            + b"\x12\x60"
-            + password.encode()
-            + b"\x1a\x05"
-            + self.version_code.encode()
-        )
+        data = _login_data(phone_number, password, self.version_code)
         url = "https://auth.todus.cu/v2/auth/token"
-        with self.session.post(url, data=data, headers=headers) as resp:
+        with self.metrics.timer("login"), self.session.post(
+            url, data=data, headers=headers
+        ) as resp:
             if resp.status_code == 403:
                 raise AuthenticationError()
             resp.raise_for_status()
@@ -227,71 +366,337 @@ class ToDusClient:
     def upload_file(
         self,
         token: str,
-        data: bytes,
+        data: UploadData,
         size: int = None,
         file_type: FileType = FileType.VOICE,
+        urls: tuple = None,
+        progress: Progress = None,
     ) -> str:
-        """Upload data and return the download URL."""
-        up_url, down_url = self._reserve_url(token, size or len(data), file_type)
+        """Upload data and return the download URL.
+
+        ``data`` can be bytes, a binary file object or an iterable of bytes
+        chunks, for the last two ``size`` is required. The data is streamed in
+        chunks of at most ``block_size`` bytes.
+
+        ``urls`` is an (upload URL, download URL) tuple previously returned by
+        ``reserve_urls()``, if not given a new URL is reserved.
+
+        ``progress(size)`` is called with the size of every chunk sent.
+
+        If the client has an ``upload_cache``, data already uploaded is not
+        uploaded again and the cached URL is returned instead. Data that can
+        only be read once (like iterables) is not looked up in the cache but
+        it is added to it.
+        """
+        if size is None:
+            assert isinstance(data, (bytes, bytearray)), "size needed to stream data"
+            size = len(data)
+        digest = None
+        if self.upload_cache and self.upload_cache.has_size(size, file_type):
+            digest = content_sha256(data, size, self.block_size)
+            url = digest and self._get_cached_upload(token, size, digest, file_type)
+            if url:
+                self.metrics.emit("upload.cached", bytes=size)
+                if progress:
+                    progress(size)
+                return url
+        if urls:
+            up_url, down_url = urls
+        else:
+            up_url, down_url = self._reserve_url(token, size, file_type)
         headers = {
             "User-Agent": self.upload_ua,
             "Authorization": f"Bearer {token}",
         }
-        with self.session.put(
+        # the data is hashed while it is sent if it wasn't hashed already
+        hasher = hashlib.sha256() if self.upload_cache and not digest else None
+        with self.metrics.timer("upload", bytes=size), self.session.put(
             url=up_url,
-            data=data,
+            data=_UploadStream(data, size, self.block_size, progress, hasher, self.upload_limiter) if size else b"",  # type: ignore
             headers=headers,
         ) as resp:
             resp.raise_for_status()
+        if self.upload_cache and size:
+            digest = digest or hasher.hexdigest()  # type: ignore
+            self.upload_cache.put(size, digest, file_type, down_url)
         return down_url
 
-    def download_file(self, token: str, url: str, path: str) -> int:
+    def _get_cached_upload(
+        self, token: str, size: int, digest: str, file_type: FileType
+    ) -> Optional[str]:
+        """Get the cached download URL of the given data, if the cache
+        validates its URLs the file is checked with a HEAD request."""
+        cache: UploadCache = self.upload_cache  # type: ignore
+        url = cache.get(size, digest, file_type)
+        if not url or not cache.validate:
+            return url
+        headers = {
+            "User-Agent": self.download_ua,
+            "Authorization": f"Bearer {token}",
+        }
+        try:
+            with self.session.head(
+                self._get_real_url(token, url), headers=headers, allow_redirects=True
+            ) as resp:
+                length = resp.headers.get("Content-Length")
+                valid = resp.ok and (length is None or int(length) == size)
+        except requests.exceptions.RequestException as err:
+            self.logger.exception(err)
+            valid = False
+        if not valid:
+            self.logger.debug("Cached upload is gone: %s", url)
+            self._real_urls.forget(url)
+            cache.remove(size, digest, file_type)
+            return None
+        return url
+
+    def download_file(
+        self,
+        token: str,
+        url: str,
+        path: str,
+        real_url: str = None,
+        segments: int = 1,
+        progress: Progress = None,
+        sha256: str = None,
+    ) -> int:
         """Download file URL.
 
+        ``real_url`` is the URL previously returned by ``resolve_urls()`` for
+        the given file URL, if not given the URL is resolved. Resolved URLs
+        are reused for ``url_ttl`` seconds unless the server rejects them.
+
+        If ``segments`` is greater than 1, the file is split in byte ranges
+        that are downloaded concurrently.
+
+        ``progress(size)`` is called with the size of every block received,
+        from the threads of the segments if any.
+
+        If ``sha256`` is given, the file is hashed while it is downloaded
+        (segmented downloads are hashed at the end) and ``ChecksumError`` is
+        raised if it doesn't match, the partial file is removed so the next
+        attempt starts over.
+
         Returns the file size.
         """
         temp_path = f"{path}.part"
-        url = self._get_real_url(token, url)
-        headers = {
-            "User-Agent": self.download_ua,
-            "Authorization": f"Bearer {token}",
-        }
+        real_url = real_url or self._get_real_url(token, url)
+        headers = _download_headers(self.download_ua, token)
+        hasher = hashlib.sha256() if sha256 else None
+        try:
+            if segments > 1 or os.path.exists(_segments_path(temp_path)):
+                size = self._download_segments(
+                    real_url, headers, temp_path, segments, progress
+                )
+                if hasher:
+                    _hash_file(hasher, temp_path, self.block_size)
+            else:
+                if hasher and os.path.exists(temp_path):
+                    _hash_file(hasher, temp_path, self.block_size)  # resumed
+                with open(temp_path, "ab") as file:
+                    size = self._download_range(
+                        real_url, headers, file, progress=progress, hasher=hasher
+                    )
+        except Exception as err:
+            self._forget_rejected_url(url, err)
+            raise
+        if hasher and hasher.hexdigest() != sha256:
+            os.remove(temp_path)
+            raise ChecksumError(f"SHA-256 mismatch: {hasher.hexdigest()}")
+        os.rename(temp_path, path)
+        return size
+
+    def download_into(
+        self,
+        token: str,
+        url: str,
+        file: BinaryIO,
+        real_url: str = None,
+        progress: Progress = None,
+        sha256: str = None,
+    ) -> int:
+        """Download file URL into the given binary file from its current
+        position.
+
+        Interrupted transfers are resumed, ``progress(size)`` is called with
+        the size of every block received. If ``sha256`` is given the data is
+        hashed while it is downloaded and ``ChecksumError`` is raised if it
+        doesn't match. Returns the file size.
+        """
+        real_url = real_url or self._get_real_url(token, url)
+        headers = _download_headers(self.download_ua, token)
+        start = file.tell()
+        hasher = hashlib.sha256() if sha256 else None
+        try:
+            end = self._download_range(
+                real_url, headers, file, offset=start, progress=progress, hasher=hasher
+            )
+        except Exception as err:
+            self._forget_rejected_url(url, err)
+            raise
+        if hasher and hasher.hexdigest() != sha256:
+            raise ChecksumError(f"SHA-256 mismatch: {hasher.hexdigest()}")
+        return end - start
+
+    def _download_range(
+        self,
+        url: str,
+        headers: dict,
+        file: BinaryIO,
+        end: int = None,
+        offset: int = 0,
+        progress: Progress = None,
+        hasher=None,
+    ) -> int:
+        """Download into the file from its current position up to ``end``.
+
+        ``offset`` is the position of the file where the first byte of the
+        URL goes. Interrupted transfers are resumed, returns the position of
+        the end of the downloaded range. The data written is added to the
+        ``hasher``, if any.
+        """
+        headers = dict(headers)
         size = -1
-        with open(temp_path, "ab") as file:
-            pos = file.tell()
+        pos = first = file.tell() - offset
+        attempt = 0
+        started = self.retry_policy.clock()
+        with self.metrics.timer("download", bytes=0) as event:
             while pos < size or size == -1:
-                if pos:
-                    headers["Range"] = f"bytes={pos}-"
+                if pos or end is not None:
+                    headers["Range"] = f"bytes={pos}-{'' if end is None else end}"
                 try:
                     with self.session.get(
                         url=url, headers=headers, stream=True
                     ) as resp:
+                        self.metrics.emit(
+                            "http.ttfb", duration=resp.elapsed.total_seconds()
+                        )
                         resp.raise_for_status()
-                        size = pos + int(resp.headers["Content-Length"])
-                        try:
-                            for chunk in resp.iter_content(chunk_size=10):
-                                file.write(chunk)
-                        except requests.exceptions.ConnectionError as err:
-                            self.logger.exception(err)
-                            time.sleep(5)
-                except IncompleteRead as err:
+                        encoded = _is_encoded(resp)
+                        if not encoded:
+                            size = pos + int(resp.headers["Content-Length"])
+                        _stream_to_file(
+                            resp,
+                            file,
+                            self.block_size,
+                            progress,
+                            hasher,
+                            self.download_limiter,
+                        )
+                        if encoded:  # the decoded size is known at the end
+                            size = file.tell() - offset
+                except (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.ReadTimeout,
+                    urllib3.exceptions.HTTPError,
+                    IncompleteRead,
+                    OSError,
+                ) as err:
                     self.logger.exception(err)
-                    time.sleep(5)
-                except requests.exceptions.ReadTimeout as err:
-                    self.logger.exception(err)
-                    time.sleep(5)
-                pos = file.tell()
-        os.rename(temp_path, path)
-        return size
+                    # requests' HTTPError is an OSError, HTTP 4xx errors are
+                    # not retried and rejected tokens are refreshed by the caller
+                    if self.retry_policy.classify(err) != RetryPolicy.RETRY:
+                        raise
+                    if file.tell() - offset > pos:  # progress, start backoff over
+                        attempt, started = 0, self.retry_policy.clock()
+                    try:
+                        delay = self.retry_policy.next_delay(attempt, started)
+                    except RetryBudgetExceeded:
+                        raise err from None
+                    self.metrics.emit("retry", error=type(err).__name__)
+                    self.retry_policy.sleep(delay)
+                    attempt += 1
+                pos = file.tell() - offset
+                event["bytes"] = pos - first
+        return offset + size
+
+    def _download_segments(
+        self,
+        url: str,
+        headers: dict,
+        temp_path: str,
+        segments: int,
+        progress: Progress = None,
+    ) -> int:
+        """Download the file in concurrent byte ranges into ``temp_path``.
+
+        The completed segments are recorded in a sidecar file so interrupted
+        downloads are resumed per segment.
+        """
+        state_path = _segments_path(temp_path)
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        else:
+            size = self._get_size(url, headers)
+            if size is None:  # ranges not supported
+                with open(temp_path, "ab") as file:
+                    return self._download_range(url, headers, file, progress=progress)
+            count = max(1, min(segments, size // _MIN_SEGMENT))
+            step = -(-size // count)
+            bounds = [
+                [start, min(start + step, size) - 1] for start in range(0, size, step)
+            ]
+            # keep what was already downloaded by a non-segmented download
+            done_size = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+            state = dict(
+                size=size,
+                segments=bounds,
+                done=[i for i, (_, end) in enumerate(bounds) if end < done_size],
+            )
+            with open(temp_path, "ab") as file:
+                file.truncate(size)
+            _save_json(state_path, state)
+
+        lock = Lock()
+
+        def fetch(index: int) -> None:
+            start, end = state["segments"][index]
+            with open(temp_path, "r+b") as file:
+                file.seek(start)
+                self._download_range(url, headers, file, end, progress=progress)
+            with lock:
+                state["done"].append(index)
+                _save_json(state_path, state)
+
+        pending = [i for i in range(len(state["segments"])) if i not in state["done"]]
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                list(pool.map(fetch, pending))
+        os.remove(state_path)
+        return state["size"]
+
+    def _get_size(self, url: str, headers: dict) -> Optional[int]:
+        """Get the size of the file in the given URL.
+
+        Returns ``None`` if the server doesn't support byte ranges.
+        """
+        headers = dict(headers, Range="bytes=0-0")
+        with self.session.get(url=url, headers=headers, stream=True) as resp:
+            resp.content  # pylint: disable=W0104  # read it to reuse the connection
+            if resp.status_code == 416:  # empty file
+                return None
+            resp.raise_for_status()
+            content_range = resp.headers.get("Content-Range", "")
+            if resp.status_code != 206 or "/" not in content_range:
+                return None
+            return int(content_range.rsplit("/", maxsplit=1)[1])
 
 
 class ToDusClient2(ToDusClient):
     """Class to interact with the ToDus API."""
 
-    def __init__(self, phone_number: str, password: str = "", **kwargs) -> None:
+    def __init__(
+        self,
+        phone_number: str,
+        password: str = "",
+        token_cache: TokenCache = None,
+        **kwargs,
+    ) -> None:
         super().__init__(**kwargs)
         self.phone_number = phone_number
         self.password = password
+        self.token_cache = token_cache
         self.token = ""
 
     @property
@@ -315,66 +720,304 @@ class ToDusClient2(ToDusClient):
         """
         self.password = super().validate_code(self.phone_number, code)
 
-    def login(self) -> None:  # noqa
-        """Login with phone number and password to get an access token."""
+    def login(self, force: bool = False) -> None:  # noqa
+        """Login with phone number and password to get an access token.
+
+        If the client has a ``token_cache``, a cached token is reused until it
+        is about to expire. If ``force`` is ``True`` the current token is
+        considered rejected and a new one is requested unless it was already
+        refreshed.
+        """
         assert self.password, "Can't login without password"
-        self.token = super().login(self.phone_number, self.password)
+        login = functools.partial(super().login, self.phone_number, self.password)
+        if self.token_cache:
+            self.token = self.token_cache.fetch(
+                self.phone_number, login, stale=self.token if force else None
+            )
+        else:
+            self.token = login()
+
+    def reserve_urls(  # noqa
+        self, sizes: Iterable[int], file_type: FileType = FileType.VOICE
+    ) -> Iterator[tuple]:
+        """Reserve upload URLs for files of the given sizes.
+
+        The (upload URL, download URL) tuples are yielded in the same order
+        as the sizes as soon as they arrive.
+        """
+        assert self.token, "Token needed"
+        return super().reserve_urls(self.token, sizes, file_type)
+
+    def resolve_urls(self, urls: Iterable[str]) -> Iterator[str]:  # noqa
+        """Get the real download URLs of the given file URLs.
+
+        The URLs are yielded in the same order as soon as they arrive.
+        """
+        assert self.token, "Token needed"
+        return super().resolve_urls(self.token, urls)
 
     def upload_file(  # noqa
-        self, data: bytes, size: int = None, file_type: FileType = FileType.VOICE
+        self,
+        data: UploadData,
+        size: int = None,
+        file_type: FileType = FileType.VOICE,
+        urls: tuple = None,
+        progress: Progress = None,
     ) -> str:
         """Upload data and return the download URL."""
         assert self.token, "Token needed"
-        return super().upload_file(self.token, data, size, file_type)
+        return super().upload_file(self.token, data, size, file_type, urls, progress)
 
-    def download_file(self, url: str, path: str) -> int:  # noqa
+    def download_file(  # noqa
+        self,
+        url: str,
+        path: str,
+        real_url: str = None,
+        segments: int = 1,
+        progress: Progress = None,
+        sha256: str = None,
+    ) -> int:
         """Download file URL.
 
         Returns the file size.
         """
         assert self.token, "Token needed"
-        return super().download_file(self.token, url, path)
+        return super().download_file(
+            self.token, url, path, real_url, segments, progress, sha256
+        )
 
+    def download_into(  # noqa
+        self,
+        url: str,
+        file: BinaryIO,
+        real_url: str = None,
+        progress: Progress = None,
+        sha256: str = None,
+    ) -> int:
+        """Download file URL into the given binary file from its current
+        position.
 
-def _request(real_request: Callable, *args, **kwargs) -> requests.Response:
-    kwargs.setdefault("timeout", 30)
-    resp = real_request(*args, **kwargs)
-    if resp.encoding is None:
-        # Default Encoding for HTML4 ISO-8859-1 (Latin-1)
-        resp.encoding = "latin-1"
-    return resp
+        Returns the file size.
+        """
+        assert self.token, "Token needed"
+        return super().download_into(self.token, url, file, real_url, progress, sha256)
+
+
+def _download_headers(user_agent: str, token: str) -> dict:
+    # the body is written as is, without content decoding, see _stream_to_file()
+    return {
+        "User-Agent": user_agent,
+        "Authorization": f"Bearer {token}",
+        "Accept-Encoding": "identity",
+    }
+
+
+def _is_encoded(resp: requests.Response) -> bool:
+    return resp.headers.get("Content-Encoding", "identity").lower() != "identity"
+
+
+def _iter_blocks(
+    raw, block_size: int, encoded: bool
+) -> Iterator[Union[bytes, memoryview]]:
+    """Iterate over the blocks of the body of the given urllib3 response, the
+    blocks of unencoded bodies are views of a reusable buffer."""
+    if encoded:
+        yield from raw.stream(block_size, decode_content=True)
+        return
+    buffer = memoryview(bytearray(block_size))
+    while True:
+        size = raw.readinto(buffer)
+        if not size:
+            return
+        yield buffer[:size]
+
+
+def _stream_to_file(
+    resp: requests.Response,
+    file: BinaryIO,
+    block_size: int,
+    progress: Progress = None,
+    hasher=None,
+    limiter: RateLimiter = None,
+) -> None:
+    """Write the response body into the file through a reusable buffer.
+
+    Encoded bodies (the downloads ask for ``identity`` but the server may not
+    honor it) are decoded.
+    """
+    raw = resp.raw
+    for block in _iter_blocks(raw, block_size, _is_encoded(resp)):
+        size = len(block)
+        if limiter:
+            limiter.acquire(size)
+        file.write(block)
+        if hasher:
+            hasher.update(block)
+        if progress:
+            progress(size)
+    # the whole body was read, return the connection to the pool instead of
+    # closing it with the response
+    raw.release_conn()
+
+
+class _ResolvedURLs:
+    """Resolved download URLs by file URL, reused for ``ttl`` seconds.
+
+    Concurrent lookups of the same URL are single-flight: the other threads
+    wait for the first one and get its result.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self._urls: Dict[str, Tuple[str, float]] = {}
+        self._pending: Dict[str, Future] = {}
+        self._prune_size = 1024
+        self._lock = Lock()
+
+    def get(self, url: str, resolve: Callable[[str], str]) -> str:
+        """Get the resolved URL, calling ``resolve(url)`` if it isn't known."""
+        with self._lock:
+            entry = self._urls.get(url)
+            if entry and entry[1] > self.clock():
+                return entry[0]
+            future = self._pending.get(url)
+            if future is None:
+                future = self._pending[url] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return future.result()
+        try:
+            real_url = resolve(url)
+        except BaseException as err:
+            with self._lock:
+                del self._pending[url]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._pending[url]
+            self._put(url, real_url)
+        future.set_result(real_url)
+        return real_url
+
+    def put(self, url: str, real_url: str) -> None:
+        with self._lock:
+            self._put(url, real_url)
+
+    def forget(self, url: str) -> None:
+        with self._lock:
+            self._urls.pop(url, None)
+
+    def _put(self, url: str, real_url: str) -> None:
+        if self.ttl <= 0:
+            return
+        now = self.clock()
+        self._urls[url] = (real_url, now + self.ttl)
+        if len(self._urls) >= self._prune_size:
+            self._urls = {
+                url: entry for url, entry in self._urls.items() if entry[1] > now
+            }
+            self._prune_size = max(1024, 2 * len(self._urls))
 
 
-def _negociate_start(
-    response: str, ssl_socket: ssl.SSLSocket, authstr: bytes, sid: str
-) -> bool:
-    if response.startswith(
-        "<?xml version='1.0'?><stream:stream i='"
-    ) and response.endswith("xmlns:stream='x1' f='im.todus.cu' xmlns='jc'>"):
-        return True
+class _UploadStream:
+    """Request body that streams the upload data in bounded chunks.
 
-    auth_stream = (
-        "<stream:features><es xmlns='x2'><e>PLAIN</e><e>X-OAUTH2</e></es>"
-        "<register xmlns='http://jabber.org/features/iq-register'/></stream:features>"
+    ``requests`` takes the Content-Length from ``len()``.
+    """
+
+    def __init__(
+        self,
+        data: UploadData,
+        size: int,
+        block_size: int,
+        progress: Progress = None,
+        hasher=None,
+        limiter: RateLimiter = None,
+    ) -> None:
+        self.data = data
+        self.size = size
+        self.block_size = block_size
+        self.progress = progress
+        self.hasher = hasher
+        self.limiter = limiter
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[bytes]:
+        if not self.progress and not self.hasher and not self.limiter:
+            yield from self._chunks()
+            return
+        for chunk in self._chunks():
+            if self.hasher:
+                self.hasher.update(chunk)
+            if self.limiter:
+                self.limiter.acquire(len(chunk))
+            yield chunk
+            # the chunk was sent when the next one is requested
+            if self.progress:
+                self.progress(len(chunk))
+
+    def _chunks(self) -> Iterator[bytes]:
+        data = self.data
+        if isinstance(data, (bytes, bytearray)):
+            view = memoryview(data)
+            for pos in range(0, len(view), self.block_size):
+                yield view[pos : pos + self.block_size]  # type: ignore
+        elif hasattr(data, "read"):
+            remaining = self.size
+            while remaining > 0:
+                chunk = data.read(min(self.block_size, remaining))  # type: ignore
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            yield from data  # type: ignore
+
+
+def _login_data(phone_number: str, password: str, version_code: str) -> bytes:
+    return (
+        b"\n\n"
+        + phone_number.encode()
+        + b"\x12\x96\x01"
+        + generate_token(150).encode()
+        + b"\x12\x60"
+        + password.encode()
+        + b"\x1a\x05"
+        + version_code.encode()
     )
-    if response == auth_stream:
-        ssl_socket.send(b"<ah xmlns='ah:ns' e='PLAIN'>" + authstr + b"</ah>")
-        return True
 
-    if response == "<ok xmlns='x2'/>":
-        ssl_socket.send(
-            b"<stream:stream xmlns='jc' o='im.todus.cu' xmlns:stream='x1' v='1.0'>"
-        )
-        return True
 
-    if "<stream:features><b1 xmlns='x4'/>" in response:
-        ssl_socket.send(f"<iq i='{sid}-1' t='set'><b1 xmlns='x4'></b1></iq>".encode())
-        return True
+def _segments_path(temp_path: str) -> str:
+    return f"{temp_path}.json"
+
 
-    return False
+def _hash_file(hasher, path: str, block_size: int) -> None:
+    """Add the content of the given file to the hasher."""
+    with open(path, "rb") as file:
+        for block in iter(functools.partial(file.read, block_size), b""):
+            hasher.update(block)
 
 
-def _parse_token(token: str) -> tuple:
-    phone = json.loads(b64decode(token.split(".")[1]).decode())["username"]
-    authstr = b64encode((chr(0) + phone + chr(0) + token).encode("utf-8"))
-    return phone, authstr
+def _save_json(path: str, data: dict) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def _request(
+    real_request: Callable,
+    timeout: Union[float, Tuple[float, float]],
+    *args,
+    **kwargs,
+) -> requests.Response:
+    kwargs.setdefault("timeout", timeout)
+    resp = real_request(*args, **kwargs)
+    if resp.encoding is None:
+        # Default Encoding for HTML4 ISO-8859-1 (Latin-1)
+        resp.encoding = "latin-1"
+    return resp
@@ -0,0 +1,131 @@
+"""Deduplication cache of uploaded files."""
+
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+from typing import Optional
+
+from .util import file_lock
+
+
+class UploadCache:
+    """Cache of the download URLs of uploaded files by their content, stored
+    in a JSON file.
+
+    Entries are keyed by the SHA-256, size and file type (the ``file_type``
+    of the upload, see ``todus.client.FileType``) of the data, they expire
+    ``ttl`` seconds after the upload and the least recently used ones are
+    evicted when there are more than ``max_entries``. If ``validate`` is
+    ``True`` the cached URLs are checked with a request to the server before
+    they are reused, see ``todus.client.ToDusClient``.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 30 * 24 * 60 * 60,
+        max_entries: int = 10000,
+        validate: bool = False,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.validate = validate
+        self._lock = Lock()
+
+    def has_size(self, size: int, file_type: int) -> bool:
+        """Check if there are entries for data of the given size and file type,
+        to avoid hashing data that can't be in the cache."""
+        now = time.time()
+        return any(
+            entry["size"] == size
+            and entry.get("type") == file_type
+            and self._is_valid(entry, now)
+            for entry in self._load().values()
+        )
+
+    def get(self, size: int, digest: str, file_type: int) -> Optional[str]:
+        """Get the URL of the data of the given size, SHA-256 and file type, if
+        any."""
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            entry = entries.get(_key(size, digest, file_type))
+            if not entry or not self._is_valid(entry, time.time()):
+                return None
+            entry["used"] = time.time()
+            self._save(entries)
+            return entry["url"]
+
+    def put(self, size: int, digest: str, file_type: int, url: str) -> None:
+        """Add the URL of uploaded data of the given size, SHA-256 and file
+        type."""
+        now = time.time()
+        with self._lock, file_lock(self.path):
+            entries = {
+                key: entry
+                for key, entry in self._load().items()
+                if self._is_valid(entry, now)
+            }
+            entries[_key(size, digest, file_type)] = dict(
+                url=url, size=size, type=int(file_type), time=now, used=now
+            )
+            if len(entries) > self.max_entries:
+                lru = sorted(entries, key=lambda key: entries[key]["used"])
+                for key in lru[: len(entries) - self.max_entries]:
+                    del entries[key]
+            self._save(entries)
+
+    def remove(self, size: int, digest: str, file_type: int) -> None:
+        """Remove the entry of the data of the given size, SHA-256 and file
+        type."""
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            if entries.pop(_key(size, digest, file_type), None):
+                self._save(entries)
+
+    def _is_valid(self, entry: dict, now: float) -> bool:
+        return entry["time"] + self.ttl > now
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries: dict) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(temp_path, self.path)
+
+
+def _key(size: int, digest: str, file_type: int) -> str:
+    return f"{digest}:{size}:{int(file_type)}"
+
+
+def content_sha256(data, size: int, block_size: int = 1 << 20) -> Optional[str]:
+    """Get the SHA-256 of the first ``size`` bytes of the given upload data.
+
+    The data can be bytes or a seekable binary file object, which is moved
+    back to its position. ``None`` is returned for other data, that can only
+    be read once.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return hashlib.sha256(data).hexdigest()
+    seekable = getattr(data, "seekable", None)
+    if seekable is None or not seekable():
+        return None
+    digest = hashlib.sha256()
+    start = data.tell()
+    remaining = size
+    while remaining > 0:
+        chunk = data.read(min(block_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        digest.update(chunk)
+    data.seek(start)
+    return digest.hexdigest()
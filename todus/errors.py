@@ -11,3 +11,15 @@ class EndOfStreamError(Exception):
 
 class AuthenticationError(Exception):
     """Account password is invalid."""
+
+
+class RetryBudgetExceeded(Exception):
+    """The retry policy gave up retrying an operation."""
+
+
+class ChecksumError(Exception):
+    """The downloaded data doesn't match its checksum."""
+
+
+class TransferCancelled(Exception):
+    """The transfer was cancelled."""
@@ -0,0 +1,162 @@
+"""Journal of the transfers to resume them after a crash."""
+
+import json
+import os
+import shutil
+import sqlite3
+from threading import Lock
+from typing import Dict, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,
+    layout TEXT,
+    UNIQUE (kind, key)
+);
+CREATE TABLE IF NOT EXISTS parts (
+    job INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    url TEXT,
+    size INTEGER,
+    offset INTEGER NOT NULL DEFAULT 0,
+    sha256 TEXT,
+    PRIMARY KEY (job, name)
+);
+"""
+
+
+def file_fingerprint(path: str) -> str:
+    """Get a fingerprint of the given file that changes if it is modified."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class JobJournal:
+    """Journal of the transfers stored in a SQLite database in ``folder``.
+
+    A job is the transfer of a source identified by its ``kind`` and
+    ``key`` (like the path of the file to upload), it records the state of
+    the job and of its parts. Every change is committed right away so the
+    journal survives a crash of the program, it is thread-safe and can be
+    shared by several processes.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(folder, "journal.db"), timeout=30, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        self._lock = Lock()
+
+    def open(self, kind: str, key: str, fingerprint: str) -> "Job":
+        """Get the job of the given source, a new job is started if there
+        is none or if the source ``fingerprint`` changed."""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id, fingerprint, state, layout FROM jobs"
+                " WHERE kind = ? AND key = ?",
+                (kind, key),
+            ).fetchone()
+            if row and row[1] != fingerprint:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (row[0],))
+                shutil.rmtree(os.path.join(self.folder, str(row[0])), True)
+                row = None
+            if row is None:
+                cursor = self._db.execute(
+                    "INSERT INTO jobs (kind, key, fingerprint, state)"
+                    " VALUES (?, ?, ?, 'new')",
+                    (kind, key, fingerprint),
+                )
+                row = (cursor.lastrowid, fingerprint, "new", None)
+        return Job(self, row[0], row[2], json.loads(row[3]) if row[3] else None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def execute(self, query: str, params: tuple) -> list:
+        """Run a query in its own transaction and get the resulting rows."""
+        with self._lock, self._db:
+            return self._db.execute(query, params).fetchall()
+
+
+class Job:
+    """A transfer recorded in a ``JobJournal``.
+
+    ``state`` and ``layout`` (a JSON-serializable value) describe the job,
+    its parts have a ``state``, ``url``, ``size``, ``offset`` and ``sha256``.
+    Temporary files of the job can be kept in its ``folder``.
+    """
+
+    def __init__(
+        self, journal: JobJournal, job_id: int, state: str, layout: Optional[dict]
+    ) -> None:
+        self.journal = journal
+        self.id = job_id
+        self.state = state
+        self.layout = layout
+        self.folder = os.path.join(journal.folder, str(job_id))
+
+    def update(self, state: str, layout: dict = None) -> None:
+        """Set the state of the job, and its layout if given."""
+        if layout is not None:
+            self.layout = layout
+        self.state = state
+        self.journal.execute(
+            "UPDATE jobs SET state = ?, layout = ? WHERE id = ?",
+            (state, json.dumps(self.layout), self.id),
+        )
+
+    def parts(self) -> Dict[str, dict]:
+        """Get the parts of the job by name."""
+        rows = self.journal.execute(
+            "SELECT name, state, url, size, offset, sha256 FROM parts WHERE job = ?",
+            (self.id,),
+        )
+        return {
+            row[0]: dict(
+                state=row[1], url=row[2], size=row[3], offset=row[4], sha256=row[5]
+            )
+            for row in rows
+        }
+
+    def update_part(
+        self,
+        name: str,
+        state: str,
+        url: str = None,
+        size: int = None,
+        offset: int = 0,
+        sha256: str = None,
+    ) -> None:
+        """Record the state of a part of the job."""
+        self.journal.execute(
+            "INSERT OR REPLACE INTO parts"
+            " (job, name, state, url, size, offset, sha256)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.id, name, state, url, size, offset, sha256),
+        )
+
+    def reset(self) -> None:
+        """Start the job over, its parts and files are removed."""
+        self.journal.execute("DELETE FROM parts WHERE job = ?", (self.id,))
+        self.update("new")
+        self.remove_folder()
+
+    def remove_folder(self) -> None:
+        """Remove the temporary files of the job."""
+        shutil.rmtree(self.folder, True)
+
+    def remove(self) -> None:
+        """Remove the job from the journal with its parts and files."""
+        self.journal.execute("DELETE FROM jobs WHERE id = ?", (self.id,))
+        self.remove_folder()
@@ -1,34 +1,38 @@
 """CLI program."""
-# pylama:ignore=R0912,C901,R0913
+# pylama:ignore=R0912,R0915,C901,R0913
 
 import argparse
 import functools
+import hashlib
 import json
 import logging.handlers
 import os
+import re
+import shutil
 import time
-from concurrent.futures import ThreadPoolExecutor
-from tempfile import TemporaryDirectory
-from threading import Lock
-from typing import TextIO
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from queue import Queue
+from threading import Condition, Event, Lock, Semaphore, Thread
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional, TextIO, Tuple
 from urllib.parse import quote_plus, unquote_plus
 
-import multivolumefile
-import tqdm
-
-from . import __version__
-from .client import ToDusClient2
-from .errors import AuthenticationError
+from . import archive, get_version, split
+from .dedup import UploadCache
+from .errors import AuthenticationError, TransferCancelled
+from .jobs import Job, JobJournal, file_fingerprint
+from .metrics import JsonLinesExporter, Metrics, Summary, format_summary
+from .progress import PartProgress, TransferProgress, write
+from .ratelimit import RateLimiter
+from .scheduler import Attempt, TransferScheduler
+from .tokens import TokenCache
 from .util import normalize_phone_number
 
-try:
-    import py7zr
-
-    ARCHIVE_EXT = "7z"
-except ImportError:
-    import zipfile
-
-    ARCHIVE_EXT = "zip"
+if TYPE_CHECKING:
+    # requests is slow to import, the client is only imported by the commands
+    # that connect to the server
+    from .client import ToDusClient2
+    from .pool import ClientPool
 
 
 def _get_config() -> dict:
@@ -58,86 +62,458 @@ def _get_logger() -> logging.Logger:
 
 
 def _split_upload(
-    client: ToDusClient2, path: str, part_size: int, max_workers: int
+    pool: "ClientPool",
+    path: str,
+    part_size: int,
+    max_workers: int,
+    journal: JobJournal,
+    compression: str = "auto",
+    level: Optional[int] = None,
 ) -> str:
-    with open(path, "rb") as file:
-        data = file.read()
     filename = os.path.basename(path)
-    with TemporaryDirectory() as tempdir:
-        with multivolumefile.open(
-            os.path.join(tempdir, f"{filename}.{ARCHIVE_EXT}"),
-            "wb",
-            volume=part_size,
-        ) as vol:
-            if ARCHIVE_EXT == "7z":
-                with py7zr.SevenZipFile(vol, "w") as archive:
-                    archive.writestr(data, filename)
-            else:
-                with zipfile.ZipFile(vol, "w", zipfile.ZIP_DEFLATED) as archive:  # type: ignore
-                    archive.writestr(filename, data)
-        del data
-        path = os.path.abspath(filename + ".txt")
-        uploaded_parts = []
-        if os.path.exists(path):
-            with open(path, encoding="utf-8") as txt:
-                for line in txt.readlines():
-                    line = line.strip()
-                    if line:
-                        uploaded_parts.append(line.split(maxsplit=1)[1])
-            client.logger.debug(
-                "Uploads txt found with %s parts already uploaded", len(uploaded_parts)
-            )
-        parts = sorted(os.listdir(tempdir))
-        pool = ThreadPoolExecutor(max_workers=max_workers)
-        pbar = tqdm.tqdm(total=len(parts))
-        with open(path, "a", encoding="utf-8") as txt:
-            task = functools.partial(
-                _upload_task,
-                client=client,
-                folder=tempdir,
-                pbar=pbar,
-                uploaded=uploaded_parts,
-                txt_file=txt,
-                lock=Lock(),
-            )
-            client.login()
-            for _ in pool.map(task, parts):
-                pbar.refresh()
-    return path
+    txt_path = os.path.abspath(filename + ".txt")
+    uploaded_parts = []
+    if os.path.exists(txt_path):
+        with open(txt_path, encoding="utf-8") as txt:
+            for line in txt.readlines():
+                line = line.strip()
+                if line:
+                    uploaded_parts.append(_parse_txt_line(line)[1])
+        pool.logger.debug(
+            "Uploads txt found with %s parts already uploaded", len(uploaded_parts)
+        )
+    job = journal.open(
+        "split-upload",
+        os.path.abspath(path),
+        f"{file_fingerprint(path)}:{part_size}:{compression}:{level}"
+        f":{archive.ARCHIVE_EXT}",
+    )
+    parts = job.parts()
+    with open(txt_path, "a", encoding="utf-8") as txt:
+        # the parts uploaded before the txt was lost
+        for name, part in parts.items():
+            if part["state"] == "uploaded" and name not in uploaded_parts:
+                txt.write(_txt_line(part["url"], name, part["sha256"]))
+                uploaded_parts.append(name)
+    # the volumes of a finished compression are reused if they are still there
+    volumes = job.layout["volumes"] if job.layout else []
+    reuse = bool(volumes) and all(
+        name in uploaded_parts
+        or os.path.exists(os.path.join(job.folder, name))
+        and os.path.getsize(os.path.join(job.folder, name)) == parts[name]["size"]
+        for name in volumes
+    )
+    # volumes are uploaded while the file is still being compressed, the
+    # compression is paused when too many volumes are waiting to be uploaded
+    slots = Semaphore(2 * max_workers)
+    aborted = Event()
+    sealed: Queue = Queue()
+
+    def on_sealed(volume: str) -> None:
+        slots.acquire()
+        if aborted.is_set():
+            raise RuntimeError("Upload aborted")
+        name = os.path.basename(volume)
+        if not reuse:
+            volumes.append(name)
+            job.update_part(name, "sealed", size=os.path.getsize(volume))
+        sealed.put(name)
+
+    def compress() -> None:
+        if reuse:
+            write(f"Reusing compressed volumes: {filename}")
+            for name in volumes:
+                if name not in uploaded_parts:
+                    on_sealed(os.path.join(job.folder, name))
+            return
+        volumes.clear()
+        job.remove_folder()
+        os.makedirs(job.folder)
+        archive.write_archive(
+            path,
+            os.path.join(job.folder, filename),
+            part_size,
+            on_sealed,
+            compression,
+            level,
+        )
+        job.update("compressed", dict(volumes=volumes))
+
+    pool.login()
+    with ThreadPoolExecutor(max_workers=1) as compressor, TransferScheduler(
+        max_workers
+    ) as scheduler:
+        compressing = compressor.submit(compress)
+        compressing.add_done_callback(lambda _: sealed.put(None))
+        progress = TransferProgress()
+        try:
+            with open(txt_path, "a", encoding="utf-8") as txt:
+                task = functools.partial(
+                    _upload_task,
+                    pool=pool,
+                    folder=job.folder,
+                    progress=progress,
+                    uploaded=uploaded_parts,
+                    txt_file=txt,
+                    lock=Lock(),
+                    job=job,
+                )
+                futures = []
+                for batch in _drain(sealed):
+                    pending = []
+                    for name in batch:
+                        volume = os.path.join(job.folder, name)
+                        if name in uploaded_parts:
+                            write(f"Skipping: {name}")
+                            progress.skip(os.path.getsize(volume))
+                            os.remove(volume)
+                            slots.release()
+                        else:
+                            pending.append(name)
+                    if not pending:
+                        continue
+                    # the largest volumes first, they are uploaded out of order
+                    # and their URLs are reserved in the same order
+                    by_size = sorted(
+                        (
+                            (os.path.getsize(os.path.join(job.folder, name)), name)
+                            for name in pending
+                        ),
+                        key=lambda item: -item[0],
+                    )
+                    progress.add_total(sum(size for size, _ in by_size))
+                    source = pool.primary
+                    reservations = _safe_prefetch(
+                        source.reserve_urls(size for size, _ in by_size), pool.logger
+                    )
+                    for size, name in by_size:
+                        future = scheduler.submit(
+                            functools.partial(
+                                task, name, next(reservations), source=source
+                            ),
+                            size,
+                        )
+                        future.add_done_callback(lambda _: slots.release())
+                        futures.append(future)
+                compressing.result()
+                done = all([future.result() for future in futures])
+        finally:
+            # the compression stops if the upload failed
+            aborted.set()
+            for _ in range(2 * max_workers):
+                slots.release()
+        progress.close()
+    if done:
+        # the txt has every part now, an upload started again is a new one
+        job.remove()
+    return txt_path
+
+
+def _raw_split_upload(
+    pool: "ClientPool", path: str, part_size: int, max_workers: int
+) -> str:
+    filename = os.path.basename(path)
+    txt_path = os.path.abspath(filename + ".txt")
+    manifest_path = os.path.abspath(filename + split.MANIFEST_EXT)
+    manifest = split.new_manifest(path, part_size)
+    resume = False
+    if os.path.exists(manifest_path):
+        old_manifest = split.load_manifest(manifest_path)
+        resume = split.is_same_source(old_manifest, manifest)
+        if resume:
+            manifest = old_manifest
+        else:
+            write(f"{filename} changed or was split differently, uploading it again")
+    split.save_manifest(manifest_path, manifest)
+    pending = [part for part in manifest["parts"] if not part["url"]]
+    progress = TransferProgress(sum(part["size"] for part in pending))
+    for part in manifest["parts"]:
+        if part["url"]:
+            write(f"Skipping: {part['name']}")
+            progress.skip(part["size"])
+    # the lines of the parts of another manifest are not kept
+    txt_mode = "a" if resume else "w"
+    with open(txt_path, txt_mode, encoding="utf-8") as txt, TransferScheduler(
+        max_workers
+    ) as scheduler:
+        pool.login()
+        source = pool.primary
+        task = functools.partial(
+            _upload_range_task,
+            path=path,
+            pool=pool,
+            source=source,
+            progress=progress,
+            txt_file=txt,
+            manifest=manifest,
+            manifest_path=manifest_path,
+            lock=Lock(),
+        )
+        futures = _schedule(
+            scheduler,
+            task,
+            pending,
+            lambda parts: source.reserve_urls(part["size"] for part in parts),
+            pool.logger,
+            sizes=[part["size"] for part in pending],
+        )
+    progress.close()
+    for future in futures:
+        future.result()
+    return txt_path
+
+
+def _txt_line(url: str, name: str, sha256: Optional[str]) -> str:
+    return f"{url}\t{name}\t{sha256}\n" if sha256 else f"{url}\t{name}\n"
+
+
+def _parse_txt_line(line: str) -> Tuple[str, str, Optional[str]]:
+    """Get the URL, name and SHA-256 (if any) of a line of an uploads txt,
+    the old lines without the SHA-256 are supported."""
+    url, name = line.split(maxsplit=1)
+    match = _SHA256_COLUMN.search(name)
+    if match:
+        return url, name[: match.start()], match.group(1)
+    return url, name, None
+
+
+def _drain(queue: Queue) -> Iterator[list]:
+    """Yield the items put in ``queue`` in batches until ``None`` is found."""
+    while True:
+        batch = [queue.get()]
+        while batch[-1] is not None and not queue.empty():
+            batch.append(queue.get())
+        if batch[-1] is None:
+            if len(batch) > 1:
+                yield batch[:-1]
+            return
+        yield batch
+
+
+def _safe_prefetch(prefetched: Iterator, logger: logging.Logger) -> Iterator:
+    """Yield the values of ``prefetched`` and ``None`` forever once it ends or
+    fails."""
+    try:
+        yield from prefetched
+    except Exception as err:
+        logger.exception(err)
+    while True:
+        yield None
+
+
+def _schedule(
+    scheduler: TransferScheduler,
+    task: Callable,
+    items: list,
+    prefetch: Callable[[list], Iterator],
+    logger: logging.Logger,
+    sizes: List[Optional[int]] = None,
+    priorities: List[int] = None,
+) -> List[Future]:
+    """Submit ``task(item, value, attempt)`` to the scheduler for every item,
+    with the given sizes and priorities.
+
+    The values are the ones of ``prefetch(items)`` with the items in the
+    order they are started (like the URLs resolved ahead), consumed at most
+    ``2 * max_workers`` items ahead of the started transfers. If
+    ``prefetch`` fails, ``None`` is passed to the remaining tasks.
+    """
+    item_sizes = sizes or [None] * len(items)
+    item_priorities = priorities or [0] * len(items)
+    # the scheduler starts the transfers in this order
+    order = sorted(
+        range(len(items)),
+        key=lambda index: (-item_priorities[index], -(item_sizes[index] or 0)),
+    )
+    prefetched = _Prefetcher(
+        prefetch([items[index] for index in order]),
+        2 * scheduler.max_workers,
+        logger,
+    )
+
+    def run(index: int, position: int, attempt: Attempt) -> Any:
+        return task(items[index], prefetched.get(position), attempt)
+
+    return [
+        scheduler.submit(
+            functools.partial(run, index, position),
+            item_sizes[index],
+            item_priorities[index],
+        )
+        for position, index in enumerate(order)
+    ]
+
+
+class _Prefetcher:
+    """Consume ``values`` in a thread at most ``window`` values ahead of the
+    last one requested with ``get()``."""
+
+    def __init__(self, values: Iterator, window: int, logger: logging.Logger) -> None:
+        self._values: list = []
+        self._requested = 0
+        self._ended = False
+        self._cond = Condition()
+        Thread(target=self._run, args=(values, window, logger), daemon=True).start()
+
+    def get(self, index: int) -> Any:
+        """Get the value at ``index``, ``None`` if the values ended or failed
+        before it."""
+        with self._cond:
+            self._requested = max(self._requested, index + 1)
+            self._cond.notify_all()
+            while index >= len(self._values) and not self._ended:
+                self._cond.wait()
+            return self._values[index] if index < len(self._values) else None
+
+    def _run(self, values: Iterator, window: int, logger: logging.Logger) -> None:
+        try:
+            for value in values:
+                with self._cond:
+                    self._values.append(value)
+                    self._cond.notify_all()
+                    while len(self._values) >= self._requested + window:
+                        self._cond.wait()
+        except Exception as err:
+            logger.exception(err)
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
 
 
 def _upload_task(
     name: str,
+    urls: Optional[tuple],
+    copy: Attempt,
     folder: str,
     uploaded: list,
-    client: ToDusClient2,
-    pbar: tqdm.tqdm,
+    pool: "ClientPool",
+    source: "ToDusClient2",
+    progress: TransferProgress,
     txt_file: TextIO,
     lock: Lock,
-) -> None:
+    job: Job,
+) -> bool:
     path = os.path.join(folder, name)
-    if name in uploaded:
-        tqdm.tqdm.write(f"Skipping: {name}")
-        os.remove(path)
-        pbar.update(1)
-        return
-    tqdm.tqdm.write(f"Uploading: {name}")
-    with open(path, "rb") as file:
-        part = file.read()
-    while True:
-        try:
-            url = client.upload_file(part, len(part))
-            with lock:
-                txt_file.write(f"{url}\t{name}\n")
-                uploaded.append(name)
+    write(f"Uploading{' again' if copy.speculative else ''}: {name}")
+    size = os.path.getsize(path)
+    part = progress.part(name, size)
+    on_progress = copy.watch(part)
+
+    def upload(client: "ToDusClient2", attempt: int) -> int:
+        part.reset()
+        reserved = urls if client is source and not attempt else None
+        if copy.speculative:
+            # the reserved URLs are used by the first copy
+            reserved = None
+        with split.FileRange(path, 0, size) as data:
+            url = client.upload_file(
+                data, size, urls=reserved, progress=on_progress  # type: ignore
+            )
+        digest = data.hexdigest()
+        copy.claim()
+        with lock:
+            txt_file.write(_txt_line(url, name, digest))
+            uploaded.append(name)
+        job.update_part(name, "uploaded", url, size, sha256=digest)
+        return size
+
+    done = _retry(pool, name, upload, part, copy)
+    if done:
+        # on Windows it fails while the cancelled copy is reading it, the
+        # volumes left are removed with the job folder
+        with suppress(PermissionError):
             os.remove(path)
-            pbar.update(1)
-            break
-        except Exception as err:
-            client.logger.exception(err)
-            time.sleep(15)
-            client.login()
-            tqdm.tqdm.write(f"Retrying: {name} (ERROR: {err})")
+    return done
+
+
+def _upload_range_task(
+    part: dict,
+    urls: Optional[tuple],
+    copy: Attempt,
+    path: str,
+    pool: "ClientPool",
+    source: "ToDusClient2",
+    progress: TransferProgress,
+    txt_file: TextIO,
+    manifest: dict,
+    manifest_path: str,
+    lock: Lock,
+) -> bool:
+    name = part["name"]
+    write(f"Uploading{' again' if copy.speculative else ''}: {name}")
+    part_progress = progress.part(name, part["size"])
+    on_progress = copy.watch(part_progress)
+
+    def upload(client: "ToDusClient2", attempt: int) -> int:
+        part_progress.reset()
+        reserved = urls if client is source and not attempt else None
+        if copy.speculative:
+            # the reserved URLs are used by the first copy
+            reserved = None
+        with split.FileRange(path, part["offset"], part["size"]) as data:
+            url = client.upload_file(
+                data, part["size"], urls=reserved, progress=on_progress  # type: ignore
+            )
+        copy.claim()
+        with lock:
+            part["sha256"] = data.hexdigest()
+            part["url"] = url
+            txt_file.write(_txt_line(url, name, part["sha256"]))
+            txt_file.flush()
+            split.save_manifest(manifest_path, manifest)
+        return part["size"]
+
+    return _retry(pool, name, upload, part_progress, copy)
+
+
+def _retry(
+    pool: "ClientPool",
+    name: str,
+    func: Callable[["ToDusClient2", int], int],
+    progress: PartProgress = None,
+    copy: Attempt = None,
+) -> bool:
+    """Call ``func(client, attempt)`` with the accounts of the pool, retrying
+    it with the retry policy.
+
+    If the operation fails the error is reported and ``False`` is returned,
+    authentication errors are raised when no accounts are left. The
+    operations cancelled by the scheduler (see ``Attempt``) are not reported
+    and the ``copy`` is not retried once it is cancelled. The ``progress`` of
+    the operation is closed at the end.
+    """
+
+    def on_retry(err: Exception, _attempt: int) -> None:
+        pool.logger.exception(err)
+        write(f"Retrying: {name} (ERROR: {err})")
+
+    done = False
+    try:
+        pool.call(func, on_retry, copy.check if copy else None)
+        done = True
+    except AuthenticationError:
+        raise
+    except TransferCancelled:
+        pass
+    except Exception as err:
+        pool.logger.exception(err)
+        write(f"Failed: {name} (ERROR: {err})")
+    finally:
+        if progress:
+            progress.close(done)
+    return done
+
+
+class _VersionAction(argparse.Action):
+    """Like the "version" action, the version is only read when it is shown."""
+
+    def __init__(self, option_strings: List[str], dest: str, **kwargs) -> None:
+        super().__init__(option_strings, argparse.SUPPRESS, nargs=0, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None) -> None:
+        print(get_version())
+        parser.exit()
 
 
 def _get_parser() -> argparse.ArgumentParser:
@@ -156,11 +532,73 @@ def _get_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "-v",
         "--version",
-        action="version",
-        version=__version__,
+        action=_VersionAction,
         help="show program's version number and exit.",
     )
 
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        type=int,
+        help="Maximum retries of a failed transfer (default: no limit)",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        dest="retry_budget",
+        type=float,
+        help="Maximum seconds spent retrying a failed transfer (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-delay",
+        dest="max_delay",
+        type=float,
+        default=60,
+        help="Maximum seconds to wait between retries (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--upload-limit",
+        dest="upload_limit",
+        metavar="RATE",
+        type=_parse_rate,
+        default=0,
+        help="Maximum upload speed in bytes per second shared by all the"
+        " transfers, with an optional K, M or G suffix (default: no limit)",
+    )
+    parser.add_argument(
+        "--download-limit",
+        dest="download_limit",
+        metavar="RATE",
+        type=_parse_rate,
+        default=0,
+        help="Maximum download speed in bytes per second shared by all the"
+        " transfers, with an optional K, M or G suffix (default: no limit)",
+    )
+    parser.add_argument(
+        "--account-limit",
+        dest="account_limit",
+        metavar="RATE",
+        type=_parse_rate,
+        default=0,
+        help="Maximum upload and download speed of each account, within the"
+        " limits above (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        metavar="PATH",
+        help="write the transfer metrics to the given file",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        dest="metrics_format",
+        choices=("jsonl", "prometheus"),
+        default="jsonl",
+        help="Format of the metrics file: every event as a line of JSON or a"
+        " summary in the Prometheus text format (default: %(default)s)",
+    )
+
     subparsers = parser.add_subparsers(dest="command")
 
     subparsers.add_parser(name="login", help="authenticate in server")
@@ -182,6 +620,52 @@ def _get_parser() -> argparse.ArgumentParser:
         default=1,
         help="Number of simultaneous uploads (default: %(default)s)",
     )
+    up_parser.add_argument(
+        "-r",
+        "--raw",
+        dest="raw",
+        action="store_true",
+        help="split the file in raw byte ranges instead of a split archive,"
+        " the parts can be joined with cat",
+    )
+    up_parser.add_argument(
+        "-c",
+        "--compression",
+        dest="compression",
+        choices=archive.COMPRESSIONS,
+        default="auto",
+        help="Compression of split uploads, 'auto' doesn't compress files that"
+        " are already compressed (default: %(default)s)",
+    )
+    up_parser.add_argument(
+        "-l",
+        "--level",
+        dest="level",
+        type=int,
+        help="Compression level or preset of the selected codec",
+    )
+    up_parser.add_argument(
+        "-a",
+        "--accounts",
+        dest="accounts",
+        metavar="ACCOUNTS",
+        default="",
+        help="spread the uploads between the given comma-separated accounts,"
+        " or 'all' the logged accounts",
+    )
+    up_parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="upload the data again even if it was already uploaded",
+    )
+    up_parser.add_argument(
+        "--check-cache",
+        dest="check_cache",
+        action="store_true",
+        help="check that the already uploaded files are still in the server"
+        " before reusing them",
+    )
     up_parser.add_argument("file", nargs="+", help="file to upload")
 
     down_parser = subparsers.add_parser(name="download", help="download file")
@@ -193,10 +677,68 @@ def _get_parser() -> argparse.ArgumentParser:
         default=4,
         help="Number of simultaneous downloads (default: %(default)s)",
     )
+    down_parser.add_argument(
+        "-s",
+        "--segments",
+        dest="segments",
+        type=int,
+        default=1,
+        help="Number of parallel connections used to download each file (default: %(default)s)",
+    )
+    down_parser.add_argument(
+        "-x",
+        "--extract",
+        dest="extract",
+        action="store_true",
+        help="extract the downloaded split archives, each volume is deleted"
+        " once it was extracted",
+    )
+    down_parser.add_argument(
+        "-a",
+        "--accounts",
+        dest="accounts",
+        metavar="ACCOUNTS",
+        default="",
+        help="spread the downloads between the given comma-separated accounts,"
+        " or 'all' the logged accounts",
+    )
     down_parser.add_argument("url", nargs="+", help="url to download or txt file path")
 
+    verify_parser = subparsers.add_parser(
+        name="verify", help="check the checksums of downloaded files"
+    )
+    verify_parser.add_argument(
+        "-w",
+        "--max-workers",
+        dest="max_workers",
+        type=int,
+        default=4,
+        help="Number of files checked and downloaded at the same time"
+        " (default: %(default)s)",
+    )
+    verify_parser.add_argument(
+        "-a",
+        "--accounts",
+        dest="accounts",
+        metavar="ACCOUNTS",
+        default="",
+        help="spread the downloads between the given comma-separated accounts,"
+        " or 'all' the logged accounts",
+    )
+    verify_parser.add_argument(
+        "--no-fetch",
+        dest="fetch",
+        action="store_false",
+        help="only report the bad files, don't download them again",
+    )
+    verify_parser.add_argument(
+        "file", nargs="+", help="uploads txt or manifest of the downloaded files"
+    )
+
     subparsers.add_parser(name="token", help="get a token")
 
+    subparsers.add_parser(name="stats", help="show the stats of the last transfer")
+
     acc_parser = subparsers.add_parser(name="accounts", help="list accounts")
     acc_parser.add_argument(
         "-r",
@@ -216,7 +758,14 @@ def _get_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def _register(client: ToDusClient2, acc: dict, config: dict) -> None:
+def _parse_rate(text: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMG]?)B?", text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid rate: {text!r}")
+    return float(match.group(1)) * 1024 ** "_KMG".index(match.group(2) or "_")
+
+
+def _register(client: "ToDusClient2", acc: dict, config: dict) -> None:
     if not client.phone_number:
         client.phone_number = normalize_phone_number(input("Enter Phone Number: "))
     client.request_code()
@@ -237,65 +786,470 @@ def _get_password(phone: str, folder: str) -> str:
     return ""
 
 
-def _upload(client: ToDusClient2, args) -> None:
+def _upload(pool: "ClientPool", args, journal: JobJournal) -> None:
     for path in args.file:
-        if args.part_size:
-            tqdm.tqdm.write(f"Splitting: {path}")
-            txt = _split_upload(client, path, args.part_size, args.max_workers)
-            tqdm.tqdm.write(f"TXT: {txt}")
+        if args.part_size and args.raw:
+            write(f"Splitting: {path}")
+            txt = _raw_split_upload(pool, path, args.part_size, args.max_workers)
+            write(f"TXT: {txt}")
+        elif args.part_size:
+            write(f"Splitting: {path}")
+            txt = _split_upload(
+                pool,
+                path,
+                args.part_size,
+                args.max_workers,
+                journal,
+                args.compression,
+                args.level,
+            )
+            write(f"TXT: {txt}")
         else:
-            tqdm.tqdm.write(f"Uploading: {path}")
-            pbar = tqdm.tqdm(total=1)
-            with open(path, "rb") as file:
-                data = file.read()
-            client.login()
-            url = client.upload_file(data, len(data))
-            pbar.update(1)
-            pbar.refresh()
-            url += "?name=" + quote_plus(os.path.basename(path))
-            tqdm.tqdm.write(f"URL: {url}")
+            write(f"Uploading: {path}")
+            progress = TransferProgress(os.path.getsize(path), parts=False)
+            pool.login()
+            url = _upload_file(pool, path, progress)
+            progress.close()
+            if url:
+                url += "?name=" + quote_plus(os.path.basename(path))
+                write(f"URL: {url}")
+
+
+def _upload_file(
+    pool: "ClientPool", path: str, progress: TransferProgress
+) -> Optional[str]:
+    urls = []
+    size = os.path.getsize(path)
+    part = progress.part(path, size)
+
+    def upload(client: "ToDusClient2", _attempt: int) -> int:
+        part.reset()
+        with open(path, "rb") as file:
+            urls.append(client.upload_file(file, size, progress=part))
+        return size
 
+    return urls[-1] if _retry(pool, path, upload, part) else None
 
-def _download(client: ToDusClient2, args) -> None:
-    downloads = []
-    for url in args.url:
+
+def _download(pool: "ClientPool", args, journal: JobJournal) -> None:
+    downloads: List[tuple] = []
+    # the sizes of the files are not known, the files of the first arguments
+    # are downloaded first
+    priorities: List[int] = []
+    for index, url in enumerate(args.url):
+        manifest = split.find_manifest(url)
         if url.startswith("http"):
             url, name = url.split("?name=", maxsplit=1)
-            downloads.append((url, unquote_plus(name)))
+            downloads.append((url, unquote_plus(name), None))
+            priorities.append(-index)
+        elif manifest:
+            _manifest_download(pool, manifest, args, journal)
         else:
             with open(url, encoding="utf-8") as file:
                 for line in file.readlines():
                     line = line.strip()
                     if line:
-                        url, name = line.split(maxsplit=1)
-                        downloads.append((url, name))
+                        downloads.append(_parse_txt_line(line))
+                        priorities.append(-index)
+
+    failed = _download_all(
+        pool, downloads, args.max_workers, args.segments, journal, priorities
+    )
+    if args.extract and failed:
+        write(f"Not extracting, {failed} downloads failed")
+    elif args.extract:
+        # the archive formats keep their header at the end, so the volumes can
+        # only be read once all of them were downloaded
+        for basename in dict.fromkeys(
+            archive.volumes_basename(name) for _, name, _ in downloads
+        ):
+            if basename:
+                write(f"Extracting: {basename}")
+                archive.extract_archive(basename)
+
+
+def _download_all(
+    pool: "ClientPool",
+    downloads: List[tuple],
+    max_workers: int,
+    segments: int,
+    journal: JobJournal,
+    priorities: List[int] = None,
+) -> int:
+    """Download the ``(url, name, sha256)`` files that don't exist yet, with
+    the given priorities (see ``TransferScheduler``), returns the number of
+    downloads that failed."""
+    priorities = priorities or [0] * len(downloads)
+    pending = []
+    pending_priorities = []
+    for download, priority in zip(downloads, priorities):
+        if not os.path.exists(download[1]):
+            pending.append(download)
+            pending_priorities.append(priority)
+    # the sizes are not known until the downloads start
+    progress = TransferProgress(unknown=len(pending))
+    for url, name, _ in downloads:
+        if os.path.exists(name):
+            write(f"Skipping: {name} ({_short_url(url)})")
+            progress.skip(os.path.getsize(name))
+    pool.login()
+    source = pool.primary
+    task = functools.partial(
+        _download_task,
+        pool=pool,
+        source=source,
+        progress=progress,
+        segments=segments,
+        journal=journal,
+    )
+    with TransferScheduler(max_workers) as scheduler:
+        futures = _schedule(
+            scheduler,
+            task,
+            pending,
+            lambda items: source.resolve_urls(url for url, _, _ in items),
+            pool.logger,
+            priorities=pending_priorities,
+        )
+    progress.close()
+    return [future.result() for future in futures].count(False)
 
-    pool = ThreadPoolExecutor(max_workers=args.max_workers)
-    pbar = tqdm.tqdm(total=len(downloads))
-    task = functools.partial(_download_task, client=client, pbar=pbar)
-    client.login()
-    for _ in pool.map(task, downloads):
-        pbar.refresh()
 
+def _verify(pool: "ClientPool", args, journal: JobJournal) -> None:
+    """Check the downloaded files of the given uploads txt and manifest files
+    in parallel, the bad files or parts are downloaded again."""
+    # (name, path, offset, size, sha256, source) of the data to check, the
+    # source is the manifest of a part or the (url, name, sha256) of a file
+    checks: List[tuple] = []
+    for path in args.file:
+        manifest_path = split.find_manifest(path)
+        if manifest_path:
+            manifest = split.load_manifest(manifest_path)
+            name = manifest["name"]
+            if not os.path.exists(name):
+                status = "Incomplete" if os.path.exists(f"{name}.part") else "Missing"
+                write(f"{status}: {name}")
+                continue
+            for part in manifest["parts"]:
+                checks.append(
+                    (
+                        part["name"],
+                        name,
+                        part["offset"],
+                        part["size"],
+                        part["sha256"],
+                        manifest,
+                    )
+                )
+            continue
+        with open(path, encoding="utf-8") as file:
+            for line in file.readlines():
+                line = line.strip()
+                if line:
+                    download = _parse_txt_line(line)
+                    name = download[1]
+                    checks.append((name, name, 0, None, download[2], download))
+
+    def check(item: tuple) -> str:
+        _, path, offset, size, sha256, _ = item
+        if not sha256:
+            return "Unknown"
+        if not os.path.exists(path):
+            return "Missing"
+        if size is None:
+            size = os.path.getsize(path)
+        return "OK" if split.file_sha256(path, offset, size) == sha256 else "BAD"
+
+    bad = []
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        for item, status in zip(checks, executor.map(check, checks)):
+            write(f"{status}: {item[0]}")
+            if status == "BAD":
+                bad.append(item)
+    write(f"Checked: {len(checks)} ({len(bad)} bad)")
+    if bad and args.fetch:
+        failed = _fetch_bad(pool, bad, args.max_workers, journal)
+        if failed:
+            write(f"Still bad: {failed}")
+
+
+def _fetch_bad(
+    pool: "ClientPool", bad: List[tuple], max_workers: int, journal: JobJournal
+) -> int:
+    """Download again the bad files and parts found by ``_verify()``,
+    returns the number of downloads that failed."""
+    downloads = [item[5] for item in bad if isinstance(item[5], tuple)]
+    for _, name, _ in downloads:
+        os.remove(name)
+    failed = _download_all(pool, downloads, max_workers, 1, journal)
+
+    parts: dict = {}
+    for name, path, *_, source in bad:
+        if isinstance(source, dict):
+            names = parts.setdefault(path, (source, set()))[1]
+            names.add(name)
+    for path, (manifest, names) in parts.items():
+        pending = [part for part in manifest["parts"] if part["name"] in names]
+        layout = json.dumps(manifest["parts"], sort_keys=True).encode()
+        job = journal.open(
+            "manifest-download",
+            os.path.abspath(path),
+            hashlib.sha256(layout).hexdigest(),
+        )
+        progress = TransferProgress(sum(part["size"] for part in pending))
+        pool.login()
+        task = functools.partial(
+            _download_range_task,
+            path=path,
+            pool=pool,
+            source=pool.primary,
+            progress=progress,
+            job=job,
+        )
+        with TransferScheduler(max_workers) as scheduler:
+            futures = _schedule(
+                scheduler,
+                task,
+                pending,
+                lambda parts: iter(()),
+                pool.logger,
+                sizes=[part["size"] for part in pending],
+            )
+        progress.close()
+        failed += [future.result() for future in futures].count(False)
+        job.remove()
+    return failed
 
-def _download_task(download: tuple, client: ToDusClient2, pbar: tqdm.tqdm) -> None:
-    url, name = download
-    url_display = url if len(url) < 50 else url[:50] + "..."
+
+def _manifest_download(
+    pool: "ClientPool", manifest_path: str, args, journal: JobJournal
+) -> None:
+    manifest = split.load_manifest(manifest_path)
+    name = manifest["name"]
     if os.path.exists(name):
-        tqdm.tqdm.write(f"Skipping: {name} ({url_display})")
-        pbar.update(1)
+        write(f"Skipping: {name}")
         return
-    tqdm.tqdm.write(f"Downloading: {name} ({url_display})")
-    while True:
+    write(f"Downloading: {name} ({len(manifest['parts'])} parts)")
+    temp_path = f"{name}.part"
+    layout = json.dumps(manifest["parts"], sort_keys=True).encode()
+    job = journal.open(
+        "manifest-download",
+        os.path.abspath(name),
+        hashlib.sha256(layout).hexdigest(),
+    )
+    pending = []
+    downloaded = 0
+    if os.path.exists(temp_path):
+        # resume: keep the parts that were already downloaded, the parts not
+        # in the journal are checked
+        done = job.parts()
+        for part in manifest["parts"]:
+            if part["name"] in done or split.file_sha256(
+                temp_path, part["offset"], part["size"]
+            ) == (part["sha256"]):
+                downloaded += part["size"]
+            else:
+                pending.append(part)
+    else:
+        job.reset()
+        pending = manifest["parts"]
+    progress = TransferProgress(sum(part["size"] for part in pending))
+    progress.skip(downloaded)
+    with open(temp_path, "ab") as file:
+        file.truncate(manifest["size"])
+    pool.login()
+    source = pool.primary
+    task = functools.partial(
+        _download_range_task,
+        path=temp_path,
+        pool=pool,
+        source=source,
+        progress=progress,
+        job=job,
+    )
+    with TransferScheduler(args.max_workers) as scheduler:
+        futures = _schedule(
+            scheduler,
+            task,
+            pending,
+            lambda parts: source.resolve_urls(part["url"] for part in parts),
+            pool.logger,
+            sizes=[part["size"] for part in pending],
+        )
+    progress.close()
+    failed = [future.result() for future in futures].count(False)
+    if failed:
+        write(f"Incomplete: {name} ({failed} parts failed)")
+    else:
+        os.rename(temp_path, name)
+        job.remove()
+
+
+def _download_range_task(
+    part: dict,
+    real_url: Optional[str],
+    copy: Attempt,
+    path: str,
+    pool: "ClientPool",
+    source: "ToDusClient2",
+    progress: TransferProgress,
+    job: Job,
+) -> bool:
+    if copy.speculative:
+        write(f"Downloading again: {part['name']}")
+    part_progress = progress.part(part["name"], part["size"])
+    on_progress = copy.watch(part_progress)
+
+    def download(client: "ToDusClient2", attempt: int) -> int:
+        part_progress.reset()
+        resolved = real_url if client is source and not attempt else None
+        if copy.speculative:
+            # the first copy may still be writing its range, the part is
+            # downloaded apart and copied into the range if it wins
+            os.makedirs(job.folder, exist_ok=True)
+            copy_path = os.path.join(job.folder, part["name"])
+            with open(copy_path, "wb") as file:
+                client.download_into(
+                    part["url"], file, None, on_progress, part["sha256"]
+                )
+            copy.claim()
+            with open(copy_path, "rb") as src, open(path, "r+b") as file:
+                file.seek(part["offset"])
+                shutil.copyfileobj(src, file)
+            os.remove(copy_path)
+        else:
+            with open(path, "r+b") as file:
+                file.seek(part["offset"])
+                client.download_into(
+                    part["url"],
+                    copy.guard(file),  # type: ignore
+                    resolved,
+                    on_progress,
+                    part["sha256"],
+                )
+            copy.claim()
+        # the part is in the journal only once it is on disk
+        _fsync(path)
+        job.update_part(part["name"], "done", part["url"], part["size"])
+        return part["size"]
+
+    return _retry(pool, part["name"], download, part_progress, copy)
+
+
+def _download_task(
+    download: tuple,
+    real_url: Optional[str],
+    copy: Attempt,
+    pool: "ClientPool",
+    source: "ToDusClient2",
+    progress: TransferProgress,
+    segments: int,
+    journal: JobJournal,
+    interval: float = 5.0,
+) -> bool:
+    if copy.speculative:
+        return _download_copy(download, copy, pool, progress, segments, journal)
+    url, name, sha256 = download
+    write(f"Downloading: {name} ({_short_url(url)})")
+    part = progress.part(name)
+    temp_path = f"{name}.part"
+    job = journal.open("download", os.path.abspath(name), url)
+    checkpoint = job.parts().get(name)
+    if segments > 1:
+        # segmented downloads keep their own state next to the file
+        job.reset()
+    elif checkpoint and os.path.exists(temp_path):
+        # the bytes written after the last checkpoint may not be on disk
+        if os.path.getsize(temp_path) > checkpoint["offset"]:
+            os.truncate(temp_path, checkpoint["offset"])
+    next_checkpoint = time.monotonic() + interval
+
+    def on_progress(size: int) -> None:
+        nonlocal next_checkpoint
+        copy.check()
+        part(size)
+        if segments == 1 and time.monotonic() >= next_checkpoint:
+            next_checkpoint = time.monotonic() + interval
+            with copy.exclusive():
+                job.update_part(name, "partial", url, offset=_fsync(temp_path))
+
+    def download_file(client: "ToDusClient2", attempt: int) -> int:
+        # interrupted downloads are resumed, the progress is kept
+        resolved = real_url if client is source and not attempt else None
         try:
-            client.download_file(url, name)
-            pbar.update(1)
-            break
-        except Exception as err:
-            client.logger.exception(err)
-            time.sleep(15)
-            client.login()
-            tqdm.tqdm.write(f"Retrying: {name} (ERROR: {err})")
+            size = client.download_file(
+                url, name, resolved, segments, on_progress, sha256
+            )
+        except OSError:
+            copy.check()  # the partial file was removed by the copy that won
+            raise
+        copy.claim()
+        return size
+
+    done = _retry(pool, name, download_file, part, copy)
+    if done:
+        job.remove()
+    elif segments == 1 and os.path.exists(temp_path):
+        with suppress(TransferCancelled), copy.exclusive():
+            job.update_part(name, "partial", url, offset=_fsync(temp_path))
+    return done
+
+
+def _download_copy(
+    download: tuple,
+    copy: Attempt,
+    pool: "ClientPool",
+    progress: TransferProgress,
+    segments: int,
+    journal: JobJournal,
+) -> bool:
+    """Download again a file that is taking too long next to the first copy,
+    the file is replaced by the copy if it finishes first."""
+    url, name, sha256 = download
+    write(f"Downloading again: {name} ({_short_url(url)})")
+    copy_path = f"{name}.copy"
+    progress.add_unknown()
+    part = progress.part(f"{name} (copy)")
+    on_progress = copy.watch(part)
+
+    def download_file(client: "ToDusClient2", _attempt: int) -> int:
+        size = client.download_file(url, copy_path, None, segments, on_progress, sha256)
+        copy.claim()
+        os.replace(copy_path, name)
+        return size
+
+    done = _retry(pool, name, download_file, part, copy)
+    if done:
+        # the first copy is cancelled
+        _remove_partial(name)
+        journal.open("download", os.path.abspath(name), url).remove()
+    else:
+        _remove_partial(copy_path)
+        with suppress(FileNotFoundError):
+            os.remove(copy_path)
+    return done
+
+
+def _remove_partial(path: str) -> None:
+    """Remove the partial download of the given file, if any."""
+    for temp_path in (f"{path}.part", f"{path}.part.json"):
+        with suppress(FileNotFoundError):
+            os.remove(temp_path)
+
+
+def _fsync(path: str) -> int:
+    """Flush the given file to disk, returns the size flushed."""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        os.fsync(fd)
+        return size
+    finally:
+        os.close(fd)
+
+
+def _short_url(url: str) -> str:
+    return url if len(url) < 50 else url[:50] + "..."
 
 
 def _select_account(phone_number: str, config: dict) -> dict:
@@ -313,6 +1267,52 @@ def _select_account(phone_number: str, config: dict) -> dict:
     return acc
 
 
+@contextmanager
+def _export_metrics(metrics: Metrics, args) -> Iterator[None]:
+    if not args.metrics or args.metrics_format != "jsonl":
+        yield
+        return
+    with open(args.metrics, "a", encoding="utf-8") as file:
+        exporter = JsonLinesExporter(file)
+        metrics.add_hook(exporter)
+        try:
+            yield
+        finally:
+            metrics.hooks.remove(exporter)
+
+
+def _save_stats(summary: Summary, args) -> None:
+    events = summary.to_dict()
+    with open(STATS_PATH, "w", encoding="utf-8") as file:
+        json.dump(events, file)
+    if args.metrics and args.metrics_format == "prometheus":
+        with open(args.metrics, "w", encoding="utf-8") as file:
+            file.write(summary.prometheus())
+    write(f"Stats:\n{format_summary(events)}")
+
+
+def _print_stats() -> None:
+    if not os.path.exists(STATS_PATH):
+        print("No stats yet.")
+        return
+    with open(STATS_PATH, encoding="utf-8") as file:
+        print(format_summary(json.load(file)))
+
+
+def _select_accounts(accounts: str, config: dict) -> List[dict]:
+    if accounts == "all":
+        logged = [acc for acc in config["accounts"] if acc["password"]]
+        return logged or [_select_account("", config)]
+    return [_select_account(number, config) for number in accounts.split(",")]
+
+
+def _expire_account(acc: dict, config: dict, token_cache: TokenCache) -> None:
+    acc["password"] = ""
+    _save_config(config)
+    token_cache.remove(acc["phone_number"])
+    print(f"ERROR: Session expired for account: {acc['phone_number']}")
+
+
 def _list_accounts(config: dict) -> None:
     if not config["accounts"]:
         print("No accounts added yet.")
@@ -327,37 +1327,21 @@ def _list_accounts(config: dict) -> None:
 
 def main() -> None:
     """CLI program."""
+    pool: Optional["ClientPool"] = None
     try:
         parser = _get_parser()
         args = parser.parse_args()
 
+        _init_program_folder()
         config = _get_config()
-        if args.command == "login":
-            acc = dict(phone_number=args.number, password="")
-        else:
-            acc = _select_account(args.number, config)
-
-        client = ToDusClient2(
-            acc["phone_number"], acc["password"], logger=_get_logger()
-        )
-        if not client.registered and args.command not in ("", "login", "accounts"):
-            print("ERROR: account not authenticated, login first.")
-            return
-        if args.command == "upload":
-            _upload(client, args)
-        elif args.command == "download":
-            _download(client, args)
-        elif args.command == "login":
-            _register(client, acc, config)
-        elif args.command == "token":
-            client.login()
-            print(client.token)
-        elif args.command == "accounts":
+        token_cache = TokenCache(TOKENS_PATH)
+        if args.command == "accounts":
             if args.remove:
                 for acc in config["accounts"]:
                     if args.remove == acc["phone_number"]:
                         config["accounts"].remove(acc)
                         _save_config(config)
+                        token_cache.remove(acc["phone_number"])
                         print(f"Account {acc['phone_number']!r} removed.")
                         break
                 else:
@@ -374,24 +1358,118 @@ def main() -> None:
                     print(f"ERROR: Account {args.default!r} not found.")
             else:
                 _list_accounts(config)
-        else:
+            return
+        if args.command == "stats":
+            _print_stats()
+            return
+        if not args.command:
             parser.print_usage()
+            return
+
+        if args.command == "login":
+            accounts = [dict(phone_number=args.number, password="")]
+        elif getattr(args, "accounts", ""):
+            accounts = _select_accounts(args.accounts, config)
+        else:
+            accounts = [_select_account(args.number, config)]
+        acc = accounts[0]
+
+        # only the commands that connect to the server import the client
+        from .client import RetryPolicy, ToDusClient2  # pylint: disable=C0415,W0621
+        from .pool import ClientPool  # pylint: disable=C0415,W0621
+
+        logger = _get_logger()
+        summary = Summary()
+        metrics = Metrics([summary])
+        upload_cache = (
+            UploadCache(UPLOADS_PATH, validate=args.check_cache)
+            if getattr(args, "cache", False)
+            else None
+        )
+        retry_policy = RetryPolicy(
+            max_delay=args.max_delay,
+            retries=args.retries,
+            budget=args.retry_budget,
+        )
+        upload_limiter = RateLimiter(args.upload_limit)
+        download_limiter = RateLimiter(args.download_limit)
+        clients = [
+            ToDusClient2(
+                acc["phone_number"],
+                acc["password"],
+                logger=logger,
+                max_queries=getattr(args, "max_workers", 1),
+                max_connections=getattr(args, "max_workers", 1)
+                * getattr(args, "segments", 1),
+                token_cache=token_cache,
+                retry_policy=retry_policy,
+                metrics=metrics,
+                upload_cache=upload_cache,
+                upload_limiter=RateLimiter(args.account_limit, parent=upload_limiter),
+                download_limiter=RateLimiter(
+                    args.account_limit, parent=download_limiter
+                ),
+            )
+            for acc in accounts
+        ]
+        client = clients[0]
+        if (
+            not all(client.registered for client in clients)
+            and args.command != "login"
+            and getattr(args, "fetch", True)
+        ):
+            print("ERROR: account not authenticated, login first.")
+            return
+        if args.command in ("upload", "download", "verify"):
+            pool = ClientPool(clients)
+            journal = JobJournal(JOBS_FOLDER)
+            try:
+                with _export_metrics(metrics, args):
+                    if args.command == "upload":
+                        _upload(pool, args, journal)
+                    elif args.command == "download":
+                        _download(pool, args, journal)
+                    else:
+                        _verify(pool, args, journal)
+            finally:
+                journal.close()
+                _save_stats(summary, args)
+        elif args.command == "login":
+            _register(client, acc, config)
+        elif args.command == "token":
+            client.login()
+            print(client.token)
+        for client in clients:
+            logger.debug("%s: %s", client.phone_number, client.connection_stats)
+            client.close()
     except AuthenticationError:
-        acc["password"] = ""
-        _save_config(config)
-        print(f"ERROR: Session expired for account: {acc['phone_number']}")
+        if pool is None:
+            _expire_account(acc, config, token_cache)
     except KeyboardInterrupt:
         print("\nOperation canceled by user.")
         os._exit(1)  # noqa
+    finally:
+        if pool is not None:
+            for acc, client in zip(accounts, clients):
+                if client in pool.removed:
+                    _expire_account(acc, config, token_cache)
+
+
+def _init_program_folder() -> None:
+    if not os.path.exists(PROGRAM_FOLDER):
+        os.makedirs(PROGRAM_FOLDER)
+    if not os.path.exists(CONFIG_PATH):
+        _save_config(
+            {
+                "accounts": [],
+            }
+        )
 
 
 PROGRAM_FOLDER = os.path.expanduser("~/.todus")
 CONFIG_PATH = os.path.join(PROGRAM_FOLDER, "config.json")
-if not os.path.exists(PROGRAM_FOLDER):
-    os.makedirs(PROGRAM_FOLDER)
-if not os.path.exists(CONFIG_PATH):
-    _save_config(
-        {
-            "accounts": [],
-        }
-    )
+TOKENS_PATH = os.path.join(PROGRAM_FOLDER, "tokens.json")
+STATS_PATH = os.path.join(PROGRAM_FOLDER, "stats.json")
+JOBS_FOLDER = os.path.join(PROGRAM_FOLDER, "jobs")
+UPLOADS_PATH = os.path.join(PROGRAM_FOLDER, "uploads.json")
+_SHA256_COLUMN = re.compile(r"\t([0-9a-f]{64})$")
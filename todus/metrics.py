@@ -0,0 +1,164 @@
+"""Transfer metrics and tracing hooks.
+
+The client reports what it does as events, dicts with the ``event`` name,
+the wall-clock ``time`` and, depending on the event, the ``duration`` in
+seconds, the number of ``bytes`` transferred and the ``error`` name if it
+failed:
+
+- ``xmpp.connect``, ``xmpp.tls``, ``xmpp.auth`` and ``xmpp.bind``: the
+  phases of the XMPP session start.
+- ``xmpp.iq``: round trip of an XMPP query, ``query`` is its namespace
+  (``todus:purl`` to reserve URLs, ``todus:gurl`` to resolve them).
+- ``login``: request of a new access token.
+- ``http.ttfb``: time until the response headers of a download arrive.
+- ``upload`` and ``download``: transfer of the body of a file (or of a
+  byte range for segmented downloads).
+- ``upload.cached``: upload skipped because the data was already uploaded.
+- ``retry``: a failed operation is going to be retried.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, TextIO
+
+Hook = Callable[[dict], None]
+
+
+class Metrics:
+    """Dispatcher of events to the registered hooks.
+
+    Hooks are called with every event from the thread that produced it, they
+    must be thread-safe and fast. Events are not built if there are no hooks.
+    """
+
+    def __init__(self, hooks: List[Hook] = None) -> None:
+        self.hooks: List[Hook] = list(hooks or [])
+
+    def add_hook(self, hook: Hook) -> None:
+        """Call ``hook(event)`` for every event from now on."""
+        self.hooks.append(hook)
+
+    def emit(self, event: str, **fields) -> None:
+        """Report an event with the given fields."""
+        if not self.hooks:
+            return
+        record = dict(event=event, time=time.time(), **fields)
+        for hook in self.hooks:
+            hook(record)
+
+    @contextmanager
+    def timer(self, event: str, **fields) -> Iterator[dict]:
+        """Report an event with the duration of the ``with`` block.
+
+        The yielded dict holds the fields of the event and can be updated
+        inside the block, if the block fails the ``error`` is added.
+        """
+        started = time.perf_counter()
+        try:
+            yield fields
+        except Exception as err:
+            fields["error"] = type(err).__name__
+            raise
+        finally:
+            self.emit(event, duration=time.perf_counter() - started, **fields)
+
+
+class JsonLinesExporter:
+    """Hook that writes every event as a line of JSON to the given file."""
+
+    def __init__(self, file: TextIO) -> None:
+        self.file = file
+        self._lock = Lock()
+
+    def __call__(self, event: dict) -> None:
+        line = json.dumps(event)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
+class Summary:
+    """Hook that aggregates the events by name.
+
+    For every event name it keeps the ``count``, ``errors``, total
+    ``duration``, ``max_duration`` and total ``bytes``.
+    """
+
+    def __init__(self) -> None:
+        self.events: Dict[str, dict] = {}
+        self._lock = Lock()
+
+    def __call__(self, event: dict) -> None:
+        with self._lock:
+            stats = self.events.get(event["event"])
+            if stats is None:
+                stats = self.events[event["event"]] = dict(
+                    count=0, errors=0, duration=0.0, max_duration=0.0, bytes=0
+                )
+            stats["count"] += 1
+            stats["errors"] += "error" in event
+            duration = event.get("duration", 0.0)
+            stats["duration"] += duration
+            stats["max_duration"] = max(stats["max_duration"], duration)
+            stats["bytes"] += event.get("bytes", 0)
+
+    def to_dict(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.events.items()}
+
+    def prometheus(self) -> str:
+        """Get the summary in the Prometheus text exposition format."""
+        return format_prometheus(self.to_dict())
+
+    def __str__(self) -> str:
+        return format_summary(self.to_dict())
+
+
+def format_summary(events: Dict[str, dict]) -> str:
+    """Get a table of the given summary, see ``Summary.to_dict()``."""
+    lines = [
+        f"{'EVENT':<14}{'COUNT':>8}{'ERRORS':>8}{'AVG (s)':>10}{'MAX (s)':>10}"
+        f"{'TOTAL (s)':>11}{'MiB':>10}{'MiB/s':>9}"
+    ]
+    for name, stats in sorted(events.items()):
+        avg = stats["duration"] / stats["count"] if stats["count"] else 0.0
+        line = (
+            f"{name:<14}{stats['count']:>8}{stats['errors']:>8}{avg:>10.3f}"
+            f"{stats['max_duration']:>10.3f}{stats['duration']:>11.2f}"
+        )
+        if stats["bytes"]:
+            mib = stats["bytes"] / 1024 ** 2
+            speed = mib / stats["duration"] if stats["duration"] else 0.0
+            line += f"{mib:>10.1f}{speed:>9.2f}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def format_prometheus(events: Dict[str, dict]) -> str:
+    """Get the given summary in the Prometheus text exposition format."""
+    metrics = (
+        ("todus_events_total", "counter", "count", "Number of events."),
+        ("todus_event_errors_total", "counter", "errors", "Number of failed events."),
+        (
+            "todus_event_duration_seconds_total",
+            "counter",
+            "duration",
+            "Total duration of the events.",
+        ),
+        (
+            "todus_event_duration_seconds_max",
+            "gauge",
+            "max_duration",
+            "Longest duration of an event.",
+        ),
+        ("todus_bytes_total", "counter", "bytes", "Bytes transferred."),
+    )
+    lines = []
+    for metric, kind, key, help_text in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, stats in sorted(events.items()):
+            lines.append(f'{metric}{{event="{name}"}} {stats[key]}')
+    return "\n".join(lines) + "\n"
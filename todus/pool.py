@@ -0,0 +1,177 @@
+"""Multi-account load balancing."""
+
+import logging
+import time
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .client import RetryPolicy, ToDusClient2
+from .errors import AuthenticationError
+
+
+class _AccountStats:
+    def __init__(self) -> None:
+        self.active = 0
+        self.throughput: Optional[float] = None
+        self.error_rate = 0.0
+
+
+class ClientPool:
+    """Pool of clients of different accounts that spreads the transfers
+    between them.
+
+    Every transfer goes to the account with the best expected speed: its
+    throughput (an exponentially weighted moving average of the bytes per
+    second of its transfers) weighted by its error rate (also a moving
+    average) and divided among its running transfers. Accounts without
+    transfers yet are assumed to be as fast as the fastest account.
+
+    An account is removed from the pool when its password is rejected and
+    its transfers move to the other accounts, see ``call()``.
+    """
+
+    def __init__(
+        self,
+        clients: Iterable[ToDusClient2],
+        alpha: float = 0.3,
+        logger: logging.Logger = None,
+    ) -> None:
+        self.clients: List[ToDusClient2] = list(clients)
+        self.removed: List[ToDusClient2] = []
+        self.alpha = alpha
+        self.logger = logger or self.clients[0].logger
+        self.retry_policy: RetryPolicy = self.clients[0].retry_policy
+        self._stats: Dict[int, _AccountStats] = {
+            id(client): _AccountStats() for client in self.clients
+        }
+        self._lock = Lock()
+
+    @property
+    def primary(self) -> ToDusClient2:
+        """The first account still in the pool."""
+        with self._lock:
+            if not self.clients:
+                raise AuthenticationError("No accounts left")
+            return self.clients[0]
+
+    def login(self) -> None:
+        """Login all the accounts, the accounts that fail to login are
+        removed."""
+        for client in list(self.clients):
+            try:
+                client.login()
+            except AuthenticationError:
+                self.remove(client)
+
+    def acquire(self) -> ToDusClient2:
+        """Get the account for a new transfer, ``release()`` it once the
+        transfer ends."""
+        with self._lock:
+            if not self.clients:
+                raise AuthenticationError("No accounts left")
+            known = [
+                self._stats[id(client)].throughput or 0.0 for client in self.clients
+            ]
+            default = max(known) or 1.0
+            client = max(self.clients, key=lambda client: self._score(client, default))
+            self._stats[id(client)].active += 1
+            return client
+
+    def release(
+        self,
+        client: ToDusClient2,
+        size: int = 0,
+        elapsed: float = 0.0,
+        failed: bool = False,
+    ) -> None:
+        """Report the end of a transfer of ``size`` bytes that took
+        ``elapsed`` seconds."""
+        with self._lock:
+            stats = self._stats[id(client)]
+            stats.active -= 1
+            stats.error_rate += self.alpha * (failed - stats.error_rate)
+            if size and elapsed > 0:
+                throughput = size / elapsed
+                if stats.throughput is None:
+                    stats.throughput = throughput
+                else:
+                    stats.throughput += self.alpha * (throughput - stats.throughput)
+
+    def remove(self, client: ToDusClient2) -> None:
+        """Remove an account from the pool, raises ``AuthenticationError`` if
+        no accounts are left."""
+        with self._lock:
+            if client in self.clients:
+                self.logger.warning("Removing account: %s", client.phone_number)
+                self.clients.remove(client)
+                self.removed.append(client)
+            if not self.clients:
+                raise AuthenticationError("No accounts left")
+
+    def call(
+        self,
+        func: Callable[[ToDusClient2, int], int],
+        on_retry: Callable[[Exception, int], None] = None,
+        check: Callable[[], None] = None,
+    ) -> int:
+        """Call ``func(client, attempt)`` retrying it with the retry policy.
+
+        Every attempt is done with the best account at the time, ``func``
+        returns the number of bytes transferred. If the token of the
+        account is rejected it is refreshed, and if the account can't login
+        anymore it is removed from the pool and the operation is started
+        again with the other accounts.
+
+        ``check()`` is called before every attempt and after it fails, it
+        raises to stop retrying (like ``todus.scheduler.Attempt.check()``
+        once another copy of the transfer won).
+        """
+        while True:
+            current: List[ToDusClient2] = []
+
+            def attempt(number: int) -> int:
+                if check:
+                    check()
+                client = self.acquire()
+                current[:] = [client]
+                started = time.monotonic()
+                try:
+                    size = func(client, number)
+                except Exception as err:
+                    if check:
+                        try:
+                            check()
+                        except Exception:
+                            # the error is caused by the cancellation
+                            self.release(client)
+                            raise
+                    failed = self.retry_policy.classify(err) != RetryPolicy.FAIL
+                    self.release(client, failed=failed)
+                    raise
+                self.release(client, size, time.monotonic() - started)
+                return size
+
+            def refresh() -> None:
+                current[0].login(force=True)
+
+            def retry(err: Exception, number: int) -> None:
+                current[0].metrics.emit("retry", error=type(err).__name__)
+                if on_retry:
+                    on_retry(err, number)
+
+            try:
+                return self.retry_policy.call(attempt, refresh, retry)
+            except AuthenticationError:
+                if not current:
+                    raise
+                self.remove(current[0])
+
+    def close(self) -> None:
+        """Close the XMPP sessions of all the accounts."""
+        for client in self.clients + self.removed:
+            client.close()
+
+    def _score(self, client: ToDusClient2, default: float) -> float:
+        stats = self._stats[id(client)]
+        throughput = stats.throughput or default
+        return throughput * max(1 - stats.error_rate, 0.05) / (stats.active + 1)
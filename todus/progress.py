@@ -0,0 +1,170 @@
+"""Byte progress bars for parallel transfers."""
+
+import time
+from threading import Lock
+from typing import TYPE_CHECKING, Optional, Type
+
+if TYPE_CHECKING:
+    import tqdm
+
+
+def write(text: str) -> None:
+    """Print a line without breaking the progress bars."""
+    _tqdm().write(text)
+
+
+def _tqdm() -> Type["tqdm.tqdm"]:
+    # tqdm is slow to import, it is only imported once there is something to
+    # show
+    import tqdm  # pylint: disable=C0415,W0621
+
+    return tqdm.tqdm
+
+
+def _bar(total: Optional[int], **kwargs) -> "tqdm.tqdm":
+    return _tqdm()(total=total, unit="B", unit_scale=True, unit_divisor=1024, **kwargs)
+
+
+class TransferProgress:
+    """Total progress of parallel transfers in bytes, with speed and ETA.
+
+    Every transfer reports its bytes to its own ``part()``, the parts are
+    thread-safe and pass the bytes to the bars at most every ``interval``
+    seconds so the progress callbacks are cheap.
+
+    ``unknown`` is the number of transfers whose size is not known in
+    advance, the total is estimated from the average size of the finished
+    ones. If ``parts`` is ``False`` only the total bar is shown.
+    """
+
+    def __init__(
+        self,
+        total: int = 0,
+        unknown: int = 0,
+        interval: float = 0.1,
+        parts: bool = True,
+    ) -> None:
+        self.interval = interval
+        self.parts = parts
+        self._known = total
+        self._unknown = unknown
+        self._unknown_done = 0
+        self._unknown_bytes = 0
+        self._lock = Lock()
+        self._bar = _bar(self._estimate())
+
+    def add_total(self, size: int) -> None:
+        """Add ``size`` bytes to transfer to the total."""
+        with self._lock:
+            self._known += size
+            self._set_total()
+
+    def add_unknown(self, count: int = 1) -> None:
+        """Add ``count`` transfers of unknown size to the total."""
+        with self._lock:
+            self._unknown += count
+            self._set_total()
+
+    def skip(self, size: int) -> None:
+        """Count ``size`` bytes that were already transferred."""
+        with self._lock:
+            self._known += size
+            self._set_total()
+            self._bar.update(size)
+
+    def part(self, name: str, size: int = None) -> "PartProgress":
+        """Get the progress callback of a transfer of ``size`` bytes, its
+        size must be already in the total (or one of the ``unknown``)."""
+        return PartProgress(self, name, size)
+
+    def update(self, size: int) -> None:
+        """Count ``size`` transferred bytes (negative to uncount them)."""
+        with self._lock:
+            self._bar.update(size)
+
+    def close(self) -> None:
+        with self._lock:
+            self._bar.close()
+
+    def finish(self, part: "PartProgress", done: bool) -> None:
+        """Update the estimated total with a transfer that ended."""
+        if part.size is not None:
+            return
+        with self._lock:
+            self._unknown -= 1
+            if done:
+                self._unknown_done += 1
+                self._unknown_bytes += part.count
+            self._set_total()
+
+    def _estimate(self) -> Optional[int]:
+        if not self._unknown:
+            return self._known + self._unknown_bytes
+        if not self._unknown_done:
+            return None
+        average = self._unknown_bytes / self._unknown_done
+        return self._known + self._unknown_bytes + int(average * self._unknown)
+
+    def _set_total(self) -> None:
+        self._bar.total = self._estimate()
+        self._bar.refresh()
+
+
+class PartProgress:
+    """Progress callback of a single transfer, see
+    ``TransferProgress.part()``.
+
+    Call it with the size of every chunk transferred, ``reset()`` it when
+    the transfer is started again and ``close()`` it when it ends.
+    """
+
+    def __init__(self, total: TransferProgress, name: str, size: int = None) -> None:
+        self.total = total
+        self.name = name
+        self.size = size
+        self.count = 0
+        self._pending = 0
+        self._next_flush = 0.0
+        self._lock = Lock()
+        self._bar = (
+            _bar(size, desc=name, leave=False, mininterval=total.interval)
+            if total.parts
+            else None
+        )
+
+    def __call__(self, size: int) -> None:
+        with self._lock:
+            self._pending += size
+            now = time.monotonic()
+            if now >= self._next_flush:
+                self._next_flush = now + self.total.interval
+                self._flush()
+
+    def reset(self) -> None:
+        """Uncount the bytes transferred so far."""
+        with self._lock:
+            self._flush()
+            self.total.update(-self.count)
+            if self._bar is not None:
+                self._bar.reset(self.size)
+            self.count = 0
+
+    def close(self, done: bool = True) -> None:
+        """Remove the bar of the transfer, if not ``done`` its bytes are
+        uncounted."""
+        if not done:
+            self.reset()
+        with self._lock:
+            self._flush()
+            if self._bar is not None:
+                self._bar.close()
+        self.total.finish(self, done)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        self.count += self._pending
+        if self._bar is not None:
+            self._bar.update(self._pending)
+        self.total.update(self._pending)
+        self._pending = 0
@@ -0,0 +1,78 @@
+"""Bandwidth limits of the transfers."""
+
+import time
+from threading import Condition
+from typing import Callable
+
+
+class RateLimiter:
+    """Token bucket that limits the bytes per second of the transfers that
+    share it.
+
+    Every transfer calls ``acquire()`` with the size of each chunk before
+    sending it (or after receiving it). The bytes are let through in the
+    order they were requested, so the threads sharing the limiter get a fair
+    share of the ``rate``. Up to ``burst`` seconds of unused rate can be
+    spent at once.
+
+    ``rate`` is in bytes per second, ``0`` means no limit, and it can be
+    changed while the transfers are running. If a ``parent`` limiter is
+    given the bytes are also acquired from it, for example to cap the
+    transfers of an account below a limit shared by all the accounts.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        burst: float = 1.0,
+        parent: "RateLimiter" = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.burst = burst
+        self.parent = parent
+        self.clock = clock
+        self._rate = rate
+        self._cond = Condition()
+        # bytes requested by the transfers and bytes let through by the
+        # bucket since it was created
+        self._requested = 0
+        self._allowed = float(burst * rate)
+        self._time = clock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float) -> None:
+        with self._cond:
+            self._refill()
+            self._rate = rate
+            # the waiting transfers get the new rate right away
+            self._cond.notify_all()
+
+    def acquire(self, size: int) -> None:
+        """Wait until ``size`` bytes can be transferred."""
+        if self._rate:
+            with self._cond:
+                self._requested += size
+                end = self._requested
+                while True:
+                    self._refill()
+                    missing = end - self._allowed
+                    if missing <= 0:
+                        break
+                    self._cond.wait(missing / self._rate)
+        if self.parent:
+            self.parent.acquire(size)
+
+    def _refill(self) -> None:
+        now = self.clock()
+        if self._rate:
+            self._allowed = min(
+                self._allowed + (now - self._time) * self._rate,
+                self._requested + self.burst * self._rate,
+            )
+        else:
+            self._allowed = self._requested
+        self._time = now
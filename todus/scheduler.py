@@ -0,0 +1,240 @@
+"""Scheduling of parallel transfers."""
+
+import heapq
+import itertools
+import statistics
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread
+from typing import Any, BinaryIO, Callable, Iterator, List, Optional
+
+from .errors import TransferCancelled
+
+
+class Attempt:
+    """A copy of a transfer run by a ``TransferScheduler``.
+
+    A transfer can run more than once at the same time (see
+    ``TransferScheduler``), so the copies must not write the same data
+    before one of them wins with ``claim()``. The others are cancelled: they
+    raise ``TransferCancelled`` in ``check()``, in the progress callback
+    returned by ``watch()``, in ``exclusive()`` or when they write to a file
+    returned by ``guard()``.
+    """
+
+    def __init__(self, transfer: "_Transfer", speculative: bool) -> None:
+        self.speculative = speculative
+        self.cancelled = False
+        self.started = time.monotonic()
+        self._transfer = transfer
+
+    def check(self) -> None:
+        """Raise ``TransferCancelled`` if another copy won."""
+        if self.cancelled:
+            raise TransferCancelled("Another copy of the transfer finished first")
+
+    def claim(self) -> None:
+        """Make this copy the winner of the transfer and cancel the other
+        copies, ``TransferCancelled`` is raised if another copy won."""
+        with self._transfer.lock:
+            self.check()
+            self._transfer.winner = self
+            for attempt in self._transfer.attempts:
+                if attempt is not self:
+                    attempt.cancelled = True
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Context manager to write data shared by the copies, another copy
+        can't win in the meantime."""
+        with self._transfer.lock:
+            self.check()
+            yield
+
+    def watch(self, progress: Callable[[int], None]) -> Callable[[int], None]:
+        """Get a progress callback that cancels the transfer if another copy
+        won and calls ``progress``."""
+
+        def callback(size: int) -> None:
+            self.check()
+            progress(size)
+
+        return callback
+
+    def guard(self, file: BinaryIO) -> "_GuardedFile":
+        """Get a wrapper of the file that stops writing to it once another
+        copy won."""
+        return _GuardedFile(file, self)
+
+
+class _GuardedFile:
+    def __init__(self, file: BinaryIO, attempt: Attempt) -> None:
+        self.file = file
+        self.attempt = attempt
+
+    def write(self, data: bytes) -> int:
+        with self.attempt.exclusive():
+            return self.file.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class _Transfer:
+    def __init__(self, func: Callable[[Attempt], Any], size: Optional[int]) -> None:
+        self.func = func
+        self.size = size
+        self.future: Future = Future()
+        self.lock = Lock()
+        self.attempts: List[Attempt] = []
+        self.winner: Optional[Attempt] = None
+        self.started = 0.0
+        self.speculated = False
+
+
+class TransferScheduler:
+    """Run transfers in ``max_workers`` threads, the transfers with higher
+    ``priority`` first and the largest first among them.
+
+    The result of every transfer is set in the future returned by
+    ``submit()`` as soon as it finishes, so the results can be used out of
+    order with ``concurrent.futures.as_completed()``.
+
+    Once there are no more transfers waiting, the idle threads run a second
+    copy of the stragglers: the running transfers that take ``slowdown``
+    times longer than expected (and at least ``min_duration`` seconds)
+    according to the median speed of the finished transfers, once
+    ``min_finished`` of them finished. The copy that finishes first wins,
+    see ``Attempt``.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        slowdown: float = 4.0,
+        min_finished: int = 3,
+        min_duration: float = 5.0,
+        interval: float = 1.0,
+    ) -> None:
+        self.max_workers = max_workers
+        self.slowdown = slowdown
+        self.min_finished = min_finished
+        self.min_duration = min_duration
+        self.interval = interval
+        self._cond = Condition()
+        self._queue: list = []
+        self._counter = itertools.count()
+        self._running: List[_Transfer] = []
+        self._durations: List[float] = []
+        self._speeds: List[float] = []
+        self._workers: List[Thread] = []
+        self._closed = False
+
+    def submit(
+        self, func: Callable[[Attempt], Any], size: int = None, priority: int = 0
+    ) -> Future:
+        """Schedule the transfer ``func(attempt)`` of ``size`` bytes (if
+        known) and return the future of its result."""
+        transfer = _Transfer(func, size)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Can't submit transfers after shutdown")
+            heapq.heappush(
+                self._queue, (-priority, -(size or 0), next(self._counter), transfer)
+            )
+            if len(self._workers) < self.max_workers:
+                worker = Thread(target=self._work, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            self._cond.notify()
+        return transfer.future
+
+    def shutdown(self) -> None:
+        """Wait until all the transfers finished.
+
+        The cancelled copies of the transfers may still be running, they stop
+        in the background once they notice it.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while self._queue or self._running:
+                self._cond.wait()
+
+    def __enter__(self) -> "TransferScheduler":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    speculative = False
+                    if self._queue:
+                        transfer = heapq.heappop(self._queue)[-1]
+                        transfer.started = time.monotonic()
+                        self._running.append(transfer)
+                        break
+                    if self._closed and not self._running:
+                        return
+                    transfer = self._straggler()  # type: ignore
+                    if transfer:
+                        speculative = transfer.speculated = True
+                        break
+                    self._cond.wait(self.interval)
+                attempt = Attempt(transfer, speculative)
+                with transfer.lock:
+                    transfer.attempts.append(attempt)
+            self._run(transfer, attempt)
+
+    def _run(self, transfer: _Transfer, attempt: Attempt) -> None:
+        result = error = None
+        try:
+            result = transfer.func(attempt)
+        except TransferCancelled:
+            pass
+        except BaseException as err:  # pylint: disable=W0703
+            error = err
+        with self._cond:
+            with transfer.lock:
+                transfer.attempts.remove(attempt)
+                won = transfer.winner is attempt
+                last = not transfer.attempts and transfer.winner is None
+            if transfer.future.done() or not (won or last):
+                return
+            self._running.remove(transfer)
+            self._cond.notify_all()
+            if won and not attempt.speculative:
+                duration = time.monotonic() - attempt.started
+                self._durations.append(duration)
+                if transfer.size:
+                    self._speeds.append(transfer.size / max(duration, 1e-6))
+        if error is None:
+            transfer.future.set_result(result)
+        else:
+            transfer.future.set_exception(error)
+
+    def _straggler(self) -> Optional[_Transfer]:
+        if len(self._durations) < self.min_finished:
+            return None
+        duration = statistics.median(self._durations)
+        speed = statistics.median(self._speeds) if self._speeds else 0
+        now = time.monotonic()
+        for transfer in self._running:
+            if transfer.speculated:
+                continue
+            expected = transfer.size / speed if transfer.size and speed else duration
+            if now - transfer.started > max(
+                self.slowdown * expected, self.min_duration
+            ):
+                return transfer
+        return None
@@ -0,0 +1,167 @@
+"""Raw file split support.
+
+Files are split in byte ranges uploaded directly from the original file,
+a manifest with the order, size and SHA-256 of the parts allows to
+reassemble them.
+"""
+
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+MANIFEST_EXT = ".manifest.json"
+_SAMPLES = 8
+_SAMPLE_SIZE = 64 * 1024
+
+
+class FileRange:
+    """Read-only file object for a byte range of a file.
+
+    The data is read with ``os.pread()`` (without moving any shared file
+    position) and hashed as it is read, see ``hexdigest()``.
+    """
+
+    def __init__(self, path: str, offset: int, size: int) -> None:
+        self.name = path
+        self.offset = offset
+        self.size = size
+        self._pos = 0
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+        self._fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.size - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        if hasattr(os, "pread"):
+            data = os.pread(self._fd, size, self.offset + self._pos)
+        else:
+            os.lseek(self._fd, self.offset + self._pos, os.SEEK_SET)
+            data = os.read(self._fd, size)
+        if self._pos <= self._hashed < self._pos + len(data):
+            self._hash.update(data[self._hashed - self._pos :])
+            self._hashed = self._pos + len(data)
+        self._pos += len(data)
+        return data
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def hexdigest(self) -> str:
+        """SHA-256 of the data read so far from the start of the range,
+        data read again after seeking back is not hashed twice."""
+        return self._hash.hexdigest()
+
+    def close(self) -> None:
+        if self._fd != -1:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> "FileRange":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def file_sha256(path: str, offset: int, size: int, block_size: int = 1 << 20) -> str:
+    """Get the SHA-256 of the given byte range of a file."""
+    with FileRange(path, offset, size) as file:
+        while file.read(block_size):
+            pass
+        return file.hexdigest()
+
+
+def content_fingerprint(path: str) -> str:
+    """Get the SHA-256 of the size and of a few samples spread over the given
+    file (including its start and end), to detect a file rewritten in place
+    without reading it whole."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    step = max(size // _SAMPLES, _SAMPLE_SIZE)
+    offsets = list(range(0, size, step)) + [max(size - _SAMPLE_SIZE, 0)]
+    with open(path, "rb") as file:
+        for offset in offsets:
+            file.seek(offset)
+            digest.update(file.read(_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def split_ranges(size: int, part_size: int) -> List[Tuple[int, int]]:
+    """Get the (offset, size) of the parts of a file of the given size."""
+    return [
+        (offset, min(part_size, size - offset)) for offset in range(0, size, part_size)
+    ] or [(0, 0)]
+
+
+def new_manifest(path: str, part_size: int) -> dict:
+    """Create the manifest to split the given file.
+
+    The parts are named ``<name>.0001``, ``<name>.0002``, etc. so they can
+    also be joined with ``cat``, their ``sha256`` and ``url`` are set when
+    they are uploaded. The modification time and ``content_fingerprint()``
+    of the file are kept to detect if it changes before all the parts are
+    uploaded, see ``is_same_source()``.
+    """
+    name = os.path.basename(path)
+    stat = os.stat(path)
+    size = stat.st_size
+    return dict(
+        name=name,
+        size=size,
+        part_size=part_size,
+        mtime_ns=stat.st_mtime_ns,
+        fingerprint=content_fingerprint(path),
+        parts=[
+            dict(
+                name=f"{name}.{index:04}",
+                offset=offset,
+                size=part,
+                sha256=None,
+                url=None,
+            )
+            for index, (offset, part) in enumerate(split_ranges(size, part_size), 1)
+        ],
+    )
+
+
+def is_same_source(manifest: dict, other: dict) -> bool:
+    """Check if the given manifests split the same file, unchanged, in the
+    same parts."""
+    keys = ("name", "size", "part_size", "mtime_ns", "fingerprint")
+    return all(manifest.get(key) == other.get(key) for key in keys)
+
+
+def find_manifest(path: str) -> Optional[str]:
+    """Get the manifest for the given manifest or uploads txt path, if any."""
+    if path.endswith(MANIFEST_EXT):
+        return path
+    if path.endswith(".txt"):
+        manifest = path[: -len(".txt")] + MANIFEST_EXT
+        if os.path.exists(manifest):
+            return manifest
+    return None
+
+
+def load_manifest(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(path: str, manifest: dict) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f"{path}.tmp", path)
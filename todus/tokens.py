@@ -0,0 +1,84 @@
+"""Access tokens cache."""
+
+import json
+import os
+import time
+from threading import Lock
+from typing import Callable, Optional
+
+from .util import file_lock, token_payload
+
+
+class TokenCache:
+    """Cache of the accounts access tokens stored in a JSON file.
+
+    Tokens are reused, also by other processes using the same file, until
+    ``margin`` seconds before they expire (the JWT ``exp`` claim). Refreshes
+    are single-flight: concurrent threads and processes wait for the one
+    refreshing the token and reuse its result.
+    """
+
+    def __init__(self, path: str, margin: int = 300, min_age: int = 60) -> None:
+        self.path = path
+        self.margin = margin
+        self.min_age = min_age
+        self._lock = Lock()
+
+    def get(self, phone: str) -> Optional[str]:
+        """Get the cached token of the given account if it is not about to
+        expire."""
+        entry = self._load().get(phone)
+        if entry and self._is_valid(entry):
+            return entry["token"]
+        return None
+
+    def fetch(self, phone: str, login: Callable[[], str], stale: str = None) -> str:
+        """Get a valid token for the given account, calling ``login()`` to get
+        a new one if needed.
+
+        ``stale`` is a token rejected by the server, a new token is fetched
+        if the cache still has it unless it was fetched less than
+        ``min_age`` seconds ago (another thread or process just refreshed it).
+        """
+        token = self.get(phone)
+        if token and token != stale:
+            return token
+        with self._lock, file_lock(self.path):
+            entry = self._load().get(phone)
+            if entry and self._is_valid(entry):
+                recent = time.time() - entry["time"] < self.min_age
+                if entry["token"] != stale or recent:
+                    return entry["token"]
+            token = login()
+            try:
+                exp = float(token_payload(token)["exp"])
+            except Exception:  # unknown expiration, don't reuse it later
+                exp = 0
+            entries = self._load()
+            entries[phone] = dict(token=token, exp=exp, time=time.time())
+            self._save(entries)
+            return token
+
+    def remove(self, phone: str) -> None:
+        """Remove the cached token of the given account."""
+        with self._lock, file_lock(self.path):
+            entries = self._load()
+            if entries.pop(phone, None):
+                self._save(entries)
+
+    def _is_valid(self, entry: dict) -> bool:
+        return entry["exp"] - self.margin > time.time()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries: dict) -> None:
+        temp_path = f"{self.path}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,118 @@
+"""HTTP connection pooling for the transfers."""
+
+import socket
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool, PoolManager
+
+SocketOption = Tuple[int, int, int]
+
+
+class ConnectionStats:
+    """Number of HTTP requests sent over new and reused connections."""
+
+    def __init__(self) -> None:
+        self.opened = 0
+        self.reused = 0
+        self._lock = Lock()
+
+    def count(self, opened: bool) -> None:
+        with self._lock:
+            if opened:
+                self.opened += 1
+            else:
+                self.reused += 1
+
+    def __repr__(self) -> str:
+        return f"ConnectionStats(opened={self.opened}, reused={self.reused})"
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    stats: Optional[ConnectionStats] = None
+
+    def _make_request(self, conn, *args, **kwargs):  # type: ignore
+        if self.stats is not None:
+            # the connection is opened by the request if it has no socket
+            self.stats.count(getattr(conn, "sock", None) is None)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(_CountingHTTPConnectionPool, HTTPSConnectionPool):
+    pass
+
+
+class _CountingPoolManager(PoolManager):
+    def __init__(self, stats: ConnectionStats, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):  # type: ignore
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        return pool
+
+
+def socket_options(
+    tcp_nodelay: bool = True,
+    keepalive: bool = True,
+    send_buffer: int = None,
+    recv_buffer: int = None,
+) -> List[SocketOption]:
+    """Get the options for the sockets of the HTTP connections.
+
+    ``tcp_nodelay`` disables Nagle's algorithm (urllib3 does it by default),
+    ``keepalive`` enables TCP keep-alive probes so dead connections waiting
+    in the pool are detected. ``send_buffer`` and ``recv_buffer`` set the
+    socket buffer sizes, note that setting them disables the automatic
+    tuning of the buffers done by some systems.
+    """
+    options = []
+    if tcp_nodelay:
+        options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    if keepalive:
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if send_buffer:
+        options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer))
+    if recv_buffer:
+        options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer))
+    return options
+
+
+class PoolAdapter(HTTPAdapter):
+    """HTTP adapter keeping up to ``pool_size`` connections per host for
+    reuse.
+
+    The sockets are created with the given ``options`` (see
+    ``socket_options()``) and the requests sent over new and reused
+    connections are counted in ``stats``.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        options: List[SocketOption] = None,
+        **kwargs,
+    ) -> None:
+        self.stats = ConnectionStats()
+        self.options = socket_options() if options is None else options
+        super().__init__(pool_maxsize=pool_size, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):  # type: ignore
+        # save these values for pickling
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _CountingPoolManager(
+            self.stats,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            socket_options=self.options,
+            **pool_kwargs,
+        )
@@ -1,6 +1,16 @@
+import json
+import os
 import random
 import re
 import string
+from base64 import urlsafe_b64decode
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
 
 
 def generate_token(length: int) -> str:
@@ -15,3 +25,26 @@ def normalize_phone_number(phone_number: str) -> str:
     match = re.match(r"(53)?(\d{8})", phone_number)
     assert match, "Invalid phone number"
     return "53" + match.group(2)
+
+
+def token_payload(token: str) -> dict:
+    """Decode the payload of the given JWT access token (not verified)."""
+    payload = token.split(".")[1]
+    return json.loads(urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Lock the given file for other processes, using ``<path>.lock``.
+
+    The lock is not supported on Windows.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
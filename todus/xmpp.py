@@ -0,0 +1,496 @@
+"""Persistent session with the ToDus XMPP server."""
+
+import functools
+import itertools
+import logging
+import re
+import socket
+import ssl
+import time
+from base64 import b64encode
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Event, Lock, Thread
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import unescape
+
+from .errors import EndOfStreamError, TokenExpiredError
+from .metrics import Metrics
+from .util import generate_token, token_payload
+
+_BUFFERSIZE = 64 * 1024
+_HOST = ("im.todus.cu", 1756)
+_STREAM_START = b"<stream:stream xmlns='jc' o='im.todus.cu' xmlns:stream='x1' v='1.0'>"
+_TAG = re.compile(rb"<(/?)([^\s/>]+)((?:[^>'\"]|'[^']*'|\"[^\"]*\")*)>")
+_ATTR = re.compile(r"([^\s=]+)\s*=\s*(?:'([^']*)'|\"([^\"]*)\")")
+_ENTITIES = {"&apos;": "'", "&quot;": '"'}
+_XMLNS = re.compile(r"xmlns='([^']*)'")
+
+
+class Stanza:
+    """Complete top-level XMPP element.
+
+    ``children`` holds the (tag, attributes) pairs of all the nested elements
+    in document order.
+    """
+
+    __slots__ = ("tag", "attrs", "children", "raw")
+
+    def __init__(self, tag: str, attrs: dict, children: list, raw: bytes) -> None:
+        self.tag = tag
+        self.attrs = attrs
+        self.children = children
+        self.raw = raw
+
+    def find(self, tag: str) -> Optional[dict]:
+        """Return the attributes of the first nested element with the given tag."""
+        for child_tag, attrs in self.children:
+            if child_tag == tag:
+                return attrs
+        return None
+
+    def __repr__(self) -> str:
+        return f"<Stanza {self.raw.decode(errors='replace')}>"
+
+
+class StanzaParser:
+    """Incremental XMPP stream parser.
+
+    Bytes are fed as they are received, in chunks of any size, and the complete
+    top-level stanzas are returned with their attributes already parsed.
+    Stanzas are only decoded once complete so multi-byte characters split
+    across reads are handled.
+    """
+
+    def __init__(self) -> None:
+        self.closed = False
+        self._buffer = bytearray()
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._elements: list = []
+
+    def feed(self, data: bytes) -> List[Stanza]:
+        """Add received data and return the stanzas completed by it."""
+        buffer = self._buffer
+        buffer += data
+        stanzas = []
+        pos = self._pos
+        for match in _TAG.finditer(buffer, pos):
+            start, pos = match.span()
+            closing, name, rest = match.groups()
+            if name[:1] in (b"?", b"!"):
+                continue
+            if closing:
+                if self._depth == 0:
+                    self.closed = True
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    stanzas.append(self._stanza(buffer, pos))
+                continue
+
+            tag = name.decode()
+            attrs = _parse_attrs(rest.decode())
+            if tag == "stream:stream":
+                stanzas.append(Stanza(tag, attrs, [], bytes(buffer[start:pos])))
+                continue
+            if self._depth == 0:
+                self._start = start
+                self._elements = [(tag, attrs)]
+            else:
+                self._elements.append((tag, attrs))
+            if not rest.endswith(b"/"):
+                self._depth += 1
+            elif self._depth == 0:
+                stanzas.append(self._stanza(buffer, pos))
+
+        # drop the consumed data, keeping the incomplete stanza if any
+        if self._depth:
+            consumed, self._start = self._start, 0
+        else:
+            consumed = pos
+        del buffer[:consumed]
+        self._pos = pos - consumed
+        return stanzas
+
+    def _stanza(self, buffer: bytearray, end: int) -> Stanza:
+        tag, attrs = self._elements[0]
+        return Stanza(tag, attrs, self._elements[1:], bytes(buffer[self._start : end]))
+
+
+class XMPPSession:
+    """Long-lived authenticated XMPP connection.
+
+    The connection is opened lazily on the first query and reused for all the
+    following queries, whitespace keepalives are sent while it is idle.
+
+    Queries are pipelined: many threads can have IQs in flight on the same
+    stream, a reader thread routes every response back to its caller by IQ id.
+    At most ``max_queries`` queries are sent concurrently.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        max_queries: int = 8,
+        timeout: float = 15,
+        keepalive: float = 60,
+        logger: logging.Logger = logging,  # type: ignore
+        metrics: Metrics = None,
+    ) -> None:
+        self.token = token
+        self.max_queries = max_queries
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.logger = logger
+        self.metrics = metrics or Metrics()
+        self.phone, self._authstr = _parse_token(token)
+        self._sid = generate_token(5)
+        self._ids = itertools.count(1)
+        self._queries = BoundedSemaphore(max_queries)
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._socket: Optional[ssl.SSLSocket] = None
+        self._pending: Dict[str, Future] = {}
+        self._last_activity = 0.0
+        self._closed = Event()
+        self._keepalive_thread: Optional[Thread] = None
+
+    @property
+    def connected(self) -> bool:
+        """True if the XMPP stream is open."""
+        return self._socket is not None
+
+    def _next_id(self) -> str:
+        return f"{self._sid}-{next(self._ids)}"
+
+    def _send(self, sock: ssl.SSLSocket, data: bytes) -> None:
+        with self._send_lock:
+            sock.sendall(data)
+            self._last_activity = time.monotonic()
+
+    @staticmethod
+    def _read(sock: ssl.SSLSocket, parser: StanzaParser) -> List[Stanza]:
+        return _feed(parser, sock.recv(_BUFFERSIZE))
+
+    def _connect(self) -> None:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        with self.metrics.timer("xmpp.connect"):
+            raw_sock = socket.create_connection(_HOST, self.timeout)
+        try:
+            with self.metrics.timer("xmpp.tls"):
+                sock = context.wrap_socket(raw_sock)
+        except Exception:
+            raw_sock.close()
+            raise
+        try:
+            self._send(sock, _STREAM_START)
+            parser = StanzaParser()
+            self._negotiate(sock, parser)
+        except Exception:
+            sock.close()
+            raise
+        self.logger.debug("XMPP session started for %s", self.phone)
+
+        # responses are awaited with the query timeout, the reader blocks
+        sock.settimeout(None)
+        self._socket = sock
+        self._pending = {}
+        Thread(
+            target=self._read_loop, args=(sock, parser, self._pending), daemon=True
+        ).start()
+        if not self._keepalive_thread:
+            self._keepalive_thread = Thread(target=self._keepalive_loop, daemon=True)
+            self._keepalive_thread.start()
+
+    def _negotiate(self, sock: ssl.SSLSocket, parser: StanzaParser) -> None:
+        """Authenticate and bind the stream."""
+        bind_id = self._next_id()
+        started = time.perf_counter()
+        while True:
+            for stanza in self._read(sock, parser):
+                reply = _negotiation_reply(
+                    stanza, self._authstr, bind_id, self._next_id
+                )
+                if reply:
+                    self._send(sock, reply)
+                if stanza.tag in ("ok", "ed"):
+                    now = time.perf_counter()
+                    phase = "xmpp.auth" if stanza.tag == "ok" else "xmpp.bind"
+                    self.metrics.emit(phase, duration=now - started)
+                    started = now
+                if stanza.tag == "ed":
+                    return
+
+    def _disconnect(self, sock: ssl.SSLSocket) -> None:
+        """Close the given socket if it is still the active connection."""
+        with self._lock:
+            if self._socket is not sock:
+                return
+            self._socket = None
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def _read_loop(
+        self, sock: ssl.SSLSocket, parser: StanzaParser, pending: Dict[str, Future]
+    ) -> None:
+        try:
+            while True:
+                for stanza in self._read(sock, parser):
+                    if stanza.tag != "iq":
+                        continue
+                    future = pending.pop(stanza.attrs.get("i", ""), None)
+                    if future and future.set_running_or_notify_cancel():
+                        future.set_result(stanza)
+        except Exception as err:  # noqa
+            self._disconnect(sock)
+            for iq_id in list(pending):
+                future = pending.pop(iq_id, None)
+                if future and future.set_running_or_notify_cancel():
+                    future.set_exception(err)
+
+    def _keepalive_loop(self) -> None:
+        while not self._closed.wait(self.keepalive / 2):
+            sock = self._socket
+            idle = time.monotonic() - self._last_activity
+            if not sock or idle < self.keepalive:
+                continue
+            try:
+                self._send(sock, b" ")
+            except OSError as err:
+                self.logger.debug("XMPP keepalive failed: %s", err)
+                self._disconnect(sock)
+
+    def close(self, wait: bool = False) -> None:
+        """Close the XMPP stream and stop sending keepalives.
+
+        If ``wait`` is ``True`` the queries in flight get their responses (or
+        time out) before the stream is closed.
+        """
+        acquired = 0
+        if wait:
+            # every query in flight holds a slot until it is done
+            deadline = time.monotonic() + self.timeout
+            while acquired < self.max_queries and self._queries.acquire(
+                timeout=max(deadline - time.monotonic(), 0)
+            ):
+                acquired += 1
+        try:
+            self._closed.set()
+            sock = self._socket
+            if sock:
+                try:
+                    self._send(sock, b"</stream:stream>")
+                except OSError:
+                    pass
+                self._disconnect(sock)
+        finally:
+            for _ in range(acquired):
+                self._queries.release()
+
+    def query(self, query: str) -> Stanza:
+        """Send an IQ with the given query and return the server's response.
+
+        If the stream is broken it is reopened and the query is retried once.
+        If there is no response in ``timeout`` seconds ``TimeoutError`` is
+        raised, the stream is kept open for the other queries. If the token
+        is rejected ``TokenExpiredError`` is raised, to refresh it.
+        """
+        try:
+            return self._submit(query)()
+        except TimeoutError:
+            raise
+        except (EndOfStreamError, OSError) as err:
+            self.logger.debug("XMPP session lost, reconnecting: %r", err)
+            return self._submit(query)()
+
+    def query_many(self, queries: Iterable[str]) -> Iterator[Stanza]:
+        """Send the given queries back-to-back and yield the responses in order.
+
+        Up to ``max_queries`` queries are sent ahead of the response being
+        yielded, failed queries are retried like in ``query()``.
+        """
+        window: Deque[Tuple[str, Callable[[], Stanza]]] = deque()
+        for query in queries:
+            if len(window) >= self.max_queries:
+                yield self._collect(*window.popleft())
+            window.append((query, self._submit(query)))
+        while window:
+            yield self._collect(*window.popleft())
+
+    def _collect(self, query: str, wait: Callable[[], Stanza]) -> Stanza:
+        try:
+            return wait()
+        except TimeoutError:
+            raise
+        except (EndOfStreamError, OSError) as err:
+            self.logger.debug("XMPP session lost, reconnecting: %r", err)
+            return self.query(query)
+
+    def _submit(self, query: str) -> Callable[[], Stanza]:
+        """Send an IQ and return a function to wait for its response."""
+        if self._closed.is_set():
+            raise EndOfStreamError()
+        self._queries.acquire()
+        try:
+            if self._closed.is_set():  # closed while waiting for a slot
+                raise EndOfStreamError()
+            with self._lock:
+                if not self._socket:
+                    self._connect()
+                assert self._socket
+                sock: ssl.SSLSocket = self._socket
+                pending = self._pending
+            iq_id = self._next_id()
+            future: Future = Future()
+            future.add_done_callback(lambda _: self._queries.release())
+        except BaseException:
+            self._queries.release()
+            raise
+
+        pending[iq_id] = future
+        if self.metrics.hooks:
+            future.add_done_callback(
+                functools.partial(_emit_iq, self.metrics, query, time.perf_counter())
+            )
+        try:
+            self._send(sock, f"<iq i='{iq_id}' t='get'>{query}</iq>".encode())
+        except OSError:
+            self._disconnect(sock)
+            future.cancel()
+            raise
+
+        def wait() -> Stanza:
+            try:
+                return future.result(self.timeout)
+            except FutureTimeoutError as err:
+                if not future.cancel():  # the response arrived just now
+                    return future.result()
+                # only this query fails, the stream is closed on read errors
+                raise TimeoutError(f"No response to IQ {iq_id!r}") from err
+            finally:
+                pending.pop(iq_id, None)
+
+        return wait
+
+    def reserve_url(self, filesize: int, file_type: int) -> tuple:
+        """Reserve an upload URL, returns an (upload URL, download URL) tuple."""
+        return _parse_purl(self.query(_purl_query(filesize, file_type)))
+
+    def reserve_urls(self, sizes: Iterable[int], file_type: int) -> Iterator[tuple]:
+        """Reserve upload URLs for files of the given sizes.
+
+        The (upload URL, download URL) tuples are yielded in the same order.
+        """
+        queries = (_purl_query(size, file_type) for size in sizes)
+        for response in self.query_many(queries):
+            yield _parse_purl(response)
+
+    def resolve_url(self, url: str) -> str:
+        """Get the signed download URL of the given file URL."""
+        return _parse_gurl(self.query(_gurl_query(url)))
+
+    def resolve_urls(self, urls: Iterable[str]) -> Iterator[str]:
+        """Get the signed download URLs of the given file URLs, in the same order."""
+        for response in self.query_many(_gurl_query(url) for url in urls):
+            yield _parse_gurl(response)
+
+
+def _feed(parser: StanzaParser, data: bytes) -> List[Stanza]:
+    """Parse the data received from the server, raising an error if the
+    stream ended or the token was rejected."""
+    if not data:
+        raise EndOfStreamError()
+    stanzas = parser.feed(data)
+    for stanza in stanzas:
+        if stanza.find("not-authorized") is not None:
+            raise TokenExpiredError()
+    if parser.closed:
+        raise EndOfStreamError()
+    return stanzas
+
+
+def _negotiation_reply(
+    stanza: Stanza, authstr: bytes, bind_id: str, next_id: Callable[[], str]
+) -> Optional[bytes]:
+    """Get the reply to the given stanza while authenticating and binding the
+    stream, the negotiation ends with the ``ed`` stanza."""
+    if stanza.tag == "stream:features":
+        if stanza.find("es") is not None:
+            return b"<ah xmlns='ah:ns' e='PLAIN'>" + authstr + b"</ah>"
+        if stanza.find("b1") is not None:
+            return f"<iq i='{bind_id}' t='set'><b1 xmlns='x4'></b1></iq>".encode()
+    elif stanza.tag == "ok":
+        return _STREAM_START
+    elif stanza.tag == "iq" and stanza.attrs.get("i") == bind_id:
+        return b"<en xmlns='x7' u='true' max='300'/>"
+    elif stanza.tag == "ed":
+        return f"<p i='{next_id()}'></p>".encode()
+    return None
+
+
+def _emit_iq(metrics: Metrics, query: str, started: float, future: Future) -> None:
+    match = _XMLNS.search(query)
+    fields = dict(query=match.group(1) if match else "")
+    if future.cancelled():  # timed out or failed to send
+        fields["error"] = "CancelledError"
+    elif future.exception():
+        fields["error"] = type(future.exception()).__name__
+    metrics.emit("xmpp.iq", duration=time.perf_counter() - started, **fields)
+
+
+def _purl_query(filesize: int, file_type: int) -> str:
+    return (
+        f"<query xmlns='todus:purl' type='{file_type}' persistent='false'"
+        f" size='{filesize}' room=''></query>"
+    )
+
+
+def _parse_purl(response: Stanza) -> tuple:
+    query = response.find("query")
+    assert query and "put" in query, f"Unexpected response: {response}"
+    return (query["put"], query["get"])
+
+
+def _gurl_query(url: str) -> str:
+    return f"<query xmlns='todus:gurl' url='{url}'></query>"
+
+
+def _parse_gurl(response: Stanza) -> str:
+    query = response.find("query")
+    assert (
+        query and query.get("status") == "200" and "du" in query
+    ), f"Unexpected response: {response}"
+    return query["du"]
+
+
+def _parse_attrs(data: str) -> dict:
+    attrs = {}
+    for name, value1, value2 in _ATTR.findall(data):
+        value = value1 or value2
+        attrs[name] = unescape(value, _ENTITIES) if "&" in value else value
+    return attrs
+
+
+def _is_newer_token(token: str, current: str) -> bool:
+    """Check if ``token`` expires after ``current`` (the JWT ``exp`` claim),
+    a token of another account is always considered newer."""
+    try:
+        new, old = token_payload(token), token_payload(current)
+        if new["username"] != old["username"]:
+            return True
+        return float(new["exp"]) > float(old["exp"])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return token != current
+
+
+def _parse_token(token: str) -> tuple:
+    phone = token_payload(token)["username"]
+    authstr = b64encode((chr(0) + phone + chr(0) + token).encode("utf-8"))
+    return phone, authstr